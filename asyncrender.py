@@ -0,0 +1,127 @@
+
+import concurrent.futures, traceback
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+
+class AsyncRenderer(QtCore.QObject):
+
+  '''Renders frames of a QGraphicsScene into QImages on a worker thread.
+
+  Each request() starts a new generation.  Only one frame is rendered at a time; a frame
+  whose generation is superseded while it is being rendered is abandoned (items that support it
+  give up part way through painting), and the latest request is rendered next instead.
+  frameReady is emitted, on the thread this object lives in, whenever a frame is finished.
+
+  The scene must only be read on the GUI thread, so each frame is prepared there:
+  items with a snapshot() method return a copy of their painting state to be painted on the worker
+  thread, and the paint() of any other visible item is recorded into a QPicture to be replayed.
+  A snapshot with a finish() method has it called back on this object's thread once the frame is done with.
+  '''
+
+  frameReady = QtCore.pyqtSignal()
+  _finished = QtCore.pyqtSignal(int, object, object)   # (generation, (QImage, transform) or None if abandoned, snapshots)
+
+  def __init__(self, scene, parent=None):
+    super().__init__(parent)
+    self._scene = scene
+    self._generation = 0
+    self._pending = None      # the latest request not yet started: (size, dpr, transform, antialias)
+    self._busy = False
+    self._frame = None        # the latest finished frame: (QImage, transform)
+    self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    self._finished.connect(self.onFinished)
+
+  def generation(self):
+    return self._generation
+
+  def frame(self):
+    'Return the latest finished (QImage, scene-to-image QTransform), or None.'
+    return self._frame
+
+  def request(self, size, dpr, xf, antialias=True):
+    '''Ask for a frame of `size` device-independent pixels at device pixel ratio `dpr`, showing the scene
+    mapped through QTransform `xf`.  Any frame being rendered for an earlier request is abandoned.'''
+    self._generation += 1
+    self._pending = (QtCore.QSize(size), dpr, QtGui.QTransform(xf), antialias)
+    if not self._busy:
+      self.startPending()
+
+  def startPending(self):
+    (size, dpr, xf, antialias) = self._pending
+    self._pending = None
+    gen = self._generation
+    rect = xf.inverted()[0].mapRect(QtCore.QRectF(QtCore.QPointF(0,0), QtCore.QSizeF(size)))
+    background = QtGui.QBrush(self._scene.backgroundBrush())
+    layers = []                     # (scene transform, opacity, paint function) of each item, bottom first
+    snapshots = []
+    for item in self._scene.items(QtCore.Qt.AscendingOrder):
+      if not item.isVisible():
+        continue
+      ixf = item.sceneTransform()
+      exposed = ixf.inverted()[0].mapRect(rect).intersected(item.boundingRect())
+      if exposed.isEmpty():
+        continue
+      option = QtWidgets.QStyleOptionGraphicsItem()
+      option.exposedRect = exposed
+      if hasattr(item, 'snapshot'):
+        snap = item.snapshot()
+        snap._isStale = lambda: gen != self._generation
+        snapshots.append(snap)
+        paint = lambda painter, snap=snap, option=option: snap.paint(painter, option, None)
+      else:
+        picture = QtGui.QPicture()
+        p = QtGui.QPainter(picture)
+        p.setRenderHint(QtGui.QPainter.Antialiasing, antialias)
+        item.paint(p, option, None)
+        p.end()
+        paint = lambda painter, picture=picture: picture.play(painter)
+      layers.append((QtGui.QTransform(ixf), item.effectiveOpacity(), paint))
+    self._busy = True
+    self._pool.submit(self.render, gen, size, dpr, xf, antialias, rect, background, layers, snapshots)
+
+  def render(self, gen, size, dpr, xf, antialias, rect, background, layers, snapshots):
+    'Paint the prepared layers into a new QImage.  Called on the worker thread.'
+    img = None
+    try:
+      img = QtGui.QImage(size * dpr, QtGui.QImage.Format_ARGB32_Premultiplied)
+      img.setDevicePixelRatio(dpr)
+      img.fill(QtCore.Qt.transparent)
+      painter = QtGui.QPainter(img)
+      painter.setRenderHint(QtGui.QPainter.Antialiasing, antialias)
+      painter.setTransform(xf)
+      if background.style() != QtCore.Qt.NoBrush:
+        painter.fillRect(rect, background)
+      for (ixf, opacity, paint) in layers:
+        if gen != self._generation:
+          break
+        painter.save()
+        painter.setTransform(ixf * xf)
+        painter.setOpacity(opacity)
+        paint(painter)
+        painter.restore()
+      painter.end()
+      if gen != self._generation:
+        img = None
+    except Exception:
+      traceback.print_exc()     # (an exception in the worker thread would otherwise go unreported)
+      img = None
+    finally:
+      self._finished.emit(gen, None if img is None else (img, xf), snapshots)
+
+  def onFinished(self, gen, frame, snapshots):
+    self._busy = False
+    for snap in snapshots:
+      if hasattr(snap, 'finish'):
+        snap.finish()
+    if not frame is None:
+      self._frame = frame
+      self.frameReady.emit()
+    if not self._pending is None:
+      self.startPending()
+
+  def shutdown(self):
+    'Abandon any frame being rendered, and wait for the worker thread to finish.'
+    self._generation += 1
+    self._pending = None
+    self._pool.shutdown(wait=True)
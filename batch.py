@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+import argparse, contextlib, io, itertools, json, multiprocessing, os, sys, time
+
+from PyQt5 import QtCore, QtWidgets
+
+import pain
+from rendercache import RenderCache
+
+
+'''
+Rendering many variants of the scene at once, on a pool of worker processes.
+
+Each job is a seed and a list of --set style settings ("layer.param=value", see pain.applySetting()).
+The jobs are every seed combined with every combination of the --sweep values, plus any read from
+a --jobs file.  Each worker process is its own offscreen QApplication, and renders one job at a time,
+single-threaded (the processes are what run in parallel), building a new scene for each job just as
+pain.py --export does, unless the render cache already has it (see rendercache).  Workers can be
+replaced after a number of jobs (--recycle), which bounds how much memory a worker can accumulate.
+
+The outputs are named by job number, and manifest.json in the output directory lists each job's
+file, seed, settings, and time taken (or error), in job order.
+'''
+
+
+def parseSeeds(text):
+  'Parse a list of seeds like "1-10,20,30".'
+  seeds = []
+  for part in text.split(','):
+    (lo, dash, hi) = part.strip().partition('-')
+    try:
+      seeds.extend(range(int(lo), int(hi)+1) if dash else [int(lo)])
+    except ValueError:
+      raise argparse.ArgumentTypeError('expected seeds like 1-10,20,30, not "{}"'.format(text))
+  return seeds
+
+def parseSweep(text):
+  'Parse a sweep "layer.param=v1,v2,..." into a list of settings "layer.param=v1", ....'
+  (name, sep, values) = text.partition('=')
+  if not sep:
+    raise argparse.ArgumentTypeError('expected LAYER.PARAM=V1,V2,..., not "{}"'.format(text))
+  return [ '{}={}'.format(name, v) for v in values.split(',') ]
+
+def makeJobs(seeds, settings, sweeps):
+  '''Return a list of (seed, settings) for each of `seeds` with each combination of one value from each of `sweeps`,
+  each applied after the common `settings`.'''
+  return [ (seed, list(settings) + list(combo)) for seed in seeds for combo in itertools.product(*sweeps) ]
+
+def readJobs(filename):
+  'Read jobs from a JSON file of a list of {"seed": N, "set": ["layer.param=value", ...]} objects.'
+  with open(filename) as f:
+    return [ (job.get('seed'), list(job.get('set', []))) for job in json.load(f) ]
+
+
+qapp = None     # each worker process's QApplication
+
+def initWorker():
+  global qapp
+  os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+  qapp = QtWidgets.QApplication(sys.argv[:1])
+
+def renderJob(job):
+  '''Render one job in a worker process, and return its manifest entry.
+  `job` is (index, seed, settings, (width, height), output filename, render cache directory or None for no cache).'''
+  (index, seed, settings, (w, h), filename, cacheDir) = job
+  entry = { 'index': index, 'file': os.path.basename(filename), 'seed': seed, 'set': settings, 'pid': os.getpid() }
+  t0 = time.perf_counter()
+  try:
+    with contextlib.redirect_stdout(io.StringIO()):   # (the layers print a lot)
+      scene = pain.buildScene(QtCore.QSize(w, h), seed)
+      layers = pain.sceneLayers(scene)
+      for setting in settings:
+        pain.applySetting(layers, setting)
+      pain.exportFile(scene, filename, None if cacheDir is None else RenderCache(cacheDir), threads=1)
+      scene.clear()
+      del layers, scene
+  except Exception as e:
+    entry['error'] = '{}: {}'.format(type(e).__name__, e)
+  entry['seconds'] = round(time.perf_counter() - t0, 3)
+  return entry
+
+def renderBatch(jobs, outdir, size, format='png', workers=None, recycle=None, prefix='pain', cacheDir=None):
+  '''Render each (seed, settings) of `jobs` at `size` (w,h) into directory `outdir` on `workers` processes
+  (default one per CPU), each replaced after rendering `recycle` jobs (default never),
+  using the render cache in `cacheDir` (default none).
+  Write manifest.json there too, and return its list of entries.'''
+  os.makedirs(outdir, exist_ok=True)
+  workers = workers or os.cpu_count() or 1
+  digits = len(str(max(len(jobs) - 1, 0)))
+  tasks = [ (i, seed, settings, size, os.path.join(outdir, '{}-{:0{}d}.{}'.format(prefix, i, digits, format)), cacheDir)
+            for (i, (seed, settings)) in enumerate(jobs) ]
+  print('Rendering {} jobs on {} worker processes...'.format(len(tasks), workers))
+  t0 = time.perf_counter()
+  entries = []
+  # Spawned rather than forked, so that each worker starts Qt from scratch.
+  ctx = multiprocessing.get_context('spawn')
+  with ctx.Pool(workers, initializer=initWorker, maxtasksperchild=recycle) as pool:
+    for entry in pool.imap_unordered(renderJob, tasks):
+      entries.append(entry)
+      print('  {} {} ({:.3f} s){}'.format(len(entries), entry['file'], entry['seconds']
+                                          , ' ' + entry['error'] if 'error' in entry else ''))
+  entries.sort(key=lambda e: e['index'])
+  elapsed = time.perf_counter() - t0
+  manifest = { 'size': list(size), 'workers': workers, 'recycle': recycle, 'seconds': round(elapsed, 3), 'jobs': entries }
+  with open(os.path.join(outdir, 'manifest.json'), 'w') as f:
+    json.dump(manifest, f, indent=1)
+  errors = sum( 'error' in e for e in entries )
+  print('...done, {} jobs in {:.3f} s ({:.2f} per second){}.'.format(len(entries), elapsed, len(entries) / elapsed
+                                                                     , ', {} failed'.format(errors) if errors else ''))
+  return entries
+
+
+def main(argv):
+  ap = argparse.ArgumentParser(description='Render many variants of the scene, on a pool of processes.')
+  ap.add_argument('outdir', help='directory to write the images and manifest.json to')
+  ap.add_argument('--seeds', type=parseSeeds, default=[0], help='seeds to render, like 1-10,20 (default 0)')
+  ap.add_argument('--set', metavar='LAYER.PARAM=VALUE', action='append', default=[], help='a setting for every job, as for pain.py --set')
+  ap.add_argument('--sweep', metavar='LAYER.PARAM=V1,V2,...', type=parseSweep, action='append', default=[]
+                 , help='render each seed with each of these values (and each combination of values of other sweeps)')
+  ap.add_argument('--jobs', metavar='FILE', help='also render the jobs listed in this JSON file: [{"seed": N, "set": [...]}, ...]')
+  ap.add_argument('--size', metavar='WxH', type=pain.parseSize, default=QtCore.QSize(1920,1080), help='size of the images (default 1920x1080)')
+  ap.add_argument('--format', choices=['png', 'svg'], default='png')
+  ap.add_argument('--workers', type=int, help='number of worker processes (default one per CPU)')
+  ap.add_argument('--recycle', metavar='N', type=int, help='replace each worker process after it renders N jobs')
+  ap.add_argument('--cache', metavar='DIR', help='directory of the render cache (default ~/.cache/pain/renders)')
+  ap.add_argument('--no-cache', action='store_true', help='always render, and leave the render cache alone')
+  opts = ap.parse_args(argv[1:])
+  size = (opts.size.width(), opts.size.height())
+  jobs = makeJobs(opts.seeds, opts.set, opts.sweep)
+  if opts.jobs:
+    jobs += readJobs(opts.jobs)
+  cacheDir = None if opts.no_cache else opts.cache or RenderCache().directory()
+  entries = renderBatch(jobs, opts.outdir, size, opts.format, opts.workers, opts.recycle, cacheDir=cacheDir)
+  return 1 if any( 'error' in e for e in entries ) else 0
+
+
+if __name__=='__main__':
+  sys.exit(main(sys.argv))
@@ -0,0 +1,124 @@
+
+import time
+
+
+class CacheNode:
+
+  'One derived, cached quantity: which parameters and other nodes it is computed from, and how.'
+
+  def __init__(self, name, compute, attrs, params=(), deps=(), appendOnly=False):
+    self.name = name
+    self.compute = compute      # callable that computes any missing items of the cached attrs
+    self.attrs = tuple(attrs)   # owner attributes holding the cached values; the first one is sized
+    self.params = tuple(params) # names of parameters this node is directly computed from
+    self.deps = tuple(deps)     # names of nodes this node is directly computed from
+    self.appendOnly = appendOnly  # whether it must be recomputed from scratch when it has too many items
+    self.computeCount = 0
+    self.lastCost = 0.0         # seconds taken by the most recent compute
+    self.totalCost = 0.0
+
+class CacheGraph:
+
+  '''A declared dependency graph of cached quantities of some owner object.
+
+  Setters report which parameters they changed with invalidate(), which clears
+  only the nodes that depend on those parameters (directly or via other nodes).
+  Nothing is recomputed until it is asked for with require(), which first
+  pulls in any nodes it depends on.
+
+  A node is considered up to date when its first attribute is not None and
+  is at least as long as the requested quantity, so compute callables may
+  just compute the missing tail of their arrays.  (The first attribute may
+  also just be an int count of items.)  Nodes whose items can't simply be
+  ignored past the requested quantity are declared appendOnly, and are
+  recomputed from scratch when the quantity shrinks.
+  '''
+
+  def __init__(self, owner):
+    self._owner = owner
+    self._nodes = {}            # nodes in declaration order, which must be dependency order
+
+  def addNode(self, name, compute, attrs, params=(), deps=(), appendOnly=False):
+    for d in deps:
+      assert d in self._nodes, 'node "{}" must be declared after its dependency "{}"'.format(name, d)
+    node = CacheNode(name, compute, attrs, params, deps, appendOnly)
+    self._nodes[name] = node
+    for attr in node.attrs:
+      setattr(self._owner, attr, None)
+    return node
+
+  def node(self, name):
+    return self._nodes[name]
+
+  def nodeNames(self):
+    return list(self._nodes)
+
+  def params(self):
+    'Return the names of all parameters any node is computed from.'
+    names = []
+    for node in self._nodes.values():
+      names.extend(p for p in node.params if not p in names)
+    return names
+
+  def dependents(self, names):
+    'Return the names of the given nodes and all nodes computed from them, in declaration order.'
+    found = set(names)
+    for node in self._nodes.values():
+      if not node.name in found and any(d in found for d in node.deps):
+        found.add(node.name)
+    return [ name for name in self._nodes if name in found ]
+
+  def dirtiedBy(self, *params):
+    'Return the names of the nodes that changing any of the given parameters would invalidate.'
+    return self.dependents([ node.name for node in self._nodes.values()
+                             if any(p in node.params for p in params) ])
+
+  def invalidate(self, *params):
+    'Clear every node that depends on any of the given parameters.  Return the cleared node names.'
+    names = self.dirtiedBy(*params)
+    self.clear(names)
+    return names
+
+  def invalidateAll(self):
+    self.clear(self._nodes)
+
+  def clear(self, names):
+    for name in names:
+      for attr in self._nodes[name].attrs:
+        setattr(self._owner, attr, None)
+
+  def size(self, name):
+    'Return how many items of the given node are currently cached.'
+    value = getattr(self._owner, self._nodes[name].attrs[0])
+    if value is None:
+      return 0
+    elif isinstance(value, int):
+      return value
+    return len(value)
+
+  def require(self, name, quantity):
+    'Ensure the named node (and everything it depends on) has at least `quantity` items computed.'
+    node = self._nodes[name]
+    for d in node.deps:
+      self.require(d, quantity)
+    if node.appendOnly and self.size(name) > quantity:
+      self.clear([name])
+    if self.size(name) < quantity:
+      t0 = time.perf_counter()
+      node.compute()
+      node.lastCost = time.perf_counter() - t0
+      node.totalCost += node.lastCost
+      node.computeCount += 1
+
+  def costs(self):
+    'Return a dict of node name to (compute count, last cost, total cost), with costs in seconds.'
+    return { node.name: (node.computeCount, node.lastCost, node.totalCost) for node in self._nodes.values() }
+
+  def describe(self):
+    'Return a multi-line human-readable summary of the graph and its measured costs.'
+    lines = []
+    for node in self._nodes.values():
+      lines.append('{:14} {:6d} items  {:4d} computes  last {:8.4f} s  total {:8.4f} s  <- {}'.format(
+        node.name, self.size(node.name), node.computeCount, node.lastCost, node.totalCost
+        , ', '.join(node.deps + node.params)))
+    return '\n'.join(lines)
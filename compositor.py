@@ -0,0 +1,84 @@
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+
+class LayerCompositor:
+
+  '''Paints a QGraphicsScene for a view by keeping each item's latest painting in a QImage of its own,
+  at the view's resolution, and blending those images in stacking order.
+
+  An item with a generation() method, which returns a different value whenever it has called update(),
+  is only painted again when that changes, or when it moves or the view does.  (So changing one layer
+  paints only that layer again, and just re-blends the rest.)  Any other item is painted every time.
+  The background is painted again only when the scene's background brush changes.
+
+  This is only for showing the scene in a view:  exports paint every item themselves (see tilerender),
+  or don't paint at all (see svgwriter).
+  '''
+
+  def __init__(self, scene):
+    self._scene = scene
+    self._layers = {}     # item (or the scene, for its background) -> (key, QImage)
+    self._painted = 0     # how many layers were painted (not just blended) by the latest paint()
+
+  def paintedCount(self):
+    return self._painted
+
+  def clear(self):
+    self._layers = {}
+
+  def paint(self, painter, size, dpr, xf, antialias=True, widget=None):
+    '''Paint the scene with `painter` (whose transform maps to the view's pixels), into a view of
+    QSize `size` device-independent pixels at device pixel ratio `dpr`, showing the scene mapped through QTransform `xf`.
+    Each item's paint() is passed `widget`, the view's viewport, as a view would (which tells items such as
+    Confetti that they are being shown, not exported).'''
+    view = (QtCore.QSize(size), dpr, QtGui.QTransform(xf), antialias)
+    rect = xf.inverted()[0].mapRect(QtCore.QRectF(QtCore.QPointF(0,0), QtCore.QSizeF(size)))
+    self._painted = 0
+    layers = {}
+    background = QtGui.QBrush(self._scene.backgroundBrush())
+    if background.style() != QtCore.Qt.NoBrush:
+      def paintBackground(p):
+        p.setTransform(xf)
+        p.fillRect(rect, background)
+      image = self.layer(self._scene, (view, background), view, paintBackground)
+      layers[self._scene] = self._layers[self._scene]
+      painter.drawImage(0, 0, image)
+    for item in self._scene.items(QtCore.Qt.AscendingOrder):
+      if not item.isVisible():
+        continue
+      ixf = item.sceneTransform()
+      exposed = ixf.inverted()[0].mapRect(rect).intersected(item.boundingRect())
+      if exposed.isEmpty():
+        continue
+      def paintItem(p, item=item, ixf=ixf, exposed=exposed):
+        option = QtWidgets.QStyleOptionGraphicsItem()
+        option.exposedRect = exposed
+        p.setTransform(ixf * xf)
+        item.paint(p, option, widget)
+      key = (view, ixf, item.generation()) if hasattr(item, 'generation') else None
+      image = self.layer(item, key, view, paintItem)
+      layers[item] = self._layers[item]
+      painter.save()
+      painter.setOpacity(item.effectiveOpacity())
+      painter.drawImage(0, 0, image)
+      painter.restore()
+    self._layers = layers     # (forgetting any item that wasn't shown)
+
+  def layer(self, item, key, view, paint):
+    '''Return the QImage of `item` painted by paint(painter), painting it again unless `key` is the same as
+    when it was last painted (a key of None meaning it must always be painted again).'''
+    (old, image) = self._layers.get(item, (None, None))
+    if key is None or old != key:
+      (size, dpr, xf, antialias) = view
+      if image is None or image.size() != size * dpr:
+        image = QtGui.QImage(size * dpr, QtGui.QImage.Format_ARGB32_Premultiplied)
+        image.setDevicePixelRatio(dpr)
+      image.fill(QtCore.Qt.transparent)
+      p = QtGui.QPainter(image)
+      p.setRenderHint(QtGui.QPainter.Antialiasing, antialias)
+      paint(p)
+      p.end()
+      self._painted += 1
+    self._layers[item] = (key, image)
+    return image
@@ -6,7 +6,12 @@ import time
 import numpy as np
 from PyQt5 import QtCore, QtGui, QtWidgets, QtSvg
 
+from cachegraph import CacheGraph
+from lod import Detail, LevelOfDetail, LearningLog
 from qmathturtle import RecordingTurtle
+import rasterizer
+from spriteatlas import SpriteAtlas
+import svgwriter
 from widgetutils import addSliderTo
 
 
@@ -125,23 +130,95 @@ LINEAR_DISTRIBUTION = np.array(list(float(SAMPLES - x) for x in range(SAMPLES+1)
 print(INVERSE_DISTRIBUTION)
 print(LINEAR_DISTRIBUTION)
 
+def xform_points(xforms, pts):
+  '''Apply each of the (n,2,3) affine `xforms` to the (v,2) template points `pts`.
+  Returns an (n,v,2) array.  This is one batched matmul rather than n QTransform.map() calls.'''
+  # Row-vector points, so post-multiply by the transpose of each 2x2 linear part, then translate.
+  return np.matmul(pts, xforms[:,:,:2].transpose(0,2,1)) + xforms[:,np.newaxis,:,2]
+
+def qpolygonf_from_array(xy):
+  'Return a QPolygonF of the points in the (v,2) array `xy`, filled by copying memory rather than per point.'
+  data = np.asarray(xy, dtype=np.float64).tobytes()   # QPointF is a pair of doubles
+  poly = QtGui.QPolygonF(len(xy))
+  ptr = poly.data()
+  ptr.setsize(len(data))
+  ptr[:] = data
+  return poly
+
+def hsl_to_rgb(hues, saturations, lightnesses):
+  '''Convert arrays of HSL values (all 0.0 to 1.0) to an (n,3) array of RGB values (0.0 to 1.0).
+  This is the same conversion as QColor.fromHslF(h,s,l).getRgbF(), but for whole arrays at once.'''
+  h = np.asarray(hues, dtype=np.float64)
+  s = np.asarray(saturations, dtype=np.float64)
+  l = np.asarray(lightnesses, dtype=np.float64)
+  t2 = np.where(l < .5, l * (1 + s), l + s - l * s)
+  t1 = 2 * l - t2
+  tcs = np.stack((h + 1/3, h, h - 1/3), axis=-1) % 1.0   # one hue offset per component
+  t1 = t1[..., np.newaxis]
+  t2 = t2[..., np.newaxis]
+  rgb = np.select( [tcs * 6 < 1, tcs * 2 < 1, tcs * 3 < 2]
+                 , [t1 + (t2 - t1) * 6 * tcs, t2, t1 + (t2 - t1) * (2/3 - tcs) * 6]
+                 , t1 )
+  # With no saturation, it's just a gray of the given lightness.
+  return np.where((s == 0)[..., np.newaxis], l[..., np.newaxis], rgb)
+
+def rgbaf_to_rgba8(rgbaf):
+  'Convert an array of 0.0 to 1.0 color components to 8 bit (0 to 255) components, rounding like QColor does.'
+  # QColor stores 16 bits per component (rounded), and rounds them to 8 bits as qt_div_257() does.
+  v = np.rint(np.clip(rgbaf, 0.0, 1.0) * 65535).astype(np.int32)
+  return ((v + 128 - ((v + 128) >> 8)) >> 8).astype(np.uint8)
+
 class Shape:
+  '''A template shape, centered on the origin.
+  Transformed instances are just arrays of points (see xformedPoints()),
+  which are handed back to the template to be painted.'''
   def __init__(self, name):
     self._name = name
+    self._bevel_paths = {}    # width -> inner bevel path
+
+  def bevelPath(self, width):
+    '''Return the part of the template within `width` of its edge, as a QPainterPath in template coordinates.
+    Each is computed once, and then kept.'''
+    path = self._bevel_paths.get(width)
+    if path is None:
+      path = self._bevel_paths[width] = self.computeBevelPath(width)
+    return path
+
+  def computeBevelPath(self, width):
+    outline = QtGui.QPainterPath()
+    self.addTemplateToPath(outline)
+    stroker = QtGui.QPainterPathStroker()
+    stroker.setWidth(width*2)
+    return stroker.createStroke(outline).intersected(outline)
 
 class Polygon(Shape):
   def __init__(self, name, qpolygonf):
     super().__init__(name)
     self._qpolygonf = qpolygonf
-  def transformed(self, xform):
-    return Polygon(self._name, xform.map(self._qpolygonf))
-  def addToPath(self, path):
+    self._vertices = np.array([(p.x(), p.y()) for p in qpolygonf], dtype=np.float64)
+  def xformedPoints(self, xforms):
+    'Return an (n,v,2) array of the vertices transformed by each of the (n,2,3) `xforms`.'
+    return xform_points(xforms, self._vertices)
+  def bounds(self, pts, radii):
+    'Return an (n,4) array of (left, top, right, bottom) of each of the (n,v,2) transformed `pts`.'
+    return np.concatenate((pts.min(axis=1), pts.max(axis=1)), axis=1)
+  def addToPath(self, path, pts, r):
+    path.addPolygon(qpolygonf_from_array(pts))
+    path.closeSubpath()
+  def addTemplateToPath(self, path):
     path.addPolygon(self._qpolygonf)
-  def paint(self, painter):
-    painter.drawPolygon(self._qpolygonf)
-  def paintShadow(self, painter, dx, dy):
-    t = QtGui.QTransform.fromTranslate(dx, dy)
-    painter.drawPolygon(t.map(self._qpolygonf))
+    path.closeSubpath()
+  def paint(self, painter, pts, r):
+    painter.drawPolygon(qpolygonf_from_array(pts))
+  def paintShadow(self, painter, pts, r, dx, dy):
+    painter.drawPolygon(qpolygonf_from_array(pts + (dx, dy)))
+  def rasterOutline(self, pts, radii):
+    'Return a rasterizer outline of the (n,v,2) transformed `pts`.'
+    return rasterizer.PolygonOutline(pts)
+  def svgTemplate(self):
+    'Return an SVG element of the template, with "{id}" for its id (see SvgWriter.define()).'
+    return '<polygon id="{{id}}" points="{}"/>'.format(' '.join( '{},{}'.format(svgwriter.num(x), svgwriter.num(y))
+                                                                 for (x, y) in self._vertices ))
 
 class RegularPolygon(Polygon):
   def __init__(self, name, sides, r, qpolygonf=None):
@@ -152,9 +229,19 @@ class RegularPolygon(Polygon):
     super().__init__(name, qpolygonf=qpolygonf)
   def area(self):
     return self._sides * self._radius**2 * math.sin(2*math.pi/self._sides) / 2
-  def transformed(self, xform):
-    r2 = xform.map(QtCore.QLineF(QtCore.QPointF(0,0), QtCore.QPointF(self._radius, 0))).length()
-    return RegularPolygon(self._name, self._sides, r2, qpolygonf=xform.map(self._qpolygonf))
+  def rasterOutline(self, pts, radii):
+    return rasterizer.ConvexOutline(pts)
+  def computeBevelPath(self, width):
+    # Within a convex polygon, what's within `width` of the edge is just what's outside the polygon inset by `width`.
+    # (QPainterPath.intersected() is also unreliable for some squares at some scales.)
+    path = QtGui.QPainterPath()
+    self.addTemplateToPath(path)
+    inradius = self._radius * math.cos(math.pi / self._sides)
+    if width < inradius:
+      k = 1 - width / inradius
+      path.addPolygon(QtGui.QTransform.fromScale(k, k).map(self._qpolygonf))
+      path.closeSubpath()
+    return path
 
 class Star(Polygon):
   def __init__(self, name, r, qpolygonf=None):
@@ -162,9 +249,6 @@ class Star(Polygon):
     if qpolygonf is None:
       qpolygonf=StarPolygon(5,2,r)
     super().__init__(name, qpolygonf=qpolygonf)
-  def transformed(self, xform):
-    r2 = xform.map(QtCore.QLineF(QtCore.QPointF(0,0), QtCore.QPointF(self._radius, 0))).length()
-    return Star(self._name, r2, qpolygonf=xform.map(self._qpolygonf))
 
 class Circle(Shape):
   def __init__(self, name, r=1.0, center=None):
@@ -175,36 +259,57 @@ class Circle(Shape):
     self._center = center
   def area(self):
     return math.pi * self._radius**2
-  def transformed(self, xform):
-    r2 = xform.map(QtCore.QLineF(self._center, self._center + QtCore.QPointF(self._radius, 0))).length()
-    return Circle(self._name, r2, center=xform.map(self._center))
-  def addToPath(self, path):
+  def computeBevelPath(self, width):
+    # A ring, whose curves are flattened only when painted (flattening a template-sized circle would be much too coarse).
+    path = QtGui.QPainterPath()
+    self.addTemplateToPath(path)
+    if width < self._radius:
+      path.addEllipse(self._center, self._radius - width, self._radius - width)
+    return path
+  def xformedPoints(self, xforms):
+    'Return an (n,1,2) array of the center transformed by each of the (n,2,3) `xforms`.'
+    return xform_points(xforms, np.array([[self._center.x(), self._center.y()]]))
+  def bounds(self, pts, radii):
+    'Return an (n,4) array of (left, top, right, bottom) of each of the (n,1,2) transformed centers and radii.'
+    rr = radii[:,np.newaxis]
+    return np.concatenate((pts[:,0] - rr, pts[:,0] + rr), axis=1)
+  def addToPath(self, path, pts, r):
+    path.addEllipse(QtCore.QPointF(*pts[0]), r, r)
+  def addTemplateToPath(self, path):
     path.addEllipse(self._center, self._radius, self._radius)
-  def paint(self, painter):
-    painter.drawEllipse(self._center, self._radius, self._radius)
-  def paintShadow(self, painter, dx, dy):
-    t = QtGui.QTransform.fromTranslate(dx, dy)
-    painter.drawEllipse(t.map(self._center), self._radius, self._radius)
+  def paint(self, painter, pts, r):
+    painter.drawEllipse(QtCore.QPointF(*pts[0]), r, r)
+  def paintShadow(self, painter, pts, r, dx, dy):
+    painter.drawEllipse(QtCore.QPointF(pts[0,0]+dx, pts[0,1]+dy), r, r)
+  def rasterOutline(self, pts, radii):
+    return rasterizer.CircleOutline(pts[:,0], radii)
+  def svgTemplate(self):
+    return '<circle id="{{id}}" cx="{}" cy="{}" r="{}"/>'.format(*map(svgwriter.num, (self._center.x(), self._center.y(), self._radius)))
 
 class Confetti(QtWidgets.QGraphicsObject):
 
-  def __init__(self, *posargs, **kwargs):
+  ENGINES = ('QPainter', 'NumPy')
+  MAX_QUANTITIES = (2**14, 2**20)   # maximum quantity usable with each engine
+
+  def __init__(self, *posargs, seed=None, **kwargs):
     super().__init__(*posargs, **kwargs)
+    self.setFlag(QtWidgets.QGraphicsItem.ItemUsesExtendedStyleOption)  # so option.exposedRect is accurate
+    self._generation = 0      # how many times it has needed repainting (see generation())
     #self.setData(0, 'Confetti')
     #scene.addItem(self)
     self._boundingRect = QtCore.QRectF(0,0,800,600)        # bounding rect for rendered content
     print('Confetti._boundingRect =', self._boundingRect)
 
-    self._max_quantity = 2**14                      # maximum allowed _quantity
+    self._engine = 0                                # index into ENGINES
+    self._max_quantity = self.MAX_QUANTITIES[self._engine]  # maximum allowed _quantity
     self._quantity = int(self._max_quantity / 8)    # current number of polygons
+    self._quantitySlider = None
 
-    self.initShapes()
+    # Every random choice is made from the seed, so that the same seed and parameters make the same picture (see spec()).
+    self._seed = rnd.getrandbits(64) if seed is None else seed
+    choices = rnd.Random(self._seed)
+    self.initShapes(choices)
 
-    # See https://math.stackexchange.com/questions/3157030/parametrizing-the-square-spiral
-    ns = np.arange(self._max_quantity)
-    nss = np.sqrt(ns)
-    self._arranged_xlateX = nss * np.cos(2*np.pi*nss/4) / 80
-    self._arranged_xlateY = nss * np.sin(2*np.pi*nss/4) / 80
     self._posRandomness = 1000
 
     self._theta = 0
@@ -216,8 +321,8 @@ class Confetti(QtWidgets.QGraphicsObject):
     self._MAX_BORDER = 64
     self._edgeThickness = 1
 
-    self._hue = rnd.randrange(360) #300
-    self._hue_variation = rnd.randrange(5, 180) #60
+    self._hue = choices.randrange(360) #300
+    self._hue_variation = choices.randrange(5, 180) #60
     self._min_saturation = 100
     self._max_saturation = 100
     self._kappa = .5                                # distribution of lightness values
@@ -229,22 +334,30 @@ class Confetti(QtWidgets.QGraphicsObject):
 
     self._shadow_opacity = 204
     self._shadow_divisor = 50
-    self._specularGradient = None
     self._specularBrightness = 0
     self._specularDepth = 33      # percentage
     self._specularSharpness = 75  # percentage
     self._bevelThickness = 0
 
+    self._mergedShadows = False   # whether to paint all shadows as one layer under all shapes
+    self._batchedDraw = False
+    self._batchColorBits = 8      # color bits per channel distinguished when batching
+
     self._pressed_render = False
-    self._last_full_render_time = 1/30
+    self._lod = LevelOfDetail()   # chooses what detail to paint while a slider is pressed
+    self._isStale = None          # callable telling paint() to give up on a frame nobody will see
+    self._progressive = False     # whether to paint a few items per frame, into a backing image (see paintProgressively())
+    self._progress = None
+    self._progress_scheduled = False
+    self._spriteDrafts = False    # whether to paint sprites (see paintSprites()) while a slider is pressed
 
     # Array quantities
     #self._rnd_lightnesses = None                      # array of lightness values, before clamping
     #self._rnd_saturations = None
-    self.randomize()
-    self.invalidateAll()
+    self.initCacheGraph()
+    self.randomize(self._seed)
 
-  def initShapes(self):
+  def initShapes(self, choices):
     self._shapes = []        # a list of available Shape objects
     NAMES = 'Triangles Squares Pentagons Hexagons'.split()
     area = math.pi
@@ -253,7 +366,7 @@ class Confetti(QtWidgets.QGraphicsObject):
       r = math.sqrt( 2 * area / (sides * math.sin(2*math.pi/sides)) )
       #print('{} radius = {}'.format(NAMES[i], r))
       shp = RegularPolygon(NAMES[i], sides, r)
-      shp.qty = rnd.randrange(2,20)
+      shp.qty = choices.randrange(2,20)
       self._shapes.append(shp)
     # https://www.quora.com/How-do-you-find-the-area-of-a-regular-5-pointed-star-inscribed-in-the-circle-of-radius-R
     # a = 5 r^2 / (tan 72 + tan 54)
@@ -264,48 +377,67 @@ class Confetti(QtWidgets.QGraphicsObject):
     shp.qty = 1
     self._shapes.append(shp)
     c = Circle('Circles')
-    c.qty = rnd.randrange(2,20)
+    c.qty = choices.randrange(2,20)
     self._shapes.append(c)
 
-  def invalidateFillGradients(self):
-    self._fill_gradients = None                           # array of Qt gradients
-
-  def invalidateColor(self):
-    self._color = None                              # array of derived fill colors
-    self.invalidateFillGradients()
-
-  def invalidateHue(self):
-    self._clamped_hues = None
-    self.invalidateColor()
-
-  def invalidateSaturation(self):
-    self._clamped_saturations = None
-    self.invalidateColor()
-
-  def invalidateLightness(self):
-    self._clamped_lightness = None
-    self.invalidateColor()
-
-  def invalidateXformedShapes(self):
-    self._xformed_shapes = None
-    self.invalidateFillGradients()
-    self.invalidateSpecular()
-
-  def invalidateXforms(self):
-    self._xform = None
-    self.invalidateXformedShapes()
-
-  def invalidateSpecular(self):
-    self.invalidateLightness()
-    self._specularGradient = None
-    self._bevelGradient = None
+  def initCacheGraph(self):
+    '''Declare each derived array, and what parameters and other derived arrays it is computed from.
+    The special parameter "random" means the _rnd_* arrays.
+    Each compute*() method assumes the arrays it is computed from are already computed (see require()),
+    and computes just the items missing from its own arrays.'''
+    g = self._cache_graph = CacheGraph(self)
+    g.addNode('xforms', self.computeXforms, ['_xform']                  # (N,2,3) array of affine transforms
+             , params=['sceneRect', 'posRandomness', 'theta', 'thetaVariation'
+                      , 'radius', 'radiusVariation', 'radiusAux', 'random'])
+    g.addNode('shapes', self.computeXformedShapes                       # per-Shape arrays of transformed points
+             , ['_xformed_kinds', '_xformed_rows', '_xformed_radii', '_xformed_points']
+             , params=['shapeQuantities', 'random'], deps=['xforms'])
+    g.addNode('shapeBounds', self.computeShapeBounds, ['_shape_bounds'], deps=['shapes'])
+    g.addNode('centers', self.computeCenters, ['_centers'], deps=['xforms'])
+    g.addNode('illuminance', self.computeLightMetrics, ['_illuminances', '_lightDists']
+             , params=['light'], deps=['centers'])
+    g.addNode('shadows', self.computeShadowOffsets, ['_shadow_dxs', '_shadow_dys']
+             , params=['light', 'shadowDivisor'], deps=['centers'])
+    g.addNode('hues', self.computeHues, ['_clamped_hues'], params=['hue', 'hueVariation', 'random'])
+    g.addNode('saturations', self.computeSaturations, ['_clamped_saturations']
+             , params=['minSaturation', 'maxSaturation', 'random'])
+    g.addNode('lightnesses', self.computeLightnesses, ['_clamped_lightness']
+             , params=['minLightness', 'maxLightness', 'random'])
+    g.addNode('colors', self.computeColor, ['_color']                   # (N,4) uint8 array of derived RGBA fill colors
+             , params=['light'], deps=['hues', 'saturations', 'lightnesses', 'illuminance'])
+    g.addNode('fillGradients', self.computeGradient, ['_fill_gradients'] # list of Qt gradients
+             , params=['minOpacity', 'gradientOpacity', 'random'], deps=['xforms', 'colors'])
+    g.addNode('specular', self.computeSpecular, ['_specularGradient']
+             , params=['light', 'specularBrightness', 'specularDepth', 'specularSharpness']
+             , deps=['shapes', 'illuminance'])
+    g.addNode('bevel', self.computeBevel, ['_bevelGradient']
+             , params=['light', 'specularBrightness'], deps=['shapes', 'illuminance', 'colors'])
+    g.addNode('bevelWidths', self.computeBevelWidths, ['_bevel_widths'], params=['bevelThickness'], deps=['xforms'])
+    g.addNode('shadowPaths', self.computeShadowPaths                    # paths of all shadows
+             , ['_shadow_paths_quantity', '_shadow_paths', '_shadow_mask'], deps=['shapes', 'shadows'], appendOnly=True)
+    g.addNode('batches', self.computeBatches                            # flat color shapes grouped into paths
+             , ['_batch_of_item', '_batches', '_batch_latest', '_batch_cells']
+             , params=['batchColorBits', 'edgeThickness', 'shadowOpacity', 'mergedShadows']
+             , deps=['shapes', 'shapeBounds', 'colors', 'shadows'], appendOnly=True)
+    g.addNode('spatialIndex', self.computeSpatialIndex                  # which items are in each cell of a grid
+             , ['_index_quantity', '_index_bounds', '_index_inside', '_index_shape', '_index_starts', '_index_items']
+             , params=['edgeThickness'], deps=['shapeBounds', 'shadows'])
+    g.addNode('sprites', self.computeSprites, ['_sprite_rows', '_sprite_atlas']  # atlas of templates in a palette
+             , params=['edgeThickness'], deps=['colors'])
+
+  def cacheGraph(self):
+    return self._cache_graph
+
+  def invalidate(self, *params):
+    'Discard whatever derived arrays are computed from the given parameters.'
+    return self._cache_graph.invalidate(*params)
 
   def invalidateAll(self):
-    self.invalidateXforms()
-    self.invalidateHue()
-    self.invalidateSaturation()
-    self.invalidateLightness()
-    self.invalidateSpecular()
+    self._cache_graph.invalidateAll()
+
+  def require(self, name):
+    'Ensure the named derived array, and what it is computed from, is computed for the current quantity.'
+    self._cache_graph.require(name, self._quantity)
 
   def itemChange(self, change, value):
     #print('Confetti.itemChange({}, {})'.format(change, value))
@@ -327,7 +459,7 @@ class Confetti(QtWidgets.QGraphicsObject):
       else:
         self.prepareGeometryChange()
         self._boundingRect = value.sceneRect()
-        self.invalidateXforms()
+        self.invalidate('sceneRect')
         self.update()
         print('  connecting to lightSourceChanged signal')
         value.light.lightSourceChanged.connect(self.updateLightSource)
@@ -339,7 +471,7 @@ class Confetti(QtWidgets.QGraphicsObject):
   def updateSceneRect(self, r):
     self.prepareGeometryChange()
     self._boundingRect = r
-    self.invalidateXforms()
+    self.invalidate('sceneRect')
     self.update()
 
   def setQuantity(self, value):
@@ -350,52 +482,63 @@ class Confetti(QtWidgets.QGraphicsObject):
     if value != self._quantity:
       old = self._quantity
       self._quantity = value
+      self.extendRandom(value)
       #self.quantityChanged.emit(old, value)
       self.update()
 
   def setShapeQuantity(self, shape, value):
     if value != shape.qty:
       shape.qty = value
-      self.invalidateXformedShapes()
+      self.invalidate('shapeQuantities')
+      self.update()
+
+  def setShapeQuantities(self, values):
+    'Set the quantity of each shape, in order.'
+    for (shp, value) in zip(self._shapes, values):
+      self.setShapeQuantity(shp, value)
+
+  def setSeed(self, value):
+    if value != self._seed:
+      self.randomize(value)
       self.update()
 
   def setPosRandomness(self, value):
     if value != self._posRandomness:
       self._posRandomness = value
-      self.invalidateXforms()
+      self.invalidate('posRandomness')
       self.update()
 
   def setTheta(self, value):
     rad = value * math.pi / 180
     if rad != self._theta:
       self._theta = rad
-      self.invalidateXforms()
+      self.invalidate('theta')
       self.update()
 
   def setThetaVariation(self, value):
     rad = value * math.pi / 180
     if rad != self._theta_variation:
       self._theta_variation = rad
-      self.invalidateXforms()
+      self.invalidate('thetaVariation')
       self.update()
 
   def setRadius(self, value):
     if value != self._radius_param:
       self._radius_param = value
-      self.invalidateXforms()
+      self.invalidate('radius')
       self.update()
 
   def setRadiusVariation(self, value):
     if value != self._radius_variation:
       old = value
       self._radius_variation = value
-      self.invalidateXforms()
+      self.invalidate('radiusVariation')
       self.update()
 
   def setRadiusAux(self, value):
     if value != self._radius_aux:
       self._radius_aux = value
-      self.invalidateXforms()
+      self.invalidate('radiusAux')
       self.update()
 
   def setEdgeThickness(self, value):
@@ -406,18 +549,19 @@ class Confetti(QtWidgets.QGraphicsObject):
     if value != self._edgeThickness:
       old = self._edgeThickness
       self._edgeThickness = value
+      self.invalidate('edgeThickness')
       self.update()
 
   def setHue(self, value):
     if value != self._hue:
       self._hue = value
-      self.invalidateHue()
+      self.invalidate('hue')
       self.update()
 
   def setHueVariation(self, value):
     if value != self._hue_variation:
       self._hue_variation = value
-      self.invalidateHue()
+      self.invalidate('hueVariation')
       self.update()
 
   def setMinSaturation(self, value):
@@ -426,7 +570,7 @@ class Confetti(QtWidgets.QGraphicsObject):
       #if value > self._max_saturation:
       #  self._max_saturation = value
       print('setMinSaturation({})'.format(value))
-      self.invalidateSaturation()
+      self.invalidate('minSaturation')
       self.update()
 
   def setMaxSaturation(self, value):
@@ -435,41 +579,42 @@ class Confetti(QtWidgets.QGraphicsObject):
       #if value < self._min_saturation:
       #  self._min_saturation = value
       print('setMaxSaturation({})'.format(value))
-      self.invalidateSaturation()
+      self.invalidate('maxSaturation')
       self.update()
 
   def updateLightSource(self, light_source):
-    self.invalidateLightness()
-    self.invalidateSpecular()
+    self.invalidate('light')
     self.update()
 
   def setShadowOpacity(self, value):
     if value != self._shadow_opacity:
+      if not (value and self._shadow_opacity):
+        self.invalidate('shadowOpacity')    # batches only care whether there are shadows at all
       self._shadow_opacity = value
       self.update()
 
   def setShadowDivisor(self, value):
     if value != self._shadow_divisor:
       self._shadow_divisor = value
-      self.invalidateLightness()
+      self.invalidate('shadowDivisor')
       self.update()
 
   def setMinLightness(self, value):
     if value != self._min_lightness:
       self._min_lightness = value
-      self.invalidateLightness()
+      self.invalidate('minLightness')
       self.update()
 
   def setMaxLightness(self, value):
     if value != self._max_lightness:
       self._max_lightness = value
-      self.invalidateLightness()
+      self.invalidate('maxLightness')
       self.update()
 
   def setMinOpacity(self, value):
     if value != self._min_opacity:
       self._min_opacity = value
-      self.invalidateFillGradients()
+      self.invalidate('minOpacity')
       self.update()
 
   def setGradientOpacity(self, value):
@@ -478,7 +623,7 @@ class Confetti(QtWidgets.QGraphicsObject):
     if value != self._gradient_opacity:
       old = self._gradient_opacity
       self._gradient_opacity = value
-      self.invalidateFillGradients()
+      self.invalidate('gradientOpacity')
       self.update()
 
   #def setSpecular(self, state):
@@ -488,146 +633,281 @@ class Confetti(QtWidgets.QGraphicsObject):
   def setSpecularBrightness(self, value):
     if value != self._specularBrightness:
       self._specularBrightness = value
-      self.invalidateSpecular()
+      self.invalidate('specularBrightness')
       self.update()
 
   def setSpecularDepth(self, value):
     if value != self._specularDepth:
       self._specularDepth = value
-      self.invalidateSpecular()
+      self.invalidate('specularDepth')
       self.update()
 
   def setSpecularSharpness(self, value):
     if value != self._specularSharpness:
       self._specularSharpness = value
-      self.invalidateSpecular()
+      self.invalidate('specularSharpness')
       self.update()
 
   def setBevelThickness(self, value):
     if value != self._bevelThickness:
       self._bevelThickness = value
-      self.invalidateSpecular()
+      self.invalidate('bevelThickness')
+      self.update()
+
+  def setMergedShadows(self, state):
+    self._mergedShadows = (state != QtCore.Qt.Unchecked)
+    self.invalidate('mergedShadows')
+    self.update()
+
+  def setBatchedDraw(self, state):
+    self._batchedDraw = (state != QtCore.Qt.Unchecked)
+    self.update()
+
+  def setProgressive(self, state):
+    self._progressive = (state != QtCore.Qt.Unchecked)
+    self.update()
+
+  def setSpriteDrafts(self, state):
+    self._spriteDrafts = (state != QtCore.Qt.Unchecked)
+
+  def setEngine(self, index):
+    if index != self._engine:
+      self._engine = index
+      self._max_quantity = self.MAX_QUANTITIES[index]
+      if not self._quantitySlider is None:
+        self._quantitySlider.setMaximum(self._max_quantity)   # (which clamps the quantity, via setQuantity())
+      self.setQuantity(self._quantity)
+      self.update()
+
+  def setTargetFrameTime(self, value):
+    self._lod.targetTime = value / 1000
+
+  def setBatchColorBits(self, value):
+    if value != self._batchColorBits:
+      self._batchColorBits = value
+      self.invalidate('batchColorBits')
       self.update()
 
   def boundingRect(self):
     return QtCore.QRectF(self._boundingRect)
 
-  def randomize(self):
+  def spec(self):
+    '''Return a dict of this Confetti's seed and of each parameter that affects how it looks,
+    in the units of its setter (so each can be applied again by calling setParameter(value), see scenespec).'''
+    return { 'visible': self.isVisible()
+           , 'seed': self._seed
+           , 'engine': self._engine                 # (before the quantity, which it limits)
+           , 'quantity': self._quantity
+           , 'shapeQuantities': [ shp.qty for shp in self._shapes ]
+           , 'posRandomness': self._posRandomness
+           , 'theta': round(math.degrees(self._theta), 6)
+           , 'thetaVariation': round(math.degrees(self._theta_variation), 6)
+           , 'radius': self._radius_param
+           , 'radiusVariation': self._radius_variation
+           , 'radiusAux': self._radius_aux
+           , 'edgeThickness': self._edgeThickness
+           , 'hue': self._hue
+           , 'hueVariation': self._hue_variation
+           , 'minSaturation': self._min_saturation
+           , 'maxSaturation': self._max_saturation
+           , 'minLightness': self._min_lightness
+           , 'maxLightness': self._max_lightness
+           , 'minOpacity': self._min_opacity
+           , 'gradientOpacity': self._gradient_opacity
+           , 'shadowOpacity': self._shadow_opacity
+           , 'shadowDivisor': self._shadow_divisor
+           , 'specularBrightness': self._specularBrightness
+           , 'specularDepth': self._specularDepth
+           , 'specularSharpness': self._specularSharpness
+           , 'bevelThickness': self._bevelThickness
+           , 'mergedShadows': self._mergedShadows
+           , 'batchedDraw': self._batchedDraw
+           , 'batchColorBits': self._batchColorBits
+           }
+
+  def randomState(self):
+    '''Return (state, arrays):  a dict (which can be written as JSON) of the seed and the state of the random number generator,
+    and a dict of each _rnd_* array of the random values drawn so far.  See setRandomState().'''
+    names = list(self._rnd_chunks[0]) if self._rnd_chunks else []
+    state = { 'seed': self._seed, 'generator': self._rng.bit_generator.state, 'quantity': self._rnd_quantity, 'arrays': names }
+    return (state, { name: getattr(self, name) for name in names })
+
+  def setRandomState(self, state, arrays):
+    '''Restore the random values and generator that randomState() returned, rather than drawing them again.
+    `arrays` is the dict of arrays it returned (or one read back from a document).'''
+    self._seed = state['seed']
+    self._rng = np.random.default_rng(self._seed)
+    self._rng.bit_generator.state = state['generator']
+    chunk = { name: arrays[name] for name in state['arrays'] }
+    self._rnd_chunks = [chunk] if chunk else []
+    self._rnd_quantity = state['quantity']
+    for (name, values) in chunk.items():
+      setattr(self, name, values)
+    self.invalidateAll()
+    self.update()
+
+  def randomize(self, seed=None):
+    'Draw new random values for every item, from `seed`, or else from a new random seed.'
     # "New code should use the uniform method of a default_rng() instance instead; please see
     #   https://numpy.org/doc/stable/reference/random/index.html#random-quick-start "
     # np.random.uniform() returns float values from 0.0 to 1.0 NOT including 1.0
     # The implications of the half-open interval are completely unclear to me.
 
-    seed = None
-    rng = np.random.default_rng(seed)
-
-    self._rnd_shapes = rng.uniform(size=self._max_quantity)           # which shapes to use
-    self._rndPosX = rng.uniform(size=self._max_quantity) - .5 # -.5 to +.5
-    self._rndPosY = rng.uniform(size=self._max_quantity) - .5
-    self._rnd_thetas = rng.uniform(size=self._max_quantity)
-    #self._rnd_radii  = rng.uniform(size=self._max_quantity)
-    #self._rnd_radii  = .01 / np.power(.025+.975*rng.uniform(size=self._max_quantity), 2)  # approx 1/x^2
-    #self._rnd_radii = rng.choice(SCALED_AREA_DISTRIBUTION, size=self._max_quantity) # 0 to 500
-    self._rnd_radii_idxs = rng.integers(SAMPLES, size=self._max_quantity)
-
-    self._rnd_hues = rng.uniform(size=self._max_quantity)
-    self._rnd_saturations = rng.uniform(size=self._max_quantity)
-    #self._rnd_saturations = 1 - np.sqrt(rng.uniform(size=self._max_quantity))
-    self._rnd_lightnesses = rng.uniform(size=self._max_quantity)       # [0..1)
-    #self._rnd_lightnesses = [
-                          # .5                 # all fully saturated, no black or white
-                          # rnd.uniform(0,1.0) # many colors, but too much black & white
-                          #rnd.triangular()   # lots of color, some black & white
-    #                      rnd.vonmisesvariate(math.pi, self._kappa)/(2*math.pi)
-    #                      for i in range(self._max_quantity) ]
-    #self._rnd_lightnesses = (rng.vonmises(math.pi, self._kappa, size=self._max_quantity)+math.pi) / (2*math.pi)
-    self._rnd_opacities = 1 - np.sqrt(rng.uniform(size=self._max_quantity))
-
+    if seed is None:
+      seed = rnd.getrandbits(64)
+    self._seed = seed
+    self._rng = np.random.default_rng(seed)
+    self._rnd_quantity = 0        # how many items have random values
+    self._rnd_chunks = []
+    self.extendRandom(self._quantity)
     self.invalidateAll()
 
+  RANDOM_CHUNK = 2**14    # items to draw random values for at a time
+
+  def extendRandom(self, quantity):
+    '''Draw random values for at least `quantity` items, RANDOM_CHUNK items at a time,
+    so that each item's values don't depend on how many items there are or have been.'''
+    if quantity <= self._rnd_quantity:
+      return
+    while self._rnd_quantity < quantity:
+      rng = self._rng
+      size = self.RANDOM_CHUNK
+      chunk = {}
+      chunk['_rnd_shapes'] = rng.uniform(size=size)           # which shapes to use
+      chunk['_rndPosX'] = rng.uniform(size=size) - .5 # -.5 to +.5
+      chunk['_rndPosY'] = rng.uniform(size=size) - .5
+      chunk['_rnd_thetas'] = rng.uniform(size=size)
+      #chunk['_rnd_radii']  = rng.uniform(size=size)
+      #chunk['_rnd_radii']  = .01 / np.power(.025+.975*rng.uniform(size=size), 2)  # approx 1/x^2
+      #chunk['_rnd_radii'] = rng.choice(SCALED_AREA_DISTRIBUTION, size=size) # 0 to 500
+      chunk['_rnd_radii_idxs'] = rng.integers(SAMPLES, size=size)
+
+      chunk['_rnd_hues'] = rng.uniform(size=size)
+      chunk['_rnd_saturations'] = rng.uniform(size=size)
+      #chunk['_rnd_saturations'] = 1 - np.sqrt(rng.uniform(size=size))
+      chunk['_rnd_lightnesses'] = rng.uniform(size=size)       # [0..1)
+      #chunk['_rnd_lightnesses'] = [
+                            # .5                 # all fully saturated, no black or white
+                            # rnd.uniform(0,1.0) # many colors, but too much black & white
+                            #rnd.triangular()   # lots of color, some black & white
+      #                      rnd.vonmisesvariate(math.pi, self._kappa)/(2*math.pi)
+      #                      for i in range(size) ]
+      #chunk['_rnd_lightnesses'] = (rng.vonmises(math.pi, self._kappa, size=size)+math.pi) / (2*math.pi)
+      chunk['_rnd_opacities'] = 1 - np.sqrt(rng.uniform(size=size))
+      self._rnd_chunks.append(chunk)
+      self._rnd_quantity += size
+    for name in self._rnd_chunks[0]:
+      setattr(self, name, np.concatenate([ chunk[name] for chunk in self._rnd_chunks ]))
+
   def computeXforms(self):
-    'Recompute translation/rotation/scaling matrix transforms'
+    'Recompute translation/rotation/scaling matrix transforms, or just compute any missing ones'
     assert type(self._quantity) is int
-    if self._xform is None or len(self._xform) < self._quantity:
-      maxwh = max(self._boundingRect.width(), self._boundingRect.height())
-      pr = self._posRandomness / 1000
-      xs = (self._arranged_xlateX*(1-pr) + self._rndPosX*pr) * maxwh + self._boundingRect.width()/2
-      ys = (self._arranged_xlateY*(1-pr) + self._rndPosY*pr) * maxwh + self._boundingRect.height()/2
-      #variation = self._radius_aux / 100 / (.1+.9*self._rnd_radii) ** 2
-      #variation = np.power(self._rnd_radii, 1/(2 - self._radius_aux/100))
-      #scales = np.maximum(0, self._radius_param + self._radius_variation * variation / 256)
-      aux = self._radius_aux/100
-      variation = LINEAR_DISTRIBUTION[self._rnd_radii_idxs] * (1-aux) + INVERSE_DISTRIBUTION[self._rnd_radii_idxs] * aux
-      scales = np.maximum(0, self._radius_param + self._radius_variation * variation / 256 )
-      rots = self._theta + self._rnd_thetas * self._theta_variation
-      self._xform = []
-      for i in range(self._quantity):
-        self._xform.append(
-          QtGui.QTransform.fromTranslate(xs[i], ys[i])
-          .scale(scales[i],scales[i])
-          .rotateRadians(rots[i])
-        )
+    q = self._quantity
+    n = 0 if self._xform is None else len(self._xform)   # how many are already computed
+    maxwh = max(self._boundingRect.width(), self._boundingRect.height())
+    pr = self._posRandomness / 1000
+    # See https://math.stackexchange.com/questions/3157030/parametrizing-the-square-spiral
+    nss = np.sqrt(np.arange(n, q))
+    arranged_xs = nss * np.cos(2*np.pi*nss/4) / 80
+    arranged_ys = nss * np.sin(2*np.pi*nss/4) / 80
+    xs = (arranged_xs*(1-pr) + self._rndPosX[n:q]*pr) * maxwh + self._boundingRect.width()/2
+    ys = (arranged_ys*(1-pr) + self._rndPosY[n:q]*pr) * maxwh + self._boundingRect.height()/2
+    #variation = self._radius_aux / 100 / (.1+.9*self._rnd_radii) ** 2
+    #variation = np.power(self._rnd_radii, 1/(2 - self._radius_aux/100))
+    #scales = np.maximum(0, self._radius_param + self._radius_variation * variation / 256)
+    aux = self._radius_aux/100
+    idxs = self._rnd_radii_idxs[n:q]
+    variation = LINEAR_DISTRIBUTION[idxs] * (1-aux) + INVERSE_DISTRIBUTION[idxs] * aux
+    scales = np.maximum(0, self._radius_param + self._radius_variation * variation / 256 )
+    rots = self._theta + self._rnd_thetas[n:q] * self._theta_variation
+    # Equivalent to QTransform.fromTranslate(x,y).scale(s,s).rotateRadians(rot) for each item:
+    #   [[ s*cos, -s*sin, x ]
+    #    [ s*sin,  s*cos, y ]]
+    coss = scales * np.cos(rots)
+    sins = scales * np.sin(rots)
+    xform = np.empty((q-n,2,3))
+    xform[:,0,0] = coss
+    xform[:,0,1] = -sins
+    xform[:,0,2] = xs
+    xform[:,1,0] = sins
+    xform[:,1,1] = coss
+    xform[:,1,2] = ys
+    self._xform = xform if n == 0 else np.concatenate((self._xform, xform))
+
+  def computeCenters(self):
+    # Shape centers are where each transform maps the origin, which is just its translation column.
+    self._centers = self._xform[:,:,2]
 
   def computeLightMetrics(self):
     # Compute a simple metric of how well lit each shape is.
-    self.computeXforms()
-
+    q = self._quantity
+    n = 0 if self._illuminances is None else len(self._illuminances)
     light_source_xy = self.scene().light.pos()
-    zz = QtCore.QPointF(0,0)
-    dxs = np.zeros(self._max_quantity)
-    dys = np.zeros(self._max_quantity)
-    for i in range(self._quantity):
-      delta = self._xform[i].map(zz) - light_source_xy
-      dxs[i] = delta.x()
-      dys[i] = delta.y()
-    dists = np.hypot(dxs, dys)
-    dirs = np.arctan2(dys, dxs)
-    self._lightDists = dists[:self._quantity]
+    dists = np.hypot(self._centers[n:q,0] - light_source_xy.x(), self._centers[n:q,1] - light_source_xy.y())
 
     light_source_inner_radius = self.scene().light.innerRadius()
     light_source_outer_radius = self.scene().light.outerRadius()
     fade_dist = abs(light_source_outer_radius - light_source_inner_radius)
-    #self._illuminances = 1 - np.minimum( np.maximum(0.0, dists - light_source_inner_radius) / light_source_outer_radius, 1.0)
-    self._illuminances = 1 - np.minimum( np.maximum(0.0, dists - light_source_inner_radius) / (fade_dist+1), 1.0)
+    #illuminances = 1 - np.minimum( np.maximum(0.0, dists - light_source_inner_radius) / light_source_outer_radius, 1.0)
+    illuminances = 1 - np.minimum( np.maximum(0.0, dists - light_source_inner_radius) / (fade_dist+1), 1.0)
+
+    if n == 0:
+      self._lightDists = dists
+      self._illuminances = illuminances
+    else:
+      self._lightDists = np.concatenate((self._lightDists, dists))
+      self._illuminances = np.concatenate((self._illuminances, illuminances))
 
-    self._shadow_dxs = dxs / self._shadow_divisor
-    self._shadow_dys = dys / self._shadow_divisor
+  def computeShadowOffsets(self):
+    q = self._quantity
+    n = 0 if self._shadow_dxs is None else len(self._shadow_dxs)
+    light_source_xy = self.scene().light.pos()
+    dxs = (self._centers[n:q,0] - light_source_xy.x()) / self._shadow_divisor
+    dys = (self._centers[n:q,1] - light_source_xy.y()) / self._shadow_divisor
+    if n == 0:
+      self._shadow_dxs = dxs
+      self._shadow_dys = dys
+    else:
+      self._shadow_dxs = np.concatenate((self._shadow_dxs, dxs))
+      self._shadow_dys = np.concatenate((self._shadow_dys, dys))
+
+  # The clamped hues, saturations, and lightnesses are cheap enough to just compute for all items with random values.
+
+  def computeHues(self):
+    self._clamped_hues = ((self._hue_variation * (self._rnd_hues - .5) + self._hue) % 360) / 360
+
+  def computeSaturations(self):
+    #self._clamped_saturations = (
+    #  (1 - self._rnd_saturations * (1 - self._min_saturation / 100)) * self._max_saturation / 100
+    #)
+    if self._min_saturation <= self._max_saturation:
+      satrange = (self._max_saturation - self._min_saturation) / 100
+      self._clamped_saturations = self._min_saturation/100 + self._rnd_saturations * satrange
+    else:
+      avg = (self._min_saturation + self._max_saturation) / 200
+      self._clamped_saturations = avg + self._rnd_saturations * 0
+
+  def computeLightnesses(self):
+    if self._min_lightness <= self._max_lightness:
+      lightnessrange = (self._max_lightness - self._min_lightness) / 100
+      self._clamped_lightness = (self._min_lightness/100 + self._rnd_lightnesses * lightnessrange)# * self._illuminances
+    else:
+      avg = (self._min_lightness + self._max_lightness) / 200
+      self._clamped_lightness = (avg + self._rnd_lightnesses * 0)# * self._illuminances
 
   def computeColor(self):
-    if self._clamped_hues is None or len(self._clamped_hues) < self._quantity:
-      self._clamped_hues = ((self._hue_variation * (self._rnd_hues - .5) + self._hue) % 360) / 360
-      self._color = None
-    if self._clamped_saturations is None or len(self._clamped_saturations) < self._quantity:
-      #self._clamped_saturations = (
-      #  (1 - self._rnd_saturations * (1 - self._min_saturation / 100)) * self._max_saturation / 100
-      #)
-      if self._min_saturation <= self._max_saturation:
-        satrange = (self._max_saturation - self._min_saturation) / 100
-        self._clamped_saturations = self._min_saturation/100 + self._rnd_saturations * satrange
-      else:
-        avg = (self._min_saturation + self._max_saturation) / 200
-        self._clamped_saturations = avg + self._rnd_saturations * 0
-      self._color = None
-    if self._clamped_lightness is None or len(self._clamped_lightness) < self._quantity:
-      self.computeXforms()
-      self.computeLightMetrics()
-      if self._min_lightness <= self._max_lightness:
-        lightnessrange = (self._max_lightness - self._min_lightness) / 100
-        clamped_lightness = (self._min_lightness/100 + self._rnd_lightnesses * lightnessrange)# * self._illuminances
-      else:
-        avg = (self._min_lightness + self._max_lightness) / 200
-        clamped_lightness = (avg + self._rnd_lightnesses * 0)# * self._illuminances
-      self._clamped_lightness = clamped_lightness[:self._quantity]
-      self._color = None
-    if self._color is None or len(self._color) < self._quantity:
-      light_color = self.scene().light.color()
-      (r,g,b) = (light_color.redF(), light_color.greenF(), light_color.blueF())
-      self._color = []
-      for i in range(self._quantity):
-        c = QtGui.QColor.fromHslF( self._clamped_hues[i]
-                                 , self._clamped_saturations[i]
-                                 , self._clamped_lightness[i] ).getRgbF()
-        self._color.append( QtGui.QColor.fromRgbF(c[0]*r*self._illuminances[i], c[1]*g*self._illuminances[i], c[2]*b*self._illuminances[i]) )
+    q = self._quantity
+    n = 0 if self._color is None else len(self._color)
+    light_color = self.scene().light.color()
+    rgbaf = np.ones((q-n,4))
+    rgbaf[:,:3] = hsl_to_rgb( self._clamped_hues[n:q]
+                            , self._clamped_saturations[n:q]
+                            , self._clamped_lightness[n:q] )
+    # Tint by the light color, and darken by how poorly lit each shape is.
+    rgbaf[:,:3] *= np.array([light_color.redF(), light_color.greenF(), light_color.blueF()])
+    rgbaf[:,:3] *= self._illuminances[n:q,np.newaxis]
+    color = rgbaf_to_rgba8(rgbaf)
+    self._color = color if n == 0 else np.concatenate((self._color, color))
 
   def computeShapePicks(self):
     'Regenerate the list used to randomly pick shapes.'
@@ -638,101 +918,453 @@ class Confetti(QtWidgets.QGraphicsObject):
       self._shape_picks.append(self._shapes[3])
 
   def computeXformedShapes(self):
-    'Recompute transformation of each shape'
-    if self._xformed_shapes is None or len(self._xformed_shapes) < self._quantity:
-      self.computeXforms()
+    'Recompute transformation of each shape, in bulk for each kind of Shape, or just any missing ones'
+    q = self._quantity
+    n = 0 if self._xformed_kinds is None else len(self._xformed_kinds)
+    if n == 0:
       self.computeShapePicks()
-      npicks = len(self._shape_picks)
-      self._xformed_shapes = []
-      for i in range(self._quantity):
-        shp = self._shape_picks[ int(self._rnd_shapes[i] * npicks) ]
-        self._xformed_shapes.append( shp.transformed(self._xform[i]) )
+      self._shape_pick_kinds = np.array([self._shapes.index(shp) for shp in self._shape_picks])
+      self._xformed_kinds = np.empty(0, dtype=int)   # index into self._shapes of each item
+      self._xformed_rows = np.empty(0, dtype=int)    # index of each item within its kind's points array
+      self._xformed_radii = np.empty(0)
+      self._xformed_points = [ shp.xformedPoints(np.empty((0,2,3))) for shp in self._shapes ]
+    xform = self._xform[n:q]
+    picks = self._shape_pick_kinds
+    kinds = picks[ (self._rnd_shapes[n:q] * len(picks)).astype(int) ]
+    rows = np.empty(q-n, dtype=int)
+    for k in range(len(self._shapes)):
+      idxs = np.flatnonzero(kinds == k)
+      rows[idxs] = len(self._xformed_points[k]) + np.arange(len(idxs))
+      self._xformed_points[k] = np.concatenate((self._xformed_points[k], self._shapes[k].xformedPoints(xform[idxs])))
+    template_radii = np.array([shp._radius for shp in self._shapes])
+    radii = np.hypot(xform[:,0,0], xform[:,1,0]) * template_radii[kinds]
+    self._xformed_kinds = np.concatenate((self._xformed_kinds, kinds))
+    self._xformed_rows = np.concatenate((self._xformed_rows, rows))
+    self._xformed_radii = np.concatenate((self._xformed_radii, radii))
+
+  def xformedShape(self, i):
+    'Return (template Shape, transformed points, transformed radius) of item i.'
+    k = self._xformed_kinds[i]
+    return (self._shapes[k], self._xformed_points[k][self._xformed_rows[i]], self._xformed_radii[i])
+
+  def computeShapeBounds(self):
+    'Compute the (left, top, right, bottom) bounds of each transformed shape, or just any missing ones'
+    q = self._quantity
+    n = 0 if self._shape_bounds is None else len(self._shape_bounds)
+    kinds = self._xformed_kinds[n:q]
+    bounds = np.empty((q-n,4))
+    for k in range(len(self._shapes)):
+      idxs = np.flatnonzero(kinds == k)
+      if len(idxs):
+        rows = self._xformed_rows[n:q][idxs]
+        bounds[idxs] = self._shapes[k].bounds(self._xformed_points[k][rows], self._xformed_radii[n:q][idxs])
+    self._shape_bounds = bounds if n == 0 else np.concatenate((self._shape_bounds, bounds))
+
+  INDEX_CELL = 64   # size (px) of the grid cells of the spatial index
+
+  def computeSpatialIndex(self):
+    '''Index which items might be painted in each cell of a grid over the bounding rect, so that paint()
+    can visit just the items that intersect the exposed rect (see exposedItems()).
+    The index lists the items touching each cell in index order, all cells of a row of the grid being consecutive.'''
+    q = self._quantity
+    br = self._boundingRect
+    CELL = self.INDEX_CELL
+    # Bound each shape along with its shadow, its edge, and antialiasing.
+    b = self._shape_bounds[:q]
+    sb = b + np.tile(np.column_stack((self._shadow_dxs[:q], self._shadow_dys[:q])), 2)
+    m = self._edgeThickness / 2 + 1
+    bounds = np.concatenate((np.minimum(b[:,:2], sb[:,:2]) - m, np.maximum(b[:,2:], sb[:,2:]) + m), axis=1)
+    self._index_bounds = bounds
+    self._index_inside = ( (bounds[:,0] >= br.left()) & (bounds[:,1] >= br.top())
+                         & (bounds[:,2] <= br.right()) & (bounds[:,3] <= br.bottom()) )
+    (gh, gw) = self._index_shape = (int(br.height()) // CELL + 1, int(br.width()) // CELL + 1)
+    c = np.floor((bounds - (br.left(), br.top(), br.left(), br.top())) / CELL).astype(int)
+    idxs = np.flatnonzero((c[:,2] >= 0) & (c[:,3] >= 0) & (c[:,0] < gw) & (c[:,1] < gh))  # items not entirely outside
+    c = c[idxs]
+    c[:,0::2] = np.clip(c[:,0::2], 0, gw-1)
+    c[:,1::2] = np.clip(c[:,1::2], 0, gh-1)
+    # Enumerate every (cell, item) pair, then sort them by cell (keeping items in order).
+    nx = c[:,2] - c[:,0] + 1
+    counts = nx * (c[:,3] - c[:,1] + 1)
+    k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    nx = np.repeat(nx, counts)
+    cells = (np.repeat(c[:,1], counts) + k // nx) * gw + np.repeat(c[:,0], counts) + k % nx
+    order = np.argsort(cells, kind='stable')
+    self._index_items = np.repeat(idxs, counts)[order]
+    self._index_starts = np.searchsorted(cells[order], np.arange(gw*gh + 1))  # where each cell's items start
+    self._index_quantity = q
+
+  def exposedItems(self, rect):
+    '''Return an array of the indexes, in order, of the items that might paint within QRectF `rect`,
+    or None if that might be all of them.'''
+    br = self._boundingRect
+    if rect.contains(br):
+      return None
+    CELL = self.INDEX_CELL
+    (gh, gw) = self._index_shape
+    x0 = max(0, int((rect.left() - br.left()) // CELL))
+    x1 = min(gw-1, int((rect.right() - br.left()) // CELL))
+    y0 = max(0, int((rect.top() - br.top()) // CELL))
+    y1 = min(gh-1, int((rect.bottom() - br.top()) // CELL))
+    if x0 > x1 or y0 > y1:
+      return np.empty(0, dtype=int)
+    starts = self._index_starts
+    idxs = np.unique(np.concatenate([ self._index_items[starts[y*gw + x0] : starts[y*gw + x1 + 1]]
+                                      for y in range(y0, y1+1) ]))
+    idxs = idxs[idxs < self._quantity]
+    b = self._index_bounds[idxs]
+    return idxs[ (b[:,0] < rect.right()) & (b[:,2] > rect.left()) & (b[:,1] < rect.bottom()) & (b[:,3] > rect.top()) ]
 
   def computeGradient(self):
-    if self._fill_gradients is None or len(self._fill_gradients) < self._quantity:
-      #t0 = time.perf_counter()
-      self.computeColor()
-      self.computeXforms()
+    q = self._quantity
+    if self._fill_gradients is None:
       self._fill_gradients = []
-      p0 = QtCore.QPointF(-1,0)
-      p1 = QtCore.QPointF( 1,0)
-      for i in range(self._quantity):
-        xfmap = self._xform[i].map
-        # QLinearGradient takes the pixel coordinates of the start and end stops.
-        g = QtGui.QLinearGradient( xfmap(p0), xfmap(p1) )
-        c1 = QtGui.QColor(self._color[i])
-        a1 = 255 - int((255-self._min_opacity) * self._rnd_opacities[i])
-        c1.setAlpha(a1)
-        g.setColorAt(0.0, c1)
-        c2 = QtGui.QColor(self._color[i])
-        a2 = min(a1, self._gradient_opacity)
-        c2.setAlpha(a2)
-        g.setColorAt(1.0, c2)
-        self._fill_gradients.append(g)
-      #print('computeGradient {:.2f} hz'.format(1/(time.perf_counter() - t0)))
+    n = len(self._fill_gradients)
+    #t0 = time.perf_counter()
+    # QLinearGradient takes the pixel coordinates of the start and end stops,
+    # which are where (-1,0) and (1,0) map to.
+    xform = self._xform[n:q]
+    x0s = (xform[:,0,2] - xform[:,0,0]).tolist()
+    y0s = (xform[:,1,2] - xform[:,1,0]).tolist()
+    x1s = (xform[:,0,2] + xform[:,0,0]).tolist()
+    y1s = (xform[:,1,2] + xform[:,1,0]).tolist()
+    colors = self._color[n:q].tolist()
+    opacities = self._rnd_opacities[n:q].tolist()
+    for i in range(q-n):
+      g = QtGui.QLinearGradient( x0s[i], y0s[i], x1s[i], y1s[i] )
+      c1 = QtGui.QColor(*colors[i])
+      a1 = 255 - int((255-self._min_opacity) * opacities[i])
+      c1.setAlpha(a1)
+      g.setColorAt(0.0, c1)
+      c2 = QtGui.QColor(*colors[i])
+      a2 = min(a1, self._gradient_opacity)
+      c2.setAlpha(a2)
+      g.setColorAt(1.0, c2)
+      self._fill_gradients.append(g)
+    #print('computeGradient {:.2f} hz'.format(1/(time.perf_counter() - t0)))
 
   def computeSpecular(self):
-    if self._specularGradient is None or len(self._specularGradient) < self._quantity or self._bevelGradient is None or len(self._bevelGradient) < self._quantity:
-      self.computeXforms()
+    'Compute specular gloss gradients'
+    q = self._quantity
+    if self._specularGradient is None:
       self._specularGradient = []
+    n = len(self._specularGradient)
+    light_source_xy = self.scene().light.pos()
+    light_color = self.scene().light.color()
+    invisible_light = QtGui.QColor(light_color)
+    invisible_light.setAlpha(0)
+    for i in range(n, q):
+      lightDist = self._lightDists[i]     # distance to center of shape
+      r = self._xformed_radii[i]
+      L = int(self._illuminances[i] * self._specularBrightness)
+      prime_gradius = max(lightDist,r) + (r * (self._specularDepth-50)/100)
+      gradius_radius = r * (100 - self._specularSharpness) / 100
+      inner_gradius = prime_gradius - gradius_radius
+      outer_gradius = prime_gradius + gradius_radius
+      g = QtGui.QRadialGradient(light_source_xy, outer_gradius, light_source_xy, inner_gradius) # smooth
+      #g = QtGui.QRadialGradient(light_source_xy, max(lightDist,r), light_source_xy, max(lightDist,r)-2) # sharp
+      '''
+        Reading the Qt source code, it appears that the default ColorInterpolation mode causes
+        at least 50 stops to be generated for any gradient whose alpha value isn't constant!
+        PyQt doesn't export access to QGradient.setInterpolationMode!
+        Also, this appears to somehow be what triggers rendering as raster images embedded inside SVG!
+      '''
+      #g.setInterpolationMode(QtGui.QGradient.ComponentInterpolation)
+      c1 = QtGui.QColor(light_color)
+      c1.setAlpha(L)
+      g.setColorAt(0.0, c1)
+      g.setColorAt(1.0, invisible_light)
+      self._specularGradient.append(g)
+
+  def computeBevel(self):
+    'Compute (specular) bevel gradients'
+    q = self._quantity
+    if self._bevelGradient is None:
       self._bevelGradient = []
-      light_source_xy = self.scene().light.pos()
-      light_color = self.scene().light.color()
-      invisible_light = QtGui.QColor(light_color)
-      invisible_light.setAlpha(0)
-      for i in range(self._quantity):
-        lightDist = self._lightDists[i]     # distance to center of shape
-        r = self._xformed_shapes[i]._radius
-        L = self._illuminances[i] * self._specularBrightness
-
-        # Compute specular gloss
-        prime_gradius = max(lightDist,r) + (r * (self._specularDepth-50)/100)
-        gradius_radius = r * (100 - self._specularSharpness) / 100
-        inner_gradius = prime_gradius - gradius_radius
-        outer_gradius = prime_gradius + gradius_radius
-        g = QtGui.QRadialGradient(light_source_xy, outer_gradius, light_source_xy, inner_gradius) # smooth
-        #g = QtGui.QRadialGradient(light_source_xy, max(lightDist,r), light_source_xy, max(lightDist,r)-2) # sharp
-        '''
-          Reading the Qt source code, it appears that the default ColorInterpolation mode causes
-          at least 50 stops to be generated for any gradient whose alpha value isn't constant!
-          PyQt doesn't export access to QGradient.setInterpolationMode!
-          Also, this appears to somehow be what triggers rendering as raster images embedded inside SVG!
-        '''
-        #g.setInterpolationMode(QtGui.QGradient.ComponentInterpolation)
-        c1 = QtGui.QColor(light_color)
-        c1.setAlpha(L)
-        g.setColorAt(0.0, c1)
-        g.setColorAt(1.0, invisible_light)
-        self._specularGradient.append(g)
-
-        # Compute (specular) bevel gradient
-        g2 = QtGui.QRadialGradient(light_source_xy, max(lightDist+r,r), light_source_xy, max(lightDist,r)-r) # smooth
-        c2 = QtGui.QColor(light_color)
-        c2.setAlpha(L)
-        g2.setColorAt(0.0, c2)
-        c0 = QtGui.QColor(self._color[i])
-        c0.setAlpha(0)
-        g2.setColorAt(0.5, c0)
-        g2.setColorAt(1.0, QtGui.QColor(0,0,0,L))
-        self._bevelGradient.append(g2)
+    n = len(self._bevelGradient)
+    light_source_xy = self.scene().light.pos()
+    light_color = self.scene().light.color()
+    colors = self._color[:q].tolist()
+    for i in range(n, q):
+      lightDist = self._lightDists[i]     # distance to center of shape
+      r = self._xformed_radii[i]
+      L = int(self._illuminances[i] * self._specularBrightness)
+      g2 = QtGui.QRadialGradient(light_source_xy, max(lightDist+r,r), light_source_xy, max(lightDist,r)-r) # smooth
+      c2 = QtGui.QColor(light_color)
+      c2.setAlpha(L)
+      g2.setColorAt(0.0, c2)
+      c0 = QtGui.QColor(*colors[i])
+      c0.setAlpha(0)
+      g2.setColorAt(0.5, c0)
+      g2.setColorAt(1.0, QtGui.QColor(0,0,0,L))
+      self._bevelGradient.append(g2)
+
+  BEVEL_WIDTH_STEPS = 16   # steps per octave that bevel widths (relative to each shape's scale) are rounded to
+
+  def computeBevelWidths(self):
+    '''Compute the bevel width of each shape in the coordinates of its template, or just any missing ones.
+    Widths are rounded (to within about 2%), so that only a few bevel paths per template are needed
+    (see Shape.bevelPath()).  Shapes scaled to nothing get a width of 0, meaning no bevel.'''
+    q = self._quantity
+    n = 0 if self._bevel_widths is None else len(self._bevel_widths)
+    xform = self._xform[n:q]
+    scales = np.hypot(xform[:,0,0], xform[:,1,0])
+    widths = np.zeros(q-n)
+    some = (scales > 0) & (self._bevelThickness > 0)
+    steps = np.rint(np.log2(self._bevelThickness / scales[some]) * self.BEVEL_WIDTH_STEPS)
+    widths[some] = np.exp2(steps / self.BEVEL_WIDTH_STEPS)
+    self._bevel_widths = widths if n == 0 else np.concatenate((self._bevel_widths, widths))
+
+  SPRITE_PALETTE = 64   # most colors to tint the sprite atlas in
+
+  def computeSprites(self):
+    '''Make a sprite atlas of the templates in a palette of the most common colors (if there isn't one yet),
+    and pick the atlas row (palette color) nearest the color of each item, or just of any missing ones.'''
+    q = self._quantity
+    n = 0 if self._sprite_rows is None else len(self._sprite_rows)
+    colors = self._color[n:q,:3].astype(int)
+    if n == 0:
+      # Group colors by their top 4 bits per channel, and make a palette color of the average of each of the biggest groups.
+      keys = (colors >> 4) @ (256, 16, 1)
+      (uniq, groups, counts) = np.unique(keys, return_inverse=True, return_counts=True)
+      biggest = np.argsort(-counts, kind='stable')[:self.SPRITE_PALETTE]
+      sums = np.column_stack([ np.bincount(groups, weights=colors[:,c], minlength=len(uniq)) for c in range(3) ])
+      palette = np.rint(sums[biggest] / counts[biggest,np.newaxis]).astype(int)
+      self._sprite_atlas = SpriteAtlas(self._shapes, palette.tolist(), self._edgeThickness)
+    palette = np.array(self._sprite_atlas.palette(), dtype=int).reshape(-1, 3)
+    if len(palette):
+      dists = (colors**2).sum(axis=1)[:,np.newaxis] - 2 * colors @ palette.T + (palette**2).sum(axis=1)
+      rows = 1 + np.argmin(dists, axis=1)
+    else:
+      rows = np.empty(0, dtype=int)
+    self._sprite_rows = rows if n == 0 else np.concatenate((self._sprite_rows, rows))
+
+  BATCH_CELL = 16   # size (px) of grid cells used to detect possible overlap between shapes being batched
+
+  def computeBatches(self):
+    '''Group flat color shapes (and their shadows) into batches, each of which can be drawn with one drawPath().
+    Shapes are appended to the most recent batch of the same color (and shadows to the most recent shadow batch)
+    unless that would draw them before, or in the same path as, something they might overlap,
+    so the result looks the same as drawing every shape in order.  Overlap is conservatively
+    judged by which grid cells the bounds of each shape and shadow touch.
+    Batching state is kept so that more shapes can be appended when the quantity grows.'''
+    q = self._quantity
+    br = self._boundingRect
+    CELL = self.BATCH_CELL
+    if self._batch_of_item is None:
+      self._batch_of_item = []    # index into self._batches of each item's (fill) batch
+      self._batches = []          # list of [color key, QPainterPath], in drawing order; shadows have key -1
+      self._batch_latest = {}     # color key -> index of the latest batch with that key
+      self._batch_cells = np.full( (int(br.height()) // CELL + 1, int(br.width()) // CELL + 1), -1, dtype=np.int32 )
+                                  # index of the latest batch touching each grid cell
+    n = len(self._batch_of_item)
+    if n >= q:
+      return
+    # Quantize colors, keeping the middle of each quantization step.
+    drop = 8 - self._batchColorBits
+    rgb = (self._color[n:q,:3].astype(np.int32) >> drop << drop) + (1 << drop >> 1)
+    keys = ((rgb[:,0] << 16) | (rgb[:,1] << 8) | rgb[:,2]).tolist()
+    bounds = self._shape_bounds[n:q].copy()
+    m = self._edgeThickness / 2 + 1       # margin for the pen and antialiasing
+    bounds += (-m - br.left(), -m - br.top(), m - br.left(), m - br.top())
+    (gh, gw) = self._batch_cells.shape
+    def cellRanges(bounds):
+      c = np.floor(bounds / CELL).astype(int)
+      c[:,2:] += 1
+      c[:,0::2] = np.clip(c[:,0::2], 0, gw)
+      c[:,1::2] = np.clip(c[:,1::2], 0, gh)
+      return c.tolist()
+    fill_cells = cellRanges(bounds)
+    shadows = bool(self._shadow_opacity) and not self._mergedShadows
+    if shadows:
+      shadow_cells = cellRanges(bounds + np.tile(np.column_stack((self._shadow_dxs[n:q], self._shadow_dys[n:q])), 2))
+    cells = self._batch_cells
+    latest = self._batch_latest
+    batches = self._batches
+    def add(key, x0, y0, x1, y1):
+      'Return index of the batch to append a shape with the given key and cell range to.'
+      if x0 >= x1 or y0 >= y1:
+        return None                 # entirely outside the bounding rect, so never visible
+      region = cells[y0:y1, x0:x1]
+      b = latest.get(key, -1)
+      if b <= region.max():
+        b = len(batches)
+        batches.append([key, QtGui.QPainterPath()])
+        latest[key] = b
+      region[...] = b
+      return b
+    for i in range(q-n):
+      (shp, pts, r) = self.xformedShape(n+i)
+      if shadows:
+        b = add(-1, *shadow_cells[i])
+        if not b is None:
+          shp.addToPath(batches[b][1], pts + (self._shadow_dxs[n+i], self._shadow_dys[n+i]), r)
+      b = add(keys[i], *fill_cells[i])
+      self._batch_of_item.append(b)
+      if not b is None:
+        shp.addToPath(batches[b][1], pts, r)
+
+  SHADOW_PATH_CHUNK = 16   # shadows per path; the raster engine is very slow to fill paths of many overlapping shapes
+
+  def computeShadowPaths(self):
+    q = self._quantity
+    n = self._shadow_paths_quantity
+    if n is None:
+      n = 0
+      self._shadow_paths = []
+    for i in range(n, q):
+      if i % self.SHADOW_PATH_CHUNK == 0:
+        path = QtGui.QPainterPath()
+        path.setFillRule(QtCore.Qt.WindingFill)   # so overlapping shadows merge
+        self._shadow_paths.append(path)
+      (shp, pts, r) = self.xformedShape(i)
+      shp.addToPath(self._shadow_paths[-1], pts + (self._shadow_dxs[i], self._shadow_dys[i]), r)
+    self._shadow_paths_quantity = q
+    self._shadow_mask = None
+
+  def paintMergedShadows(self, painter):
+    '''Paint all the shadows at once, as a single translucent layer under all the shapes.
+    This is much faster than painting each shadow just before its shape, but shadows no longer
+    darken the shapes beneath them, and all shadows have the same (Shadow Opacity) alpha,
+    regardless of the opacity of their shape.'''
+    painter.setPen(QtCore.Qt.NoPen)
+    if painter.paintEngine().type() != QtGui.QPaintEngine.Raster:
+      # Keep vector output (e.g. SVG) as vectors, in a single path so that overlaps merge.
+      path = QtGui.QPainterPath()
+      path.setFillRule(QtCore.Qt.WindingFill)
+      for chunk in self._shadow_paths:
+        path.addPath(chunk)
+      painter.setBrush(QtGui.QColor(0,0,0,self._shadow_opacity))
+      painter.drawPath(path)
+      return
+    # Rasterize the shadows once into an alpha mask in device pixels, and reuse it while the view is unchanged.
+    dev = painter.device()
+    xf = painter.worldTransform()
+    rect = xf.mapRect(self._boundingRect).toAlignedRect().intersected(QtCore.QRect(0, 0, dev.width(), dev.height()))
+    if rect.isEmpty():
+      return
+    key = (xf, rect, dev.devicePixelRatioF(), painter.testRenderHint(QtGui.QPainter.Antialiasing))
+    entry = self._shadow_mask     # (read once, since tiles may be painted concurrently)
+    if entry is None or entry[0] != key:
+      dpr = dev.devicePixelRatioF()
+      mask = QtGui.QImage(rect.size() * dpr, QtGui.QImage.Format_Alpha8)
+      mask.setDevicePixelRatio(dpr)
+      mask.fill(0)
+      p = QtGui.QPainter(mask)
+      p.setRenderHint(QtGui.QPainter.Antialiasing, key[3])
+      p.setTransform(xf * QtGui.QTransform.fromTranslate(-rect.left(), -rect.top()))
+      p.setPen(QtCore.Qt.NoPen)
+      p.setBrush(QtCore.Qt.black)
+      for chunk in self._shadow_paths:
+        p.drawPath(chunk)
+      p.end()
+      entry = self._shadow_mask = (key, mask)
+    painter.save()
+    painter.resetTransform()
+    painter.setOpacity(painter.opacity() * self._shadow_opacity / 255)
+    painter.drawImage(rect.topLeft(), entry[1])
+    painter.restore()
+
+  def wantedDetail(self):
+    'Return the Detail to paint at when there is time to paint everything.'
+    return Detail( shadows = bool(self._shadow_opacity)
+                 , gradients = not (self._min_opacity == 255 and self._gradient_opacity == 255)
+                 , edges = self._edgeThickness > 1
+                 , specular = bool(self._specularBrightness)
+                 , bevel = bool(self._bevelThickness)
+                 , stride = 1 )
+
+  def paintDetail(self):
+    'Return the Detail to paint the next frame at: everything, unless a slider is being dragged (without sprite drafts).'
+    wanted = self.wantedDetail()
+    if self._pressed_render and not (self.drafting() or self.rasterizes()):
+      return self._lod.choose(self._quantity, wanted)
+    return wanted
+
+  def paintModes(self, detail):
+    'Return whether shapes are to be painted (flat, batched).'
+    flat = not detail.gradients
+    # Batches are only for when every shape is a flat color, and every shadow is the same color.
+    batched = self._batchedDraw and flat and not (detail.specular or detail.bevel)
+    return (flat, batched)
+
+  def drafting(self):
+    'Return whether paint() is to paint sprites (see paintSprites()).'
+    return self._spriteDrafts and self._pressed_render
+
+  def rasterizes(self, painter=None):
+    'Return whether paint() is to paint with the NumPy rasterizer (see paintRaster()), which only paints raster images.'
+    return self.ENGINES[self._engine] == 'NumPy' and (painter is None or painter.paintEngine().type() == QtGui.QPaintEngine.Raster)
+
+  def preparePaint(self, detail=None, rasterize=None):
+    '''Compute everything paint() will need to paint at `detail` (by default, paintDetail()),
+    with the NumPy rasterizer if `rasterize` (by default, if it is the selected engine),
+    and return whether shapes are (flat, batched).
+    Once this has been called, paint() only reads the cached arrays, so it may be called from several threads
+    (e.g. to paint tiles) at once.'''
+    if detail is None:
+      detail = self.paintDetail()
+    if rasterize is None:
+      rasterize = self.rasterizes()
+    (flat, batched) = self.paintModes(detail)
+    self.require('shapes')
+    self.require('colors')
+    if detail.shadows:
+      self.require('shadows')
+      if self._mergedShadows:
+        self.require('shadowPaths')
+    if self.drafting() or rasterize:
+      self.require('spatialIndex')
+      if self.drafting():
+        self.require('sprites')
+      return (flat, batched)
+    if batched:
+      self.require('batches')
+    else:
+      self.require('spatialIndex')
+      if not flat:
+        self.require('fillGradients')
+      if detail.specular:
+        self.require('specular')
+      if detail.bevel:
+        self.require('bevel')
+        self.require('bevelWidths')
+    return (flat, batched)
 
   def paint(self, painter, option, widget=0):
-    fast = self._pressed_render and self._last_full_render_time > .1
-    faster = fast and self._last_full_render_time > .5
-
-    self.computeXformedShapes()
-    self.computeColor()
-    if not fast:
-      self.computeGradient()
-      if self._specularBrightness or self._bevelThickness:
-        self.computeSpecular()
+    detail = self.paintDetail()
+    rasterize = self.rasterizes(painter)
+    (flat, batched) = self.preparePaint(detail, rasterize)
+    if self.drafting():
+      self.paintSprites(painter, detail, option.exposedRect)
+      return
+    if rasterize:
+      self.paintRaster(painter, detail, option.exposedRect)
+      return
+    # Only views pass a widget; exports (e.g. QGraphicsScene.render()) must be painted all at once.
+    if self._progressive and widget and painter.paintEngine().type() == QtGui.QPaintEngine.Raster:
+      self.paintProgressively(painter, detail, flat, batched)
+      return
+
+    t0 = time.perf_counter()
+    if self.paintItems(painter, 0, detail, flat, batched, exposed=option.exposedRect) is None:
+      return      # abandoned
+    dt = time.perf_counter() - t0
+    print('paint {:.3f} s = {:.2f} hz{}'.format(dt, 1.0/dt, '' if detail == self.wantedDetail() else ' at ' + str(detail)))
+
+  LOD_SAMPLE = 16   # time the parts of painting every this many items, for the level of detail controller
+
+  def paintItems(self, painter, start, detail, flat, batched, deadline=None, exposed=None):
+    '''Paint items from index `start` on, until they are all painted or time.perf_counter() passes `deadline`.
+    If QRectF `exposed` is given, only items that might paint within it are painted.
+    Return the index of the next item to paint, or None if the frame was abandoned as stale.'''
     painter.setClipRect(self._boundingRect)  # To avoid needing clipping, be honest about actual boundingRect
 
     shadow = QtGui.QColor(0,0,0,self._shadow_opacity)
 
     if self._edgeThickness == 0:
       pen = QtCore.Qt.NoPen
-    elif faster:
+    elif not detail.edges:
       pen = QtGui.QPen(QtCore.Qt.black, 1)
     else:
       pen = QtGui.QPen(QtCore.Qt.black, self._edgeThickness)
@@ -743,50 +1375,354 @@ class Confetti(QtWidgets.QGraphicsObject):
     #  painter.setBrush(QtCore.Qt.gray)
 
     t0 = time.perf_counter()
-    for i in range(self._quantity):
-      if self._shadow_opacity:
+    times = { 'shadows': 0.0, 'fill': 0.0, 'specular': 0.0, 'bevel': 0.0 }  # time spent by sampled items
+    shadows = detail.shadows
+    if shadows and self._mergedShadows:
+      if start == 0:
+        self.paintMergedShadows(painter)
+        painter.setPen(pen)
+      merged_time = time.perf_counter() - t0
+      shadows = False
+    if batched:
+      for (j, (key, path)) in enumerate(self._batches):
+        if j % 256 == 0 and self._isStale and self._isStale():
+          return None
+        if key < 0:
+          if not detail.shadows:
+            continue
+          painter.setPen(QtCore.Qt.NoPen)
+          painter.setBrush(shadow)
+        else:
+          painter.setPen(pen)
+          painter.setBrush(QtGui.QColor(key >> 16, (key >> 8) & 255, key & 255))
+        painter.drawPath(path)
+      return self._quantity
+    visible = None if exposed is None else self.exposedItems(exposed)
+    if visible is None:
+      items = range(start, self._quantity, detail.stride)
+      pick = lambda a: a[start:self._quantity:detail.stride].tolist()   # items of per-item array `a`, as a list
+    else:
+      visible = visible[(visible >= start) & ((visible - start) % detail.stride == 0)]
+      items = visible.tolist()
+      pick = lambda a: a[visible].tolist()
+    colors = pick(self._color)
+    insides = pick(self._index_inside)
+    if detail.bevel:
+      bevel_widths = pick(self._bevel_widths)
+      xforms = pick(self._xform.reshape(-1,6))
+    # Clip only shapes that extend outside the bounding rect.
+    clipped = True
+    end = self._quantity
+    painted = len(items)
+    for (j, i) in enumerate(items):
+      if j % 256 == 0 and self._isStale and self._isStale():
+        return None
+      if not deadline is None and time.perf_counter() > deadline:
+        (end, painted) = (i, j)
+        break
+      if insides[j] == clipped:
+        clipped = not clipped
+        painter.setClipping(clipped)
+      (shp, pts, r) = self.xformedShape(i)
+      sample = j % self.LOD_SAMPLE == 0
+      if sample:
+        t = time.perf_counter()
+      if shadows:
         painter.setPen(QtCore.Qt.NoPen)
-        if fast:
+        if flat:
           painter.setBrush(shadow)
         else:
           a1 = 255 - int((255-self._min_opacity) * self._rnd_opacities[i])
-          painter.setBrush(QtGui.QColor(0,0,0,self._shadow_opacity * a1 / 255))
-        self._xformed_shapes[i].paintShadow(painter, self._shadow_dxs[i], self._shadow_dys[i])
+          painter.setBrush(QtGui.QColor(0,0,0,self._shadow_opacity * a1 // 255))
+        shp.paintShadow(painter, pts, r, self._shadow_dxs[i], self._shadow_dys[i])
         painter.setPen(pen)
+        if sample:
+          (t, dt) = (time.perf_counter(), t)
+          times['shadows'] += t - dt
       #if faster:
       #  brush = QtCore.Qt.NoBrush
-      if fast or (self._min_opacity == 255 and self._gradient_opacity == 255):
-        brush = QtGui.QColor(self._color[i])
-        brush.setAlpha(255)
+      if flat:
+        brush = QtGui.QColor(*colors[j])
       else:
         brush = self._fill_gradients[i]
       painter.setBrush(brush)
-      self._xformed_shapes[i].paint(painter)
-      if not fast and self._specularBrightness:
+      shp.paint(painter, pts, r)
+      if sample:
+        (t, dt) = (time.perf_counter(), t)
+        times['fill'] += t - dt
+      if detail.specular:
         # Paint specular highlight
         painter.setBrush(self._specularGradient[i])
-        self._xformed_shapes[i].paint(painter)
-      if not fast and self._bevelThickness:
-        # Paint bevel
+        shp.paint(painter, pts, r)
+        if sample:
+          (t, dt) = (time.perf_counter(), t)
+          times['specular'] += t - dt
+      if detail.bevel:
+        # Paint bevel: the template's inner bevel path, transformed like the shape
+        # (not by the painter, which would also transform the gradient).
         # The bevel is drawn translucently on top of the opaque black edge,
         # so it can be hard to notice that it is on top.
-        path = QtGui.QPainterPath()
-        self._xformed_shapes[i].addToPath(path)
-        path.closeSubpath()
-        stroker = QtGui.QPainterPathStroker()
-        stroker.setWidth(self._bevelThickness*2)
-        strokedPath = stroker.createStroke(path)#.simplified()
-        innerStrokedPath = strokedPath.intersected(path)
         painter.setPen(QtCore.Qt.NoPen)
         painter.setBrush(self._bevelGradient[i])
-        #painter.setClipPath(path)
-        painter.drawPath(innerStrokedPath)
-        #painter.setClipRect(self._boundingRect)
-
-    dt = time.perf_counter() - t0
-    print('paint {:.3f} s = {:.2f} hz'.format(dt, 1.0/dt))
-    if not (fast or faster):
-      self._last_full_render_time = dt
+        if bevel_widths[j]:
+          (m11, m21, dx, m12, m22, dy) = xforms[j]
+          painter.drawPath(QtGui.QTransform(m11, m12, m21, m22, dx, dy).map(shp.bevelPath(bevel_widths[j])))
+        painter.setPen(pen)
+        if sample:
+          times['bevel'] += time.perf_counter() - t
+    if not clipped:
+      painter.setClipping(True)
+    if detail.shadows and self._mergedShadows and painted:
+      times['shadows'] = merged_time * len(range(0, painted, self.LOD_SAMPLE)) / painted
+    self._lod.learn(detail, painted, time.perf_counter() - t0, times, len(range(0, painted, self.LOD_SAMPLE)))
+    return end
+
+  def paintSprites(self, painter, detail, exposed=None):
+    '''Paint every shape, and its shadow if `detail` has shadows, as a sprite from the sprite atlas,
+    all in one drawPixmapFragments().  This is a draft, for while sliders are being dragged:  it costs little
+    more per shape than copying its pixels, but it paints no specular highlights or bevels, fills are flat
+    (translucent by the average opacity of their gradients), colors are reduced to the atlas's palette,
+    and edges are about as thick in pixels as at the sprite's size, however the view is scaled.'''
+    atlas = self._sprite_atlas
+    visible = None if exposed is None else self.exposedItems(exposed)
+    items = slice(0, self._quantity) if visible is None else visible
+    # Clipping and antialiasing the edges of the fragments would each cost about as much as painting them,
+    # and the sprites are antialiased already.
+    painter.setClipRect(self._boundingRect)
+    painter.setClipping(not self._index_inside[items].all())
+    antialias = painter.testRenderHint(QtGui.QPainter.Antialiasing)
+    painter.setRenderHint(QtGui.QPainter.Antialiasing, False)
+    painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform, antialias)
+    xform = self._xform[items]
+    kinds = self._xformed_kinds[items]
+    radii = self._xformed_radii[items]
+    angles = np.degrees(np.arctan2(xform[:,1,0], xform[:,0,0]))
+    scale = math.sqrt(abs(painter.worldTransform().determinant()))
+    alphas = np.ones(len(kinds))
+    opacities = alphas
+    if detail.gradients:
+      a1 = 255 - ((255 - self._min_opacity) * self._rnd_opacities[items]).astype(int)
+      alphas = a1 / 255
+      opacities = (a1 + np.minimum(a1, self._gradient_opacity)) / 510
+    fragments = atlas.fragments(kinds, self._sprite_rows[items], xform[:,0,2], xform[:,1,2], radii, angles, opacities, scale)
+    if detail.shadows and self._mergedShadows:
+      self.paintMergedShadows(painter)
+    elif detail.shadows:
+      # Interleave each shadow just before its shape.
+      shadows = atlas.fragments(kinds, 0, xform[:,0,2] + self._shadow_dxs[items], xform[:,1,2] + self._shadow_dys[items]
+                               , radii, angles, alphas * self._shadow_opacity / 255, scale)
+      fragments = np.stack((shadows, fragments), axis=1).reshape(-1, 10)
+    atlas.paint(painter, fragments)
+    painter.setClipping(True)
+    painter.setRenderHint(QtGui.QPainter.Antialiasing, antialias)
+
+  def paintRaster(self, painter, detail, exposed=None):
+    '''Paint the shapes within `exposed` (by default, all of them) and their shadows with the NumPy rasterizer,
+    into an image in device pixels, and draw that.  Fills are flat or gradients, but there are no specular
+    highlights or bevels, and circles are circles in device pixels however the view is scaled.'''
+    dev = painter.device()
+    dpr = dev.devicePixelRatioF()
+    xf = painter.worldTransform()
+    shown = self._boundingRect if exposed is None else exposed.intersected(self._boundingRect)
+    rect = xf.mapRect(shown).toAlignedRect().intersected(QtCore.QRect(0, 0, dev.width(), dev.height()))
+    if rect.isEmpty():
+      return
+    visible = self.exposedItems(xf.inverted()[0].mapRect(QtCore.QRectF(rect)))
+    items = np.arange(self._quantity) if visible is None else visible
+    # The affine transform from item coordinates to pixels of the image.
+    dxf = xf * QtGui.QTransform.fromTranslate(-rect.left(), -rect.top()) * QtGui.QTransform.fromScale(dpr, dpr)
+    linear = np.array([[dxf.m11(), dxf.m21()], [dxf.m12(), dxf.m22()]])
+    translation = np.array([dxf.dx(), dxf.dy()])
+    scale = math.sqrt(abs(np.linalg.det(linear)))
+    kinds = self._xformed_kinds[items]
+    rows = np.empty(len(items), dtype=int)
+    outlines = []
+    for (k, shp) in enumerate(self._shapes):
+      idxs = np.flatnonzero(kinds == k)
+      rows[idxs] = np.arange(len(idxs))
+      pts = self._xformed_points[k][self._xformed_rows[items[idxs]]] @ linear.T + translation
+      outlines.append(shp.rasterOutline(pts, self._xformed_radii[items[idxs]] * scale))
+    if self._edgeThickness == 0:
+      pen = 0
+    elif not detail.edges:
+      pen = scale
+    else:
+      pen = self._edgeThickness * scale
+    xform = self._xform[items]
+    rgb = self._color[items,:3] / 255
+    alphas = np.ones((len(items), 2))
+    ramps = np.zeros((len(items), 4))
+    if detail.gradients:
+      # Each gradient runs across the shape from where its transform maps (-1,0) to where it maps (1,0).
+      a1 = 255 - ((255 - self._min_opacity) * self._rnd_opacities[items]).astype(int)
+      alphas[:,0] = a1 / 255
+      alphas[:,1] = np.minimum(a1, self._gradient_opacity) / 255
+      ramps[:,:2] = (xform[:,:,2] - xform[:,:,0]) @ linear.T + translation
+      d = 2 * xform[:,:,0]
+      ramps[:,2:] = (d / (d**2).sum(axis=1)[:,np.newaxis]) @ np.linalg.inv(linear)   # (in item coordinates, then mapped)
+    shapes = rasterizer.Primitives(kinds, rows, np.zeros((len(items), 2)), rgb, alphas, ramps, np.full(len(items), pen))
+    (width, height) = (int(round(rect.width() * dpr)), int(round(rect.height() * dpr)))
+    antialias = painter.testRenderHint(QtGui.QPainter.Antialiasing)
+    canvas = None
+    if detail.shadows:
+      offsets = np.column_stack((self._shadow_dxs[items], self._shadow_dys[items])) @ linear.T
+      shadow_alphas = np.full((len(items), 2), self._shadow_opacity / 255)
+      if detail.gradients:
+        shadow_alphas *= alphas[:,:1]
+      shadows = shapes._replace(offsets=offsets, rgb=np.zeros((len(items), 3)), alphas=shadow_alphas
+                               , ramps=np.zeros((len(items), 4)), pens=np.zeros(len(items)))
+      if self._mergedShadows:
+        canvas = np.zeros((width * height, 4), dtype=np.float32)
+        canvas[:,3] = rasterizer.rasterizeUnion(width, height, outlines, shadows, antialias) * self._shadow_opacity / 255
+      else:
+        # Interleave each shadow just before its shape.
+        shapes = rasterizer.Primitives(*( np.stack((a, b), axis=1).reshape((-1,) + a.shape[1:]) for (a, b) in zip(shadows, shapes) ))
+    canvas = rasterizer.rasterize(width, height, outlines, shapes, antialias, canvas)
+    img = rasterizer.toQImage(canvas, width, height)
+    img.setDevicePixelRatio(dpr)
+    painter.save()
+    painter.resetTransform()
+    painter.drawImage(rect.topLeft(), img)
+    painter.restore()
+
+  SVG_CHUNK = 1024    # items written to an SVG file at a time
+
+  def writeSvg(self, svg):
+    '''Write all the shapes, with everything wantedDetail() paints, to SvgWriter `svg`.
+    Each template shape is defined once, and each shape (and its shadow, specular highlight and bevel) is a
+    transformed <use> of it.  Fill gradients are defined in template coordinates, where they all run from
+    (-1,0) to (1,0), so every shape of the same color and opacities shares one.  The specular highlight and
+    bevel gradients are centered on the light, so each shape has its own.'''
+    detail = self.wantedDetail()
+    self.require('shapes')
+    self.require('colors')
+    if detail.shadows:
+      self.require('shadows')
+    if detail.specular:
+      self.require('specular')
+    if detail.bevel:
+      self.require('bevel')
+      self.require('bevelWidths')
+    q = self._quantity
+    num = svgwriter.num
+    templates = [ svg.define(shp.svgTemplate(), 't') for shp in self._shapes ]
+    kinds = self._xformed_kinds[:q].tolist()
+    xform = self._xform[:q]
+    scales = np.hypot(xform[:,0,0], xform[:,1,0])
+    # SVG matrix(a b c d e f) maps (x,y) to (a*x + c*y + e, b*x + d*y + f).
+    abcds = xform[:,[0,1,0,1],[0,0,1,1]].tolist()
+    abcd = [ ' '.join(map(num, m)) for m in abcds ]
+    (es, fs) = (xform[:,0,2].tolist(), xform[:,1,2].tolist())
+    if self._edgeThickness == 0:
+      pen = 0
+    elif not detail.edges:
+      pen = 1
+    else:
+      pen = self._edgeThickness
+    colors = [ '#{:02x}{:02x}{:02x}'.format(*c) for c in self._color[:q,:3].tolist() ]
+    a1s = (255 - ((255 - self._min_opacity) * self._rnd_opacities[:q]).astype(int)).tolist()
+    shadow = ''
+    if detail.shadows:
+      (dxs, dys) = (self._shadow_dxs[:q].tolist(), self._shadow_dys[:q].tolist())
+      if self._mergedShadows:
+        # Black shapes in a translucent group merge just like the winding-filled path of paintMergedShadows().
+        svg.beginGroup(opacity=self._shadow_opacity / 255, attributes='fill="#000"')
+        for start in range(0, q, self.SVG_CHUNK):
+          svg.write(''.join( '<use xlink:href="#{}" transform="matrix({} {} {})"/>\n'.format(
+                                templates[kinds[i]], abcd[i], num(es[i] + dxs[i]), num(fs[i] + dys[i]))
+                             for i in range(start, min(q, start + self.SVG_CHUNK)) if scales[i] > 0 ))
+        svg.endGroup()
+      else:
+        shadow = '<use xlink:href="#{t}" transform="matrix({m} {sx} {sy})" fill="#000" fill-opacity="{so}" stroke="none"/>\n'
+    svg.beginGroup(clip=self._boundingRect, attributes=svgwriter.penAttributes(QtGui.QPen(QtCore.Qt.black, pen) if pen else QtCore.Qt.NoPen))
+    for start in range(0, q, self.SVG_CHUNK):
+      out = []
+      for i in range(start, min(q, start + self.SVG_CHUNK)):
+        if scales[i] <= 0:
+          continue
+        (t, m, e, f) = (templates[kinds[i]], abcd[i], num(es[i]), num(fs[i]))
+        stroke = ' stroke-width="{}"'.format(num(pen / scales[i])) if pen else ''  # (in template coordinates)
+        if shadow:
+          so = self._shadow_opacity * a1s[i] // 255 / 255 if detail.gradients else self._shadow_opacity / 255
+          out.append(shadow.format(t=t, m=m, sx=num(es[i] + dxs[i]), sy=num(fs[i] + dys[i]), so=num(so)))
+        if detail.gradients:
+          stops = ('<stop offset="0" stop-color="{c}" stop-opacity="{a1}"/><stop offset="1" stop-color="{c}" stop-opacity="{a2}"/>'
+                   .format(c=colors[i], a1=num(a1s[i] / 255), a2=num(min(a1s[i], self._gradient_opacity) / 255)))
+          fill = 'url(#{})'.format(svg.define('<linearGradient id="{id}" gradientUnits="userSpaceOnUse" x1="-1" y1="0" x2="1" y2="0">'
+                                              + stops + '</linearGradient>', 'g'))
+        else:
+          fill = colors[i]
+        out.append('<use xlink:href="#{}" transform="matrix({} {} {})" fill="{}"{}/>\n'.format(t, m, e, f, fill, stroke))
+        if detail.specular or (detail.bevel and self._bevel_widths[i]):
+          ixf = QtGui.QTransform(*abcds[i], es[i], fs[i])
+        if detail.specular:
+          g = svg.gradient(self._specularGradient[i], ixf)
+          out.append('<use xlink:href="#{}" transform="matrix({} {} {})" fill="url(#{})"{}/>\n'.format(t, m, e, f, g, stroke))
+        if detail.bevel and self._bevel_widths[i]:
+          path = self._shapes[kinds[i]].bevelPath(self._bevel_widths[i])
+          b = svg.define('<path id="{{id}}" fill-rule="{}" d="{}"/>'.format(
+                           'nonzero' if path.fillRule() == QtCore.Qt.WindingFill else 'evenodd', svgwriter.pathData(path)), 'b')
+          g = svg.gradient(self._bevelGradient[i], ixf)
+          out.append('<use xlink:href="#{}" transform="matrix({} {} {})" fill="url(#{})" stroke="none"/>\n'.format(b, m, e, f, g))
+      svg.write(''.join(out))     # (after any definitions made along the way)
+    svg.endGroup()
+
+  PROGRESS_BUDGET = .016  # seconds of painting per frame when painting progressively
+
+  def paintProgressively(self, painter, detail, flat, batched):
+    '''Paint items in index order into a persistent backing image for at most PROGRESS_BUDGET seconds,
+    show the backing image, and if any items are left, schedule another frame to paint some more.
+    Anything that calls update() starts the backing image over, as does any change in how it maps to the device.'''
+    dev = painter.device()
+    xf = painter.worldTransform()
+    rect = xf.mapRect(self._boundingRect).toAlignedRect().intersected(QtCore.QRect(0, 0, dev.width(), dev.height()))
+    if rect.isEmpty():
+      return
+    key = (xf, rect, dev.devicePixelRatioF(), painter.testRenderHint(QtGui.QPainter.Antialiasing), detail)
+    if self._progress is None or self._progress[0] != key:
+      dpr = dev.devicePixelRatioF()
+      backing = QtGui.QImage(rect.size() * dpr, QtGui.QImage.Format_ARGB32_Premultiplied)
+      backing.setDevicePixelRatio(dpr)
+      backing.fill(QtCore.Qt.transparent)
+      self._progress = [key, backing, 0]    # [key, backing image, index of next item to paint]
+    (key, backing, start) = self._progress
+    if start < self._quantity:
+      t0 = time.perf_counter()
+      p = QtGui.QPainter(backing)
+      p.setRenderHint(QtGui.QPainter.Antialiasing, key[3])
+      p.setTransform(xf * QtGui.QTransform.fromTranslate(-rect.left(), -rect.top()))
+      self._progress[2] = self.paintItems(p, start, detail, flat, batched, t0 + self.PROGRESS_BUDGET)
+      p.end()
+      if self._progress[2] < self._quantity and not self._progress_scheduled:
+        self._progress_scheduled = True
+        QtCore.QTimer.singleShot(0, self.continueProgress)
+    painter.save()
+    painter.resetTransform()
+    painter.drawImage(rect.topLeft(), backing)
+    painter.restore()
+
+  def continueProgress(self):
+    self._progress_scheduled = False
+    if not self._progress is None:
+      self._generation += 1
+      super().update()    # (not self.update(), which would start over)
+
+  def update(self, *args):
+    'Schedule a repaint, starting any progressive painting over.'
+    self._progress = None
+    self._generation += 1
+    super().update(*args)
+
+  def generation(self):
+    'Return a number that changes whenever this needs repainting (see LayerCompositor).'
+    return self._generation
+
+  def snapshot(self):
+    '''Prepare to paint, and return a copy of everything paint() reads, which can then be painted
+    on another thread (e.g. by an async view) while this Confetti goes on changing.'''
+    detail = self.paintDetail()
+    self.preparePaint(detail)
+    return ConfettiSnapshot(self, detail)
 
   def startPressedRender(self):
     self._pressed_render = True
@@ -801,7 +1737,14 @@ class Confetti(QtWidgets.QGraphicsObject):
     return (label, slider)
 
   def addWidgetsTo(self, layout):
-    self.addSliderTo(layout, 'Quantity', 1, self._max_quantity, self._quantity, self.setQuantity)
+    label = QtWidgets.QLabel('Render Engine:')
+    layout.addWidget(label)
+    combox = QtWidgets.QComboBox()
+    combox.addItems(['QPainter', 'NumPy (raster images, no specular or bevel, up to 1M shapes)'])
+    combox.setCurrentIndex(self._engine)
+    layout.addWidget(combox)
+    combox.currentIndexChanged.connect(self.setEngine)
+    (label, self._quantitySlider) = self.addSliderTo(layout, 'Quantity', 1, self._max_quantity, self._quantity, self.setQuantity)
     setter = lambda shp: lambda value: self.setShapeQuantity(shp, value)  # curry setShapeQuantity
     for i in range(len(self._shapes)):
       self.addSliderTo(layout, self._shapes[i]._name, 0, 100, self._shapes[i].qty, setter(self._shapes[i]))
@@ -830,6 +1773,66 @@ class Confetti(QtWidgets.QGraphicsObject):
     self.addSliderTo(layout, 'Specular Sharpness', 1, 100, self._specularSharpness, self.setSpecularSharpness)
     self.addSliderTo(layout, 'Specular Depth', 1, 100, self._specularDepth, self.setSpecularDepth)
     self.addSliderTo(layout, 'Bevel Thickness', 0, 64, self._bevelThickness, self.setBevelThickness)
+    chkbox = QtWidgets.QCheckBox('Merged Shadows (faster, but only on background)')
+    chkbox.setCheckState((QtCore.Qt.Unchecked,QtCore.Qt.Checked)[self._mergedShadows])
+    layout.addWidget(chkbox)
+    chkbox.stateChanged.connect(self.setMergedShadows)
+    chkbox = QtWidgets.QCheckBox('Batched Drawing (flat colors only)')
+    chkbox.setCheckState((QtCore.Qt.Unchecked,QtCore.Qt.Checked)[self._batchedDraw])
+    layout.addWidget(chkbox)
+    chkbox.stateChanged.connect(self.setBatchedDraw)
+    self.addSliderTo(layout, 'Batch Color Bits', 1, 8, self._batchColorBits, self.setBatchColorBits)
+    chkbox = QtWidgets.QCheckBox('Sprite Drafts (while dragging)')
+    chkbox.setCheckState((QtCore.Qt.Unchecked,QtCore.Qt.Checked)[self._spriteDrafts])
+    layout.addWidget(chkbox)
+    chkbox.stateChanged.connect(self.setSpriteDrafts)
+    chkbox = QtWidgets.QCheckBox('Progressive Painting (a few shapes per frame)')
+    chkbox.setCheckState((QtCore.Qt.Unchecked,QtCore.Qt.Checked)[self._progressive])
+    layout.addWidget(chkbox)
+    chkbox.stateChanged.connect(self.setProgressive)
+    self.addSliderTo(layout, 'Target Frame Time (ms, while dragging)', 10, 500, int(self._lod.targetTime*1000), self.setTargetFrameTime)
     
     #for i in range(32):
     #  layout.addWidget(QtWidgets.QSlider(QtCore.Qt.Horizontal))
+
+
+class ConfettiSnapshot:
+
+  '''The painting state of a Confetti at one moment.
+  Cached arrays are only ever replaced or appended to (never modified in place), so they are shared
+  with the Confetti, but paths that may yet be appended to are copied (which is cheap, as they are implicitly shared).'''
+
+  def __init__(self, confetti, detail):
+    self.__dict__.update(confetti.__dict__)
+    self._detail = detail
+    self._learnedBy = confetti._lod
+    self._lod = LearningLog()     # (the Confetti's own is only for the GUI thread; see finish())
+    if not self._batches is None:
+      self._batches = [ [key, QtGui.QPainterPath(path)] for (key, path) in self._batches ]
+    if not self._shadow_paths is None:
+      self._shadow_paths = [ QtGui.QPainterPath(path) for path in self._shadow_paths ]
+
+  def finish(self):
+    'Pass on what painting this snapshot learned about the costs of detail.  Called on the GUI thread once it is painted.'
+    self._lod.replayInto(self._learnedBy)
+
+  def paintDetail(self):
+    return self._detail
+
+  def preparePaint(self, detail=None, rasterize=None):
+    return self.paintModes(self._detail)    # everything was already computed by Confetti.snapshot()
+
+  LOD_SAMPLE = Confetti.LOD_SAMPLE
+  INDEX_CELL = Confetti.INDEX_CELL
+  exposedItems = Confetti.exposedItems
+  wantedDetail = Confetti.wantedDetail
+  paintModes = Confetti.paintModes
+  xformedShape = Confetti.xformedShape
+  paintMergedShadows = Confetti.paintMergedShadows
+  drafting = Confetti.drafting
+  paintSprites = Confetti.paintSprites
+  ENGINES = Confetti.ENGINES
+  rasterizes = Confetti.rasterizes
+  paintRaster = Confetti.paintRaster
+  paintItems = Confetti.paintItems
+  paint = Confetti.paint
@@ -0,0 +1,103 @@
+
+import json, os, zipfile
+
+import numpy as np
+
+from scenespec import sceneLayers, sceneSpec, upgradeSpec, arrangeLayers, applySpec
+
+
+'''
+Saving a scene to a document file, and opening it again.
+
+A document is a zip file of document.json, which holds the scene's spec (see scenespec), the names of
+its layers (keyed as in scenespec.sceneLayers()), and the state of the random number generator of each
+layer that has one, and of each such layer's arrays of random values, as compressed .npy files named
+layer/array.npy.  (So it is also an .npz file, and numpy.load() reads it.)
+
+Restoring the random values as they were saved, rather than drawing them again, also restores
+what a seed alone can't:  the generator's state after any later draws.
+'''
+
+FORMAT = 'pain document'
+VERSION = 1
+EXTENSION = 'pain'
+
+
+def saveDocument(scene, filename):
+  '''Save `scene`, a scene made by scenespec.buildScene(), to the document `filename`,
+  or raise ValueError if it can't be described by a spec.'''
+  layers = sceneLayers(scene)
+  doc = { 'format': FORMAT, 'version': VERSION
+        , 'spec': sceneSpec(scene)
+        , 'names': { name: layer.data(0) for (name, layer) in layers.items() }
+        , 'random': {} }
+  temp = '{}.{}.tmp'.format(filename, os.getpid())
+  with zipfile.ZipFile(temp, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as z:
+    for name in layers:
+      if hasattr(layers[name], 'randomState'):
+        (state, arrays) = layers[name].randomState()
+        doc['random'][name] = state
+        for (key, values) in arrays.items():
+          with z.open('{}/{}.npy'.format(name, key), 'w', force_zip64=True) as f:
+            np.lib.format.write_array(f, np.asanyarray(values), allow_pickle=False)
+    z.writestr('document.json', json.dumps(doc, indent=1))
+  os.replace(temp, filename)    # (so a failed save leaves any earlier document alone)
+
+
+class Document:
+
+  'An open document file.  Use it as a context manager, or close() it.'
+
+  def __init__(self, filename):
+    if not zipfile.is_zipfile(filename):
+      raise ValueError('{} is not a document'.format(filename))
+    self._npz = np.load(filename, allow_pickle=False)
+    try:
+      doc = json.loads(self._npz['document.json'])
+    except KeyError:
+      self._npz.close()
+      raise ValueError('{} is not a document (it has no document.json)'.format(filename))
+    if doc.get('format') != FORMAT or doc.get('version') != VERSION:
+      self._npz.close()
+      raise ValueError('{} is not a version {} {}'.format(filename, VERSION, FORMAT))
+    self._doc = doc
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def close(self):
+    self._npz.close()
+
+  def spec(self):
+    return self._doc['spec']
+
+  def names(self):
+    'Return a dict of the name of each layer.'
+    return dict(self._doc['names'])
+
+  def randomStates(self):
+    'Return a dict of the random state (see Confetti.randomState()) of each layer that has one.'
+    return dict(self._doc['random'])
+
+  def arrays(self, layer):
+    'Return a dict of the arrays of `layer`, by name.'
+    prefix = layer + '/'
+    return { name[len(prefix):]: self._npz[name] for name in self._npz.files if name.startswith(prefix) }
+
+
+def openDocument(scene, filename):
+  'Make `scene`, a scene made by scenespec.buildScene(), as saved in the document `filename`.'
+  with Document(filename) as doc:
+    spec = upgradeSpec(doc.spec())
+    arrangeLayers(scene, [ layer['kind'] for layer in spec['layers'] ])
+    layers = sceneLayers(scene)
+    # Restore the random values first, so that applying the spec finds the seeds already set, and draws nothing.
+    for (name, state) in doc.randomStates().items():
+      layers[name].setRandomState(state, doc.arrays(name))
+    applySpec(scene, spec)
+    for (name, text) in doc.names().items():
+      if hasattr(layers[name], 'setData'):    # (the scene's name is fixed)
+        layers[name].setData(0, text)
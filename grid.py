@@ -1,11 +1,41 @@
 
+import math
 import random as rnd
 
+import numpy as np
 from PyQt5 import QtCore, QtGui, QtWidgets
 
+import svgwriter
 from widgetutils import addSliderTo
 
 
+def honeycombEdges(rect, d):
+  '''Return an (n,2,2) array of the edges that reach into QRectF `rect` of a honeycomb of hexagons whose
+  centers are `d` apart, one centered at (0,0), its neighbors to its left and right.  Each edge is in it once.'''
+  a = d / math.sqrt(3)        # the length of an edge, and the distance from a center to a corner
+  h = d * math.sqrt(3) / 2    # the distance between rows of hexagons
+  # The hexagons' centers, in rows, every other row shifted by half a hexagon; with a row and column more on each side.
+  j = np.arange(math.floor(rect.top() / h) - 1, math.ceil(rect.bottom() / h) + 2)
+  i = np.arange(math.floor(rect.left() / d) - 1, math.ceil(rect.right() / d) + 2)
+  cx = (i[np.newaxis,:] + (j[:,np.newaxis] & 1) / 2) * d
+  cy = np.broadcast_to(j[:,np.newaxis] * h, cx.shape)
+  centers = np.stack((cx.ravel(), cy.ravel()), axis=1)
+  # Each hexagon has 3 of its edges (to its lower right, lower left, and left), whose other sides are its neighbors' other 3.
+  angles = np.radians([30, 90, 150, 210])
+  corners = a * np.stack((np.cos(angles), np.sin(angles)), axis=1)
+  ends = np.stack((corners[:-1], corners[1:]), axis=1)                # (3,2,2)
+  edges = (centers[:,np.newaxis,np.newaxis,:] + ends[np.newaxis]).reshape(-1, 2, 2)
+  lo = edges.min(axis=1)
+  hi = edges.max(axis=1)
+  inside = (hi[:,0] >= rect.left()) & (lo[:,0] <= rect.right()) & (hi[:,1] >= rect.top()) & (lo[:,1] <= rect.bottom())
+  return edges[inside]
+
+def qlines(edges):
+  '''Return a list of QLineF of the (n,2,2) array `edges`.
+  (QPainter.drawLines() draws a list of them many times faster than a QPolygonF of their ends.)'''
+  return [ QtCore.QLineF(*e) for e in edges.reshape(-1, 4).tolist() ]
+
+
 class Grid(QtWidgets.QGraphicsObject):
 
   POLAR = 0
@@ -14,18 +44,48 @@ class Grid(QtWidgets.QGraphicsObject):
   SQUARE = 3
   HONEYCOMB = 4
 
-  def __init__(self, *posargs):
+  TILE_PIXELS = 1 << 22       # the most pixels in a tile image (see tileBrush()), beyond which the lines are just drawn
+  TILE_MIN_DENSITY = 1/8      # the fewest lines per device pixel for which a smoothly transformed tile is faster than drawing them
+  HONEYCOMB_EDGES = 1 << 18   # the most edges of a honeycomb to keep (see paintLines()), beyond which just those exposed are made
+
+  def __init__(self, *posargs, seed=None):
     super().__init__(*posargs)
+    self.setFlag(QtWidgets.QGraphicsItem.ItemUsesExtendedStyleOption)  # so option.exposedRect is accurate
+    self._generation = 0      # how many times it has needed repainting (see generation())
     self._boundingRect = QtCore.QRectF()
-    self._type = rnd.choice([self.POLAR, self.ISOMETRIC, self.SQUARE])
     self._radius = 1024
-    self._radials = rnd.randrange(12,64)
     self._radialWidgets = []
-    self._spacing = rnd.randrange(8,64,4)
-    self._thickness = rnd.randrange(1,5)
-    self._pen = QtGui.QPen(QtCore.Qt.yellow, self._thickness)
+    self._pen = QtGui.QPen(QtCore.Qt.yellow)
     self._rotation_degrees = None
-    self.setRotationDegrees(rnd.randrange(360))
+    self._tile = None         # (key, QBrush, exact) of the latest tileBrush()
+    self._lines = []          # the grid's lines, as a list of QLineF, or None until needed (see buildLines())
+    self._circles = []        # the radii of the polar grid's circles
+    self.randomize(seed)
+
+  def randomize(self, seed=None):
+    'Choose the type, spacing, and so on, from `seed`, or else from a new random seed.'
+    self._seed = rnd.getrandbits(64) if seed is None else seed
+    choices = rnd.Random(self._seed)
+    self._type = choices.choice([self.POLAR, self.ISOMETRIC, self.SQUARE])
+    self._radials = choices.randrange(12,64)
+    self._spacing = choices.randrange(8,64,4)
+    self._thickness = choices.randrange(1,5)
+    self._pen = QtGui.QPen(self._pen.color(), self._thickness)
+    self.buildLines()
+    self.setRotationDegrees(choices.randrange(360))
+    self.update()
+
+  def spec(self):
+    'Return a dict of the seed and of each parameter, in the units of its setter (see scenespec).'
+    return { 'visible': self.isVisible()
+           , 'seed': self._seed
+           , 'type': self._type
+           , 'radials': self._radials
+           , 'spacing': self._spacing
+           , 'thickness': self._thickness
+           , 'rotationDegrees': self._rotation_degrees
+           , 'color': self._pen.color().name(QtGui.QColor.HexArgb)
+           }
 
   def updateSceneRect(self, rect):
     self.prepareGeometryChange()
@@ -33,6 +93,7 @@ class Grid(QtWidgets.QGraphicsObject):
     z = round(max(rect.width(), rect.height()) / 2)
     self._radius = z
     self._boundingRect = QtCore.QRectF(-z,-z,z*2,z*2)
+    self.buildLines()
     self.update()
 
   def itemChange(self, change, value):
@@ -42,50 +103,240 @@ class Grid(QtWidgets.QGraphicsObject):
         self.updateSceneRect(value.sceneRect())
     return super().itemChange(change, value)
 
+  def update(self, *args):
+    self._generation += 1
+    super().update(*args)
+
+  def generation(self):
+    'Return a number that changes whenever this needs repainting (see LayerCompositor).'
+    return self._generation
+
   def boundingRect(self):
     return QtCore.QRectF(self._boundingRect)
 
   def paint(self, painter, option, widget=0):
     painter.setClipRect(self._boundingRect)
+    (brush, exact) = self.tileBrush(painter.deviceTransform(), painter.testRenderHint(QtGui.QPainter.Antialiasing))
+    if brush is None:
+      self.paintLines(painter, option.exposedRect)
+      return
+    painter.save()
+    painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform, not exact)
+    painter.fillRect(self._boundingRect, brush)
+    painter.restore()
+
+  def paintLines(self, painter, exposed=None):
+    '''Paint the grid line by line (and circle by circle), as built by buildLines().
+    A honeycomb's edges are made the first time they're needed (usually its tiles are painted instead),
+    or if there are too many to keep, just those within QRectF `exposed` are made every time.'''
     painter.setPen(self._pen)
+    painter.setBrush(QtCore.Qt.NoBrush)
     #painter.drawRect(self._boundingRect)
     if self._type == self.POLAR:
-      for r in range(self._spacing, self._radius, self._spacing):
-        painter.drawEllipse(QtCore.QPointF(0,0), r,r)
-      if self._radials:
-        for r in range(self._radials):
-          painter.drawLine(0, -self._radius, 0, self._radius)
-          painter.rotate(180/self._radials)
+      self.paintPolar(painter, self._boundingRect if exposed is None else exposed.intersected(self._boundingRect))
+      return
+    lines = self._lines
+    if lines is None:
+      (R, d) = (self._radius, self._spacing)
+      if 2 * (2*R)**2 / (d * d * math.sqrt(3) / 2) <= self.HONEYCOMB_EDGES:    # (about 2 edges per hexagon)
+        lines = self._lines = qlines(honeycombEdges(self._boundingRect, d))
+      else:
+        rect = self._boundingRect if exposed is None else exposed.intersected(self._boundingRect)
+        margin = self._thickness / 2 + 1
+        lines = qlines(honeycombEdges(rect.adjusted(-margin, -margin, margin, margin), d))
+    if lines:
+      painter.drawLines(lines)
+
+  def paintPolar(self, painter, rect):
+    '''Paint the part of the polar grid within QRectF `rect`:  skipping the circles that miss it,
+    and trimming the radials to it.  (Any circle that reaches the rect is drawn whole, so that it is
+    antialiased the same however the grid is split into rects, as tilerender does.)'''
+    margin = self._thickness / 2 + 1     # (so that the ends of radials are out of sight)
+    rect = rect.adjusted(-margin, -margin, margin, margin)
+    (left, top, right, bottom) = (rect.left(), rect.top(), rect.right(), rect.bottom())
+    near = math.hypot(max(left, -right, 0), max(top, -bottom, 0))     # the distances from the center to the rect's nearest
+    far = math.hypot(max(-left, right), max(-top, bottom))            # and farthest points
+    # (Each circle on its own:  Qt strokes a path of them all as one big polygon, which is many times slower.)
+    for r in self._circles:
+      if near <= r <= far:
+        painter.drawEllipse(QtCore.QRectF(-r, -r, r*2, r*2))
+    if self._radials:
+      # The radials are the lines through the center at angles k * 180/radials (clockwise from 12 o'clock), from -R to R along
+      # each.  Trim them to the rect (as Liang-Barsky clipping does), and leave out those that miss it.
+      angles = np.arange(self._radials) * math.pi / self._radials
+      (dx, dy) = (np.sin(angles), -np.cos(angles))
+      (t0, t1) = (np.full(len(angles), -float(self._radius)), np.full(len(angles), float(self._radius)))
+      with np.errstate(divide='ignore', invalid='ignore'):
+        for (p, lo, hi) in ((dx, left, right), (dy, top, bottom)):
+          (ta, tb) = (lo / p, hi / p)
+          t0 = np.where(p != 0, np.maximum(t0, np.minimum(ta, tb)), np.where((lo <= 0) & (0 <= hi), t0, np.inf))
+          t1 = np.where(p != 0, np.minimum(t1, np.maximum(ta, tb)), t1)
+      shown = t0 < t1
+      (dx, dy, t0, t1) = (dx[shown], dy[shown], t0[shown], t1[shown])
+      ends = np.stack((dx * t0, dy * t0, dx * t1, dy * t1), axis=1)
+      if len(ends):
+        painter.drawLines(qlines(ends))
+
+  def buildLines(self):
+    '''Make the grid's lines (and circles) for its type, spacing, radials and radius, so that painting it
+    is just drawing them.  (Call this whenever any of those change.)  The polar grid's radials are made
+    as they're painted instead, trimmed to what is exposed (see paintPolar()).'''
+    (R, d) = (self._radius, self._spacing)
+    lines = []
+    circles = []
+    if self._type == self.POLAR:
+      circles = list(range(d, R, d))
     elif self._type == self.PINSTRIPE:
-      for i in range(0, self._radius*2, self._spacing):
-        painter.drawLine(i-self._radius, -self._radius, i-self._radius, self._radius)   # vertical line
+      lines = [ QtCore.QLineF(i-R, -R, i-R, R) for i in range(0, R*2, d) ]    # vertical lines
     elif self._type == self.ISOMETRIC:
+      # Vertical lines, three times, 60 degrees apart, each reaching the corners of the bounding rect.
+      z = math.ceil(R * math.sqrt(2))
+      xs = [0] + [ x for i in range(d, z, d) for x in (i, -i) ]
       for j in range(3):
-        painter.drawLine(0, -self._radius, 0, self._radius)     # vline at x=0
-        for i in range(self._spacing, self._radius, self._spacing):
-          painter.drawLine(i, -self._radius, i, self._radius)   # vline at x=i
-          painter.drawLine(-i, -self._radius, -i, self._radius) # vline at x=-i
-        painter.rotate(60)
+        (s, c) = (math.sin(math.radians(j * 60)), math.cos(math.radians(j * 60)))
+        lines.extend( QtCore.QLineF(x*c + z*s, x*s - z*c, x*c - z*s, x*s + z*c) for x in xs )
     elif self._type == self.SQUARE:
-      for i in range(0, self._radius*2, self._spacing):
-        painter.drawLine(i-self._radius, -self._radius, i-self._radius, self._radius)   # vertical line
-      for j in range(0, self._radius*2, self._spacing):
-        painter.drawLine(-self._radius, j-self._radius, self._radius, j-self._radius)    # horizontal line
+      lines = [ QtCore.QLineF(i-R, -R, i-R, R) for i in range(0, R*2, d) ]    # vertical lines
+      lines += [ QtCore.QLineF(-R, j-R, R, j-R) for j in range(0, R*2, d) ]   # horizontal lines
+    elif self._type == self.HONEYCOMB:
+      lines = None        # (made by paintLines(), if it's ever needed)
+    self._lines = lines
+    self._circles = circles
+
+  def lineFamilies(self):
+    '''Return the families of parallel lines that a repeating type of grid is made of, as a list of (angle, offset):
+    the lines of the points whose distance in the direction `angle` degrees is `offset` plus a multiple of the spacing;
+    and the (width, height) of a tile that repeats the grid.  Or return None, None if the type doesn't repeat.
+    (A honeycomb repeats, but isn't made of whole lines, so it has no families.)'''
+    (R, d) = (self._radius, self._spacing)
+    if self._type == self.PINSTRIPE:
+      return ([(0, -R)], (d, d))
+    elif self._type == self.SQUARE:
+      return ([(0, -R), (90, -R)], (d, d))
+    elif self._type == self.ISOMETRIC:
+      return ([(0, 0), (60, 0), (120, 0)], (2*d, 2*d/math.sqrt(3)))
+    elif self._type == self.HONEYCOMB:
+      return ([], (d, d*math.sqrt(3)))
+    return (None, None)
+
+  def tileBrush(self, m, antialias=True):
+    '''Return a QBrush of an image of one tile of the grid, which fills the grid as seen through device transform `m`,
+    and whether it maps the image's pixels exactly onto device pixels (so painting it needs no smoothing).
+    Or return None, False if the grid doesn't repeat, or the tile would be too big to be worth it.'''
+    (families, period) = self.lineFamilies()
+    if families is None or m.type() == QtGui.QTransform.TxProject:
+      return (None, False)
+    (pw, ph) = period
+    (sx, sy) = (math.hypot(m.m11(), m.m12()), math.hypot(m.m21(), m.m22()))   # device pixels per unit along x and y
+    # Unless the grid is rotated (other than by a multiple of 90 degrees) or its period isn't a whole number of pixels,
+    # each tile's pixels are just copied to the device's.  Otherwise the tile is smoothly transformed, and is painted at
+    # twice the resolution, which keeps thin lines much sharper.
+    axisAligned = (abs(m.m12()) < 1e-9 and abs(m.m21()) < 1e-9) or (abs(m.m11()) < 1e-9 and abs(m.m22()) < 1e-9)
+    exact = axisAligned and abs(pw * sx - round(pw * sx)) < 1e-9 and abs(ph * sy - round(ph * sy)) < 1e-9
+    density = 2 if self._type == self.HONEYCOMB else len(families)    # (the length of its lines per unit area, times the spacing)
+    if not exact and density / (self._spacing * min(sx, sy)) < self.TILE_MIN_DENSITY:
+      return (None, False)      # (smoothly transforming the tile over the whole grid would take longer than drawing the lines)
+    q = 1 if exact else 2
+    (w, h) = (max(1, round(pw * sx * q)), max(1, round(ph * sy * q)))
+    if w * h > self.TILE_PIXELS:
+      return (None, False)
+    (fx, fy) = (w / pw, h / ph)
+    o = m.inverted()[0].map(QtCore.QPointF(round(m.dx()), round(m.dy())))   # (a point on a device pixel's corner)
+    (ox, oy) = (o.x() % pw, o.y() % ph)
+    key = (self._type, tuple(families), w, h, round(fx, 9), round(fy, 9), round(ox, 6), round(oy, 6), self._spacing, self._thickness
+          , self._pen.color().rgba(), antialias)
+    tile = self._tile         # (just once, since it may be painted on several threads at once)
+    if tile is None or tile[0] != key:
+      img = QtGui.QImage(w, h, QtGui.QImage.Format_ARGB32_Premultiplied)    # (not a QPixmap, so that tiles can be painted on any thread)
+      img.fill(QtCore.Qt.transparent)
+      p = QtGui.QPainter(img)
+      p.setRenderHint(QtGui.QPainter.Antialiasing, antialias)
+      p.scale(fx, fy)
+      p.translate(-ox, -oy)
+      p.setPen(self._pen)
+      reach = self._thickness / 2 + 1
+      corners = [ (ox, oy), (ox+pw, oy), (ox, oy+ph), (ox+pw, oy+ph) ]
+      (cx, cy) = (ox + pw/2, oy + ph/2)
+      length = pw + ph + reach      # (reaching past the tile from any point within it)
+      for (angle, offset) in families:
+        (c, s) = (math.cos(math.radians(angle)), math.sin(math.radians(angle)))
+        along = [ x*c + y*s for (x, y) in corners ]
+        u = cy*c - cx*s             # (the point nearest the tile's center, along each line)
+        for k in range(math.floor((min(along) - reach - offset) / self._spacing), math.ceil((max(along) + reach - offset) / self._spacing) + 1):
+          a = offset + k * self._spacing
+          p.drawLine(QtCore.QPointF(a*c - (u-length)*s, a*s + (u-length)*c), QtCore.QPointF(a*c - (u+length)*s, a*s + (u+length)*c))
+      if self._type == self.HONEYCOMB:
+        edges = honeycombEdges(QtCore.QRectF(ox - reach, oy - reach, pw + reach*2, ph + reach*2), self._spacing)
+        p.drawLines(qlines(edges))
+      p.end()
+      brush = QtGui.QBrush(img)
+      brush.setTransform(QtGui.QTransform(1/fx, 0, 0, 1/fy, o.x(), o.y()))
+      tile = (key, brush, exact)
+      self._tile = tile
+    return tile[1:]
+
+  def writeSvg(self, svg):
+    'Write the grid to SvgWriter `svg`:  its lines as one path, and any circles.'
+    R = self._radius
+    num = svgwriter.num
+    svg.beginGroup(clip=self._boundingRect, attributes='fill="none" ' + svgwriter.penAttributes(self._pen))
+    if self._type == self.POLAR:
+      out = [ '<circle r="{}"/>\n'.format(r) for r in range(self._spacing, R, self._spacing) ]
+      if self._radials:
+        d = []
+        for k in range(self._radials):
+          (s, c) = (math.sin(math.radians(k * 180 / self._radials)), math.cos(math.radians(k * 180 / self._radials)))
+          d.append('M{} {}L{} {}'.format(num(R*s), num(-R*c), num(-R*s), num(R*c)))
+        out.append('<path d="{}"/>\n'.format(''.join(d)))
+      svg.write(''.join(out))
+    elif self._type == self.PINSTRIPE:
+      svg.write('<path d="{}"/>\n'.format(''.join( 'M{} {}V{}'.format(i-R, -R, R) for i in range(0, R*2, self._spacing) )))
+    elif self._type == self.ISOMETRIC:
+      # The same vertical lines, three times, 60 degrees apart, each reaching the corners of the bounding rect.
+      z = math.ceil(R * math.sqrt(2))
+      d = 'M0 {}V{}'.format(-z, z) + ''.join( 'M{x} {}V{}M-{x} {}V{}'.format(-z, z, -z, z, x=i) for i in range(self._spacing, z, self._spacing) )
+      lines = svg.define('<path id="{id}" d="' + d + '"/>', 'grid')
+      svg.write(''.join( '<use xlink:href="#{}" transform="rotate({})"/>\n'.format(lines, j * 60) for j in range(3) ))
+    elif self._type == self.SQUARE:
+      d = ''.join( 'M{} {}V{}'.format(i-R, -R, R) for i in range(0, R*2, self._spacing) )
+      d += ''.join( 'M{} {}H{}'.format(-R, j-R, R) for j in range(0, R*2, self._spacing) )
+      svg.write('<path d="{}"/>\n'.format(d))
+    elif self._type == self.HONEYCOMB:
+      edges = honeycombEdges(self._boundingRect, self._spacing).reshape(-1, 4)
+      svg.write('<path d="{}"/>\n'.format(''.join( 'M{} {}L{} {}'.format(*map(num, e)) for e in edges.tolist() )))
+    svg.endGroup()
 
   def onIndexChanged(self, idx):
     self._type = idx
+    self.buildLines()
     for w in self._radialWidgets:
       w.setVisible(self._type == self.POLAR)
     self.update()
 
+  def setType(self, value):
+    if value != self._type:
+      self.onIndexChanged(value)
+
+  def setSeed(self, value):
+    if value != self._seed:
+      self.randomize(value)
+
+  def setColor(self, value):
+    c = QtGui.QColor(value)
+    if c != self._pen.color():
+      self._pen = QtGui.QPen(c, self._thickness)
+      self.update()
+
   def setRadials(self, value):
     if value != self._radials:
       self._radials = value
+      self.buildLines()
       self.update()
 
   def setSpacing(self, value):
     if value != self._spacing:
       self._spacing = value
+      self.buildLines()
       self.update()
 
   def setThickness(self, value):
@@ -112,7 +363,7 @@ class Grid(QtWidgets.QGraphicsObject):
     #label.setSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Maximum)
     layout.addWidget(label)
     combox = QtWidgets.QComboBox()
-    combox.addItems('Polar Pinstripe Isometric Square'.split())
+    combox.addItems('Polar Pinstripe Isometric Square Honeycomb'.split())
     combox.setCurrentIndex(self._type)
     #combox.setSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Maximum)
     layout.addWidget(combox)
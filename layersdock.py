@@ -60,6 +60,10 @@ class LayersDock(QtWidgets.QDockWidget):
     else:
       print('selectLayer: index({},0) is invalid'.format(y))
 
+  def reloadParams(self):
+    'Load the parameters of the current layer into the parameters dock again (after they were changed some other way).'
+    self._paramsDock.loadParamsFrom(self._layersWidget.currentIndex().data(role=QtCore.Qt.UserRole))
+
   def currentLayerChanged(self, current_modelIdx, previous_modelIdx):
     print('LayersDock.currentLayerChanged')
     self._paramsDock.loadParamsFrom(current_modelIdx.data(role=QtCore.Qt.UserRole))
@@ -2,11 +2,13 @@
 from PyQt5 import QtCore, QtGui, QtWidgets
 
 from widgetutils import addSliderTo, addSpinBoxTo
+import svgwriter
 
 class LightSource(QtWidgets.QGraphicsObject):
 
   def __init__(self, *posargs):
     super().__init__(*posargs)
+    self._generation = 0      # how many times it has needed repainting (see generation())
     self._boundingRect = QtCore.QRectF(-8,-8,16,16)
     self._x = .5
     self._y = .5
@@ -33,7 +35,9 @@ class LightSource(QtWidgets.QGraphicsObject):
 
   def itemChange(self, change, value):
     if change == QtWidgets.QGraphicsItem.ItemSceneHasChanged:
-      self.computeLightSource()
+      if not value is None:
+        value.sceneRectChanged.connect(self.computeLightSource)   # (it is placed relative to the scene's size)
+        self.computeLightSource()
     return super().itemChange(change, value)
 
   def innerRadius(self):
@@ -42,6 +46,14 @@ class LightSource(QtWidgets.QGraphicsObject):
   def outerRadius(self):
     return self._scene_outer_r
 
+  def update(self, *args):
+    self._generation += 1
+    super().update(*args)
+
+  def generation(self):
+    'Return a number that changes whenever this needs repainting (see LayerCompositor).'
+    return self._generation
+
   def boundingRect(self):
     return QtCore.QRectF(self._boundingRect)
 
@@ -51,6 +63,11 @@ class LightSource(QtWidgets.QGraphicsObject):
     painter.drawEllipse(self._boundingRect)
     return
 
+  def writeSvg(self, svg):
+    r = self._boundingRect
+    svg.write('<ellipse cx="{}" cy="{}" rx="{}" ry="{}" fill="#ffffff"/>\n'.format(
+      *map(svgwriter.num, (r.center().x(), r.center().y(), r.width()/2, r.height()/2))))
+
   def setLightSourceX(self, value):
     value = value/100.0
     if value != self._x:
@@ -78,11 +95,26 @@ class LightSource(QtWidgets.QGraphicsObject):
   def color(self):
     return QtGui.QColor(self._color)
 
+  def setColor(self, value):
+    c = QtGui.QColor(value)
+    if c != self._color:
+      self._color = c
+      self.computeLightSource()
+
   def onColor(self):
     c = QtWidgets.QColorDialog.getColor( self._color, None, options=QtWidgets.QColorDialog.ShowAlphaChannel )
-    if c.isValid() and c != self._color:
-      self._color = QtGui.QColor(c)
-      self.computeLightSource()
+    if c.isValid():
+      self.setColor(c)
+
+  def spec(self):
+    'Return a dict of each parameter, in the units of its setter (see scenespec).'
+    return { 'visible': self.isVisible()
+           , 'lightSourceX': round(self._x * 100, 6)
+           , 'lightSourceY': round(self._y * 100, 6)
+           , 'lightSourceInnerR': round(self._inner_r * 100, 6)
+           , 'lightSourceOuterR': round(self._outer_r * 100, 6)
+           , 'color': self._color.name(QtGui.QColor.HexArgb)
+           }
 
   def addWidgetsTo(self, layout):
     addSliderTo(layout, 'Light Source X', -100, 200, int(self._x*100), self.setLightSourceX)
@@ -0,0 +1,99 @@
+
+import collections, itertools, math
+
+
+Detail = collections.namedtuple('Detail', 'shadows gradients edges specular bevel stride')
+Detail.__doc__ = '''Which optional features of Confetti to paint, and `stride`, the step between indexes of items painted.
+  Features are listed most valued first.'''
+
+
+class LevelOfDetail:
+
+  '''Chooses how much detail can be painted within a target frame time, from the measured cost of each feature.
+
+  Every paint reports (via learn()) how long it took, and how long each of its parts took for a sample of
+  items.  Those costs per painted item are smoothed across frames, and choose() picks the richest
+  combination of wanted features whose estimated frame time fits the target, and only if even painting
+  no optional features won't fit does it skip items too.
+
+  Features that haven't been measured yet are estimated from those that have:  when the fill (with or
+  without gradients, with thick or thin edges) hasn't been measured in some combination, gradients and
+  thick edges are each assumed to double its cost.
+  '''
+
+  FEATURES = Detail._fields[:-1]
+  SMOOTHING = .5      # weight of the latest measurement
+
+  def __init__(self, targetTime=.05):
+    self.targetTime = targetTime  # seconds
+    self._costs = {}    # smoothed seconds per painted item: of 'shadows', 'specular', 'bevel', 'base' (everything
+                        # not separately measured), and ('fill', gradients, edges)
+
+  def costs(self):
+    return dict(self._costs)
+
+  def smooth(self, key, value):
+    old = self._costs.get(key)
+    self._costs[key] = value if old is None else old + (value - old) * self.SMOOTHING
+
+  def learn(self, detail, painted, elapsed, sectionTimes, sampled):
+    '''Record that painting `painted` items at `detail` took `elapsed` seconds,
+    of which `sectionTimes` (a dict of section name to seconds) were spent on `sampled` of them.'''
+    if painted == 0 or sampled == 0:
+      return
+    perItem = { name: t / sampled for (name, t) in sectionTimes.items() }
+    for name in ('shadows', 'specular', 'bevel'):
+      if getattr(detail, name):
+        self.smooth(name, perItem[name])
+    self.smooth(('fill', detail.gradients, detail.edges), perItem['fill'])
+    self.smooth('base', max(0.0, elapsed / painted - sum(perItem.values())))
+
+  def fillCost(self, gradients, edges):
+    cost = self._costs.get(('fill', gradients, edges))
+    if cost is None:
+      known = [ (key[1], key[2], c) for (key, c) in self._costs.items() if isinstance(key, tuple) ]
+      if not known:
+        return 0.0
+      (g, e, c) = min(known, key=lambda k: abs(k[0] - gradients) + abs(k[1] - edges))
+      cost = c * 2.0 ** ((gradients - g) + (edges - e))
+    return cost
+
+  def itemCost(self, detail):
+    'Return the estimated seconds to paint each item at the given detail.'
+    cost = self._costs.get('base', 0.0) + self.fillCost(detail.gradients, detail.edges)
+    for name in ('shadows', 'specular', 'bevel'):
+      if getattr(detail, name):
+        cost += self._costs.get(name, 0.0)
+    return cost
+
+  def choose(self, quantity, wanted):
+    '''Return the richest Detail, having no feature that isn't in Detail `wanted`, that is estimated to paint
+    `quantity` items within targetTime, or if none will, the plainest Detail with the smallest stride that will.'''
+    if not self._costs:
+      return wanted
+    best = None
+    for features in itertools.product((True, False), repeat=len(self.FEATURES)):  # richest first
+      if any(f and not w for (f, w) in zip(features, wanted)):
+        continue
+      detail = Detail(*features, stride=1)
+      stride = max(1, math.ceil(quantity * self.itemCost(detail) / self.targetTime))
+      if best is None or stride < best.stride:
+        best = detail._replace(stride=stride)
+    return best
+
+
+class LearningLog:
+
+  '''Stands in for a LevelOfDetail where it mustn't be touched (e.g. on a worker thread), recording each call of
+  learn() to be replayed into it later (on the thread that owns it).'''
+
+  def __init__(self):
+    self._calls = []
+
+  def learn(self, *args):
+    self._calls.append(args)
+
+  def replayInto(self, lod):
+    for args in self._calls:
+      lod.learn(*args)
+    self._calls = []
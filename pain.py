@@ -2,16 +2,19 @@
 
 'Polyagonal Artistic Interactive Notions'
 
-import time, argparse
+import time, argparse, json
 import os
 
-from PyQt5 import QtCore, QtGui, QtWidgets, QtSvg
+STARTED = time.perf_counter()   # (before the imports that take most of the startup time)
 
-from painscene import PainScene
-from lightsource import LightSource
-from grid import Grid
-from confetti import Confetti
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from scenespec import buildScene, sceneLayers, applySetting, sceneSpec, sceneFromSpec
+from rendercache import RenderCache
+from document import saveDocument, openDocument, EXTENSION as DOCUMENT_EXTENSION
 from painview import PainView
+import svgwriter
+import tilerender
 
 from layermodel import LayerModel
 from layersdock import LayersDock
@@ -28,8 +31,8 @@ class PainMainWindow(QtWidgets.QMainWindow):
     self.setWindowTitle(__doc__)
 
     #self._scene = PainScene(0,0,1920,1280)
-    self._scene = PainScene(QtCore.QRectF(QtCore.QPointF(0,0), QtCore.QSizeF(self.largestWallpaperSize())))
-    self._scene.setBackgroundBrush(QtCore.Qt.black)
+    self._scene = buildScene(self.largestWallpaperSize())
+    self._cache = RenderCache()
 
     self._view = PainView()
     self._view.setScene(self._scene)
@@ -47,34 +50,25 @@ class PainMainWindow(QtWidgets.QMainWindow):
 
     self._menuBar = QtWidgets.QMenuBar(self)
     self._fileMenu = QtWidgets.QMenu('&File', self._menuBar)
+    self._fileMenu.addAction('&Open...', self.onOpen, 'Ctrl+O')
+    self._fileMenu.addAction('&Save...', self.onSave, 'Ctrl+S')
     self._fileMenu.addAction('Export PNG...', self.onExportPng)
     self._fileMenu.addAction('Export SVG...', self.onExportSvg)
     self._fileMenu.addAction('&Quit', self.close, 'Ctrl+Q')
+    self._viewMenu = QtWidgets.QMenu('&View', self._menuBar)
+    action = self._viewMenu.addAction('Render in Background', self._view.setAsyncRender)
+    action.setCheckable(True)
+    action = self._viewMenu.addAction('Cache Layers', self._view.setLayerCache)
+    action.setCheckable(True)
+    action.setChecked(True)
+    self._view.setLayerCache(True)
     self.setMenuBar(self._menuBar)
     self._menuBar.addAction(self._fileMenu.menuAction())
+    self._menuBar.addAction(self._viewMenu.menuAction())
 
-    self.addInitialLayers()
     self._layersDock.selectLayer(1)
     self.show()
 
-  def addInitialLayers(self):
-    #self._scene.addRect(self._scene.sceneRect(), QtGui.QPen(QtCore.Qt.green, 3))
-
-    light = LightSource()
-    light.setData(0, 'Light Source')
-    self._scene.setLight(light)
-
-    grid = Grid()
-    grid.setData(0, 'Grid')
-    self._scene.addItem(grid)
-    #QtWidgets.QGraphicsEllipseItem(400,300, 800,600, grid) # test child items are not layers
-
-    confetti = Confetti()
-    confetti.setData(0, 'Confetti')
-    self._scene.addItem(confetti)
-
-    self._scene.addItem(self._scene.light)
-
   def largestWallpaperSize(self):
     screens = QtWidgets.QApplication.screens()
     sizes = [ scr.size() for scr in screens ] + [ scr.virtualSize() for scr in screens ]
@@ -86,42 +80,10 @@ class PainMainWindow(QtWidgets.QMainWindow):
     return QtCore.QSize(w,h)
 
   def renderToSvgFileName(self, filename):
-    # Note that gradients are stupidly verbosely rendered (two stops are rendered as about 20 stops in the SVG).
-    # Note that the Confetti "specular" option somehow triggers rendering a bunch of stuff as embedded raster images!!
-    #   At least up thru Qt 5.15.2
-    # In theory, just be sure nothing has antialiasing or caching enabled.
-    for item in self._scene.items():
-      assert item.cacheMode() == QtWidgets.QGraphicsItem.NoCache
-    svgGen = QtSvg.QSvgGenerator()
-    svgGen.setFileName(filename)
-    sz = self._scene.sceneRect().toAlignedRect().size()
-    svgGen.setSize(sz)
-    #svgGen.setResolution(90)  # trial-and-error reveals this fuck-ass magic number to get the SVG size (in mm!) to match the content
-    svgGen.setViewBox(self._scene.sceneRect())  # or, set this.
-    svgGen.setTitle("Polyagonal Artistic Interactive Notions")
-    svgGen.setDescription("Confetti Art")
-    #self._view.setRenderHint(QtGui.QPainter.Antialiasing, False)
-    painter = QtGui.QPainter()
-    painter.begin(svgGen)
-    painter.setRenderHint(QtGui.QPainter.Antialiasing, False)
-    print("Rendering to {} x {} SVG file at {} DPI...".format(sz.width(), sz.height(), svgGen.resolution()))
-    self._scene.render(painter)
-    print("...done.")
-    painter.end()
-    del painter
-    del svgGen
+    exportFile(self._scene, filename, self._cache)
 
   def renderToPngFileName(self, filename):
-    sz = self._scene.sceneRect().toAlignedRect().size()
-    qi = QtGui.QImage(sz, QtGui.QImage.Format_ARGB32)
-    painter = QtGui.QPainter(qi)
-    print("Rendering to {} x {} PNG file...".format(sz.width(), sz.height()))
-    painter.setRenderHint(QtGui.QPainter.Antialiasing, True)
-    self._scene.render(painter)
-    qi.save(filename, "PNG")
-    print("...done.")
-    del painter
-    del qi
+    exportFile(self._scene, filename, self._cache)
 
   def getSaveFileName(self, extension):
     assert not extension.startswith('.') and not extension.startswith('*')
@@ -144,6 +106,37 @@ class PainMainWindow(QtWidgets.QMainWindow):
           name = ''
     return name
 
+  def openFileName(self, filename):
+    print("Opening {}...".format(filename))
+    t0 = time.perf_counter()
+    openDocument(self._scene, filename)
+    self._layersDock.reloadParams()
+    print("...done ({:.3f} s).".format(time.perf_counter()-t0))
+
+  def saveFileName(self, filename):
+    print("Saving {}...".format(filename))
+    t0 = time.perf_counter()
+    saveDocument(self._scene, filename)
+    print("...done ({:.3f} s).".format(time.perf_counter()-t0))
+
+  def onOpen(self):
+    (name, selectedFilter) = QtWidgets.QFileDialog.getOpenFileName(self, filter = '*.' + DOCUMENT_EXTENSION)
+    if name:
+      try:
+        self.openFileName(name)
+      except (OSError, ValueError) as e:
+        QtWidgets.QMessageBox.warning(self, 'Cannot open file', str(e))
+    return True
+
+  def onSave(self):
+    name = self.getSaveFileName(DOCUMENT_EXTENSION)
+    if name:
+      try:
+        self.saveFileName(name)
+      except (OSError, ValueError) as e:
+        QtWidgets.QMessageBox.warning(self, 'Cannot save file', str(e))
+    return True
+
   def onExportSvg(self):
     name = self.getSaveFileName('svg')
     if name:
@@ -157,9 +150,96 @@ class PainMainWindow(QtWidgets.QMainWindow):
     return True
 
   def closeEvent(self, evt):
+    self._view.setAsyncRender(False)
     evt.accept()
 
 
+def exportSvg(scene, filename):
+  # Items write their own SVG (see svgwriter), rather than being painted into a QSvgGenerator,
+  # which spells out every gradient as dozens of stops, and even embeds raster images for specular highlights.
+  sz = scene.sceneRect().toAlignedRect().size()
+  print("Writing {} x {} SVG file...".format(sz.width(), sz.height()))
+  svgwriter.writeScene(scene, filename, title="Polyagonal Artistic Interactive Notions", description="Confetti Art")
+  print("...done.")
+
+def exportPng(scene, filename, threads=None):
+  sz = scene.sceneRect().toAlignedRect().size()
+  threads = threads or tilerender.idealThreadCount()
+  print("Rendering to {} x {} PNG file on {} threads...".format(sz.width(), sz.height(), threads))
+  t0 = time.perf_counter()
+  qi = tilerender.renderScene(scene, threads=threads)
+  t1 = time.perf_counter()
+  qi.save(filename, "PNG")
+  print("...done (render {:.3f} s, save {:.3f} s).".format(t1-t0, time.perf_counter()-t1))
+  del qi
+
+def exportFile(scene, filename, cache=None, threads=None):
+  '''Export `scene` to `filename`, as SVG if it ends with .svg, or else as PNG.
+  With a RenderCache `cache`, a scene exported before is copied from the cache instead.'''
+  extension = 'svg' if filename.lower().endswith('.svg') else 'png'
+  spec = None
+  if not cache is None:
+    try:
+      spec = sceneSpec(scene)
+    except ValueError as e:
+      print('Not using the render cache: {}.'.format(e))
+      cache = None
+  if not cache is None and cache.fetch(spec, extension, filename):
+    print('Copied {} from the render cache.'.format(filename))
+    return
+  if extension == 'svg':
+    exportSvg(scene, filename)
+  else:
+    exportPng(scene, filename, threads)
+  if not cache is None:
+    cache.store(spec, extension, filename)
+
+def exportHeadless(opts):
+  '''Build a scene without any widgets (from opts.open, or opts.spec, or else of opts.size from opts.seed),
+  apply the --set options in order, and export it to opts.export, reporting the time each stage takes.'''
+  times = [('startup', time.perf_counter() - STARTED)]
+  t = time.perf_counter()
+  def stage(name):
+    nonlocal t
+    (t, dt) = (time.perf_counter(), t)
+    times.append((name, t - dt))
+  if opts.open:
+    scene = buildScene(QtCore.QSize(64,64))
+    openDocument(scene, opts.open)
+    if opts.size:
+      scene.setWidth(opts.size.width())
+      scene.setHeight(opts.size.height())
+  elif opts.spec:
+    with open(opts.spec) as f:
+      spec = json.load(f)
+    if opts.size:
+      spec['size'] = [opts.size.width(), opts.size.height()]
+    scene = sceneFromSpec(spec)
+  else:
+    scene = buildScene(opts.size or QtCore.QSize(1920,1080), opts.seed)
+  stage('build')
+  layers = sceneLayers(scene)
+  for setting in opts.set:
+    applySetting(layers, setting)
+  stage('settings')
+  if opts.write_spec:
+    with open(opts.write_spec, 'w') as f:
+      json.dump(sceneSpec(scene), f, indent=1)
+  if opts.save:
+    saveDocument(scene, opts.save)
+  exportFile(scene, opts.export, None if opts.no_cache else RenderCache(opts.cache))
+  stage('export')
+  print('Timing: ' + ', '.join( '{} {:.3f} s'.format(name, dt) for (name, dt) in times )
+        + ', total {:.3f} s'.format(time.perf_counter() - STARTED))
+  return 0
+
+def parseSize(text):
+  (w, x, h) = text.lower().partition('x')
+  try:
+    return QtCore.QSize(int(w), int(h))
+  except ValueError:
+    raise argparse.ArgumentTypeError('expected WIDTHxHEIGHT, not "{}"'.format(text))
+
 def main(argv):
   global qapp  # prevent eager GC from causing segfault on return from main
 
@@ -169,15 +249,37 @@ def main(argv):
   QApplication.arguments() will reveal by omission which arguments were recognized.
   '''
   ap = argparse.ArgumentParser()
-  opts, argv_remaining = ap.parse_known_args()
+  ap.add_argument('--export', metavar='FILE', help='render to a .png or .svg file, without any windows, and exit')
+  ap.add_argument('--open', metavar='FILE', help='open this document (.pain file)')
+  ap.add_argument('--size', metavar='WxH', type=parseSize, help='size of exported image (default 1920x1080, or the size in the --open document or --spec)')
+  ap.add_argument('--seed', type=int, help='seed for the random choices')
+  ap.add_argument('--spec', metavar='FILE', help='build the scene from this scene spec (a JSON file, as written by --write-spec)')
+  ap.add_argument('--set', metavar='LAYER.PARAM=VALUE', action='append', default=[]
+                 , help='call the setter of a parameter of a layer (scene, light, grid, or confetti, or grid2, confetti2, ... for any more) before exporting, e.g. confetti.quantity=8000; repeatable, applied in order')
+  ap.add_argument('--write-spec', metavar='FILE', help='write the spec of the exported scene to this JSON file')
+  ap.add_argument('--save', metavar='FILE', help='save the exported scene to this document (.pain file)')
+  ap.add_argument('--cache', metavar='DIR', help='directory of the render cache (default ~/.cache/pain/renders)')
+  ap.add_argument('--no-cache', action='store_true', help='always render, and leave the render cache alone')
+  opts, argv_remaining = ap.parse_known_args(argv[1:])
 
   #np_test()
 
+  if opts.export:
+    # No display is needed (or wanted) just to render an image.
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    qapp = QtWidgets.QApplication(argv[:1] + argv_remaining)
+    try:
+      return exportHeadless(opts)
+    except ValueError as e:
+      ap.error(str(e))
+
   qapp = QtWidgets.QApplication(argv[:1] + argv_remaining)
 
   print('Available "-style" choices: ', ', '.join(QtWidgets.QStyleFactory.keys()))
 
   mainWnd = PainMainWindow()
+  if opts.open:
+    mainWnd.openFileName(opts.open)
   return qapp.exec_()
 
 
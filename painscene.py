@@ -54,17 +54,34 @@ class PainScene(QtWidgets.QGraphicsScene):
     self.light = light
     self.light.lightSourceChanged.connect(self.recomputeBackground)
 
+  def setInnerColor(self, value):
+    c1 = QtGui.QColor(value)
+    if c1 != self._innerColor:
+      self._innerColor = c1
+      self.recomputeBackground()
+
+  def setOuterColor(self, value):
+    c1 = QtGui.QColor(value)
+    if c1 != self._outerColor:
+      self._outerColor = c1
+      self.recomputeBackground()
+
   def onInnerColor(self):
     c1 = QtWidgets.QColorDialog.getColor( self._innerColor, None, options=QtWidgets.QColorDialog.ShowAlphaChannel )
-    if c1.isValid() and c1 != self._innerColor:
-      self._innerColor = QtGui.QColor(c1)
-      self.recomputeBackground()
+    if c1.isValid():
+      self.setInnerColor(c1)
 
   def onOuterColor(self):
     c1 = QtWidgets.QColorDialog.getColor( self._outerColor, None, options=QtWidgets.QColorDialog.ShowAlphaChannel )
-    if c1.isValid() and c1 != self._outerColor:
-      self._outerColor = QtGui.QColor(c1)
-      self.recomputeBackground()
+    if c1.isValid():
+      self.setOuterColor(c1)
+
+  def spec(self):
+    'Return a dict of each parameter but the size, in the units of its setter (see scenespec).'
+    return { 'visible': self.isVisible()
+           , 'innerColor': self._innerColor.name(QtGui.QColor.HexArgb)
+           , 'outerColor': self._outerColor.name(QtGui.QColor.HexArgb)
+           }
 
   def addWidgetsTo(self, layout):
     addSpinBoxTo(layout, 'Width (px)', 16, 1024*8, int(self.width()), self.setWidth)
@@ -1,8 +1,89 @@
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 
+from asyncrender import AsyncRenderer
+from compositor import LayerCompositor
+
 class PainView(QtWidgets.QGraphicsView):
 
+  '''In async render mode, the scene is rendered on a worker thread, and the view just shows
+  the latest finished frame (stretched to fit, if the view has changed since it was requested).
+  Otherwise, with layer caching on, each layer is kept painted in an image of its own (see LayerCompositor),
+  so that changing one layer only paints that one again.'''
+
+  def __init__(self, *posargs):
+    super().__init__(*posargs)
+    self._asyncRenderer = None
+    self._requested = None      # (size, dpr, transform) of the latest async frame requested
+    self._compositor = None
+
+  def isLayerCache(self):
+    return not self._compositor is None
+
+  def setLayerCache(self, state):
+    if bool(state) == self.isLayerCache():
+      return
+    # The scene only tells a view that an item needs repainting if the view painted that item itself,
+    # so when the compositor paints them, any change to the scene has to repaint the view.
+    if state:
+      self._compositor = LayerCompositor(self.scene())
+      self.scene().changed.connect(self.compositeChanged)
+    else:
+      self.scene().changed.disconnect(self.compositeChanged)
+      self._compositor = None
+    self.viewport().update()
+
+  def compositeChanged(self, *args):
+    self.viewport().update()
+
+  def isAsyncRender(self):
+    return not self._asyncRenderer is None
+
+  def setAsyncRender(self, state):
+    if bool(state) == self.isAsyncRender():
+      return
+    if state:
+      self._asyncRenderer = AsyncRenderer(self.scene(), self)
+      self._asyncRenderer.frameReady.connect(self.viewport().update)
+      self.scene().changed.connect(self.requestFrame)
+      self.requestFrame()
+    else:
+      self.scene().changed.disconnect(self.requestFrame)
+      self._asyncRenderer.shutdown()
+      self._asyncRenderer = None
+      self._requested = None
+    self.viewport().update()
+
+  def requestFrame(self, *args):
+    'Start rendering a new async frame of the current scene and view.'
+    vp = self.viewport()
+    self._requested = (vp.size(), vp.devicePixelRatioF(), self.viewportTransform())
+    self._asyncRenderer.request(*self._requested, self.renderHints() & QtGui.QPainter.Antialiasing != 0)
+
+  def paintEvent(self, evt):
+    if not self.isAsyncRender():
+      if not self.isLayerCache():
+        return super().paintEvent(evt)
+      vp = self.viewport()
+      painter = QtGui.QPainter(vp)
+      painter.fillRect(evt.rect(), self.backgroundBrush() if self.backgroundBrush().style() else self.palette().window())
+      self._compositor.paint(painter, vp.size(), vp.devicePixelRatioF(), self.viewportTransform()
+                            , self.renderHints() & QtGui.QPainter.Antialiasing != 0, vp)
+      painter.end()
+      return
+    vp = self.viewport()
+    if self._requested != (vp.size(), vp.devicePixelRatioF(), self.viewportTransform()):
+      self.requestFrame()       # the view has been resized or zoomed
+    painter = QtGui.QPainter(vp)
+    painter.fillRect(evt.rect(), self.backgroundBrush() if self.backgroundBrush().style() else self.palette().window())
+    frame = self._asyncRenderer.frame()
+    if not frame is None:
+      (img, xf) = frame
+      painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform, True)
+      painter.setTransform(xf.inverted()[0] * self.viewportTransform())
+      painter.drawImage(0, 0, img)
+    painter.end()
+
   def resizeEvent(self, evt):
     super().resizeEvent(evt)
     print('PainView.resizeEvent: sceneRect ==', self.scene().sceneRect())
@@ -12,4 +93,3 @@ class PainView(QtWidgets.QGraphicsView):
     super().updateSceneRect(rect)
     print('PainView.updateSceneRect({})'.format(rect))
     self.fitInView(self.scene().sceneRect(), QtCore.Qt.KeepAspectRatio)
-
@@ -0,0 +1,286 @@
+
+import collections
+
+import numpy as np
+from PyQt5 import QtGui
+
+
+'''
+A software rasterizer, in NumPy, for painting very many simple filled shapes at once.
+
+Shapes (here called primitives) are convex polygons, simple polygons, or circles, each filled with
+a flat color whose alpha may ramp linearly across it (like a QLinearGradient between two alphas
+of one color), and optionally edged with an opaque black pen, just as QPainter would paint them.
+Nothing is done per primitive in Python: primitives are rasterized in batches.  Each row of pixels
+of each primitive is cut into spans, from its outline:  pixels near the outline get their signed
+distance from it, and from that the antialiased coverage of the fill and of the pen, while pixels
+well inside are simply filled.  The resulting fragments are then composited (source over) in the
+order the primitives were given, one depth layer at a time, skipping any beneath opaque fragments.
+
+The result differs slightly from QPainter's: coverage is estimated from the distance between each
+pixel's center and the outline, rather than computed exactly, and colors are blended in floating point.
+'''
+
+
+Primitives = collections.namedtuple('Primitives', 'kinds rows offsets rgb alphas ramps pens')
+Primitives.__doc__ = '''Arrays describing M primitives, in painting order:
+  kinds   (M,) index of the outline (in a list of outlines) each is one of
+  rows    (M,) index of each within its outline
+  offsets (M,2) translation of each from its outline
+  rgb     (M,3) straight color, 0.0 to 1.0
+  alphas  (M,2) alpha where each alpha ramp starts and ends
+  ramps   (M,4) (x, y, u, v) of each ramp: where it starts, and (u,v) such that it ends where (u,v) . (p - (x,y)) is 1
+  pens    (M,) width of each pen, or 0 for none'''
+
+
+class ConvexOutline:
+
+  'Convex polygons, each of the same number of vertices, in either winding.'
+
+  def __init__(self, points):
+    '`points` is an (m,K,2) array of the vertices of m polygons.'
+    p = np.asarray(points, dtype=float)
+    e = np.roll(p, -1, axis=1) - p                        # edge k runs from vertex k to vertex k+1
+    winding = np.sign((p[:,:,0] * np.roll(p[:,:,1], -1, axis=1) - np.roll(p[:,:,0], -1, axis=1) * p[:,:,1]).sum(axis=1))
+    lengths = np.maximum(np.hypot(e[:,:,0], e[:,:,1]), 1e-12)
+    normals = np.stack((-e[:,:,1], e[:,:,0]), axis=2) * (winding[:,np.newaxis] / lengths)[:,:,np.newaxis]  # inward
+    # Each edge's coefficients are kept in an array of their own, so that they can be gathered one edge at a time.
+    self._edges = np.stack((normals[:,:,0].T, normals[:,:,1].T, (normals * p).sum(axis=2).T)).astype(np.float32)
+    # Pens have bevel joins:  each vertex also bounds the pen, along the bisector of its two edges' normals.
+    sums = normals + np.roll(normals, 1, axis=1)
+    half_cos = np.hypot(sums[:,:,0], sums[:,:,1]) / 2     # cosine of half the angle between the normals
+    bisectors = -sums / np.maximum(half_cos * 2, 1e-12)[:,:,np.newaxis]  # outward
+    self._joins = np.stack((bisectors[:,:,0].T, bisectors[:,:,1].T, (bisectors * p).sum(axis=2).T, half_cos.T)).astype(np.float32)
+    self._bounds = np.concatenate((p.min(axis=1), p.max(axis=1)), axis=1)
+
+  def bounds(self, rows):
+    return self._bounds[rows]
+
+  def spans(self, rows, y, outer, inner):
+    '''Return the (lo, hi, inner lo, inner hi) x coordinates between which lines `y` are within distance `outer`
+    of the outlines of `rows`, and between which they are inside by at least distance `inner`.'''
+    lo = np.full(len(rows), -np.inf)
+    hi = np.full(len(rows), np.inf)
+    (ilo, ihi) = (lo.copy(), hi.copy())
+    for (nx, ny, c) in zip(*self._edges):
+      (a, b) = (nx[rows], ny[rows] * y - c[rows])         # the distance inside the edge is a*x + b
+      halfPlaneSpan(lo, hi, a, b, -outer)
+      halfPlaneSpan(ilo, ihi, a, b, inner)
+    return (lo, hi, ilo, ihi)
+
+  def distances(self, rows, x, y, pens):
+    '''Return the signed distances (positive inside) of points `x`,`y` from the outlines of `rows`,
+    and from the outer edges of their pens of widths `pens`.'''
+    d = np.full(len(rows), np.inf, dtype=x.dtype)
+    for (nx, ny, c) in zip(*self._edges):
+      np.minimum(d, nx[rows] * x + ny[rows] * y - c[rows], out=d)
+    outer = d + pens / 2
+    if pens.any():
+      for (bx, by, c, half_cos) in zip(*self._joins):
+        np.minimum(outer, c[rows] + half_cos[rows] * pens / 2 - bx[rows] * x - by[rows] * y, out=outer)
+    return (d, outer)
+
+class PolygonOutline:
+
+  'Simple (possibly concave) polygons, each of the same number of vertices, filled odd-even.  Pens have round joins.'
+
+  def __init__(self, points):
+    p = np.asarray(points, dtype=float)
+    e = np.roll(p, -1, axis=1) - p
+    self._edges = np.stack((p[:,:,0].T, p[:,:,1].T, e[:,:,0].T, e[:,:,1].T,
+                            1 / np.maximum((e**2).sum(axis=2), 1e-12).T)).astype(np.float32)
+    self._bounds = np.concatenate((p.min(axis=1), p.max(axis=1)), axis=1)
+
+  def bounds(self, rows):
+    return self._bounds[rows]
+
+  def spans(self, rows, y, outer, inner):
+    'Return the bounds of the outlines of `rows` widened by `outer`, and empty inner spans.'
+    b = self._bounds[rows]
+    return (b[:,0] - outer, b[:,2] + outer, np.full(len(rows), np.inf), np.full(len(rows), -np.inf))
+
+  def distances(self, rows, x, y, pens):
+    d2 = np.full(len(rows), np.inf, dtype=x.dtype)
+    inside = np.zeros(len(rows), dtype=bool)
+    for (ax, ay, ex, ey, inv_length2) in zip(*self._edges):
+      (ax, ay, ex, ey) = (x - ax[rows], y - ay[rows], ex[rows], ey[rows])   # (ax, ay) is from the start of the edge
+      t = np.clip((ax * ex + ay * ey) * inv_length2[rows], 0, 1)
+      np.minimum(d2, (ax - t * ex)**2 + (ay - t * ey)**2, out=d2)
+      inside ^= ((ay < 0) != (ay < ey)) & ((ax * ey < ay * ex) == (ey > 0))
+    d = np.sqrt(d2)
+    d[~inside] *= -1
+    return (d, d + pens / 2)
+
+class CircleOutline:
+
+  'Circles.'
+
+  def __init__(self, centers, radii):
+    c = np.asarray(centers, dtype=float).reshape(-1, 2)
+    self._circles = np.stack((c[:,0], c[:,1], np.asarray(radii, dtype=float))).astype(np.float32)
+    r = self._circles[2][:,np.newaxis]
+    self._bounds = np.concatenate((c - r, c + r), axis=1)
+
+  def bounds(self, rows):
+    return self._bounds[rows]
+
+  def spans(self, rows, y, outer, inner):
+    (cx, dy, r) = (self._circles[0][rows], y - self._circles[1][rows], self._circles[2][rows])
+    result = []
+    for rr in (r + outer, np.maximum(r - inner, 0)):
+      half2 = rr**2 - dy**2
+      half = np.sqrt(np.maximum(half2, 0))
+      result += [np.where(half2 < 0, np.inf, cx - half), np.where(half2 < 0, -np.inf, cx + half)]
+    return tuple(result)
+
+  def distances(self, rows, x, y, pens):
+    (cx, cy, r) = self._circles
+    d = r[rows] - np.hypot(x - cx[rows], y - cy[rows])
+    return (d, d + pens / 2)
+
+
+def halfPlaneSpan(lo, hi, a, b, t):
+  'Narrow the spans `lo`..`hi` (in place) to where a*x + b >= t.'
+  with np.errstate(divide='ignore', invalid='ignore'):
+    x = (t - b) / a
+  np.maximum(lo, np.where(a > 0, x, np.where((a == 0) & (b < t), np.inf, -np.inf)), out=lo)
+  np.minimum(hi, np.where(a < 0, x, np.inf), out=hi)
+
+def ranges(starts, stops):
+  'Return (i, x) for every x in range(starts[i], stops[i]), for every i in order.'
+  counts = np.maximum(stops - starts, 0)
+  i = np.repeat(np.arange(len(counts)), counts)
+  return (i, np.arange(len(i)) + np.repeat(starts - (np.cumsum(counts) - counts), counts))
+
+
+BATCH_FRAGMENTS = 2**21   # most pixels of bounding boxes to rasterize at once
+
+def coverage(d, antialias):
+  'Return the fraction of each pixel covered, given the signed distance of its center from an edge.'
+  if antialias:
+    return np.clip(d + .5, 0, 1)
+  return (d >= 0).astype(d.dtype)
+
+def batches(width, height, outlines, prims):
+  '''Yield (prims, primitive, pixel y) of the rows of the bounding boxes (clipped to the canvas) of
+  successive batches of primitives, numbering primitives from the first of their batch.
+  The rows are ordered by the kind of their primitive.'''
+  m = len(prims.kinds)
+  bounds = np.empty((m, 4))
+  for (k, outline) in enumerate(outlines):
+    idxs = np.flatnonzero(prims.kinds == k)
+    bounds[idxs] = outline.bounds(prims.rows[idxs])
+  margin = prims.pens[:,np.newaxis] / 2 + 1
+  bounds = bounds + np.tile(prims.offsets, 2) + np.concatenate((-margin, -margin, margin, margin), axis=1)
+  y0 = np.clip(np.floor(bounds[:,1]), 0, height).astype(np.int64)
+  h = np.maximum(np.clip(np.ceil(bounds[:,3]), 0, height).astype(np.int64) - y0, 0)
+  w = np.maximum(np.clip(np.ceil(bounds[:,2]), 0, width) - np.clip(np.floor(bounds[:,0]), 0, width), 0)
+  ends = np.cumsum(w * h)
+  first = 0
+  while first < m:
+    last = max(first + 1, int(np.searchsorted(ends, ends[first] - w[first] * h[first] + BATCH_FRAGMENTS, side='right')))
+    (prim, ys) = ranges(y0[first:last], y0[first:last] + h[first:last])
+    order = np.argsort(prims.kinds[first:last][prim], kind='stable')
+    yield (Primitives(*(a[first:last] for a in prims)), prim[order], ys[order])
+    first = last
+
+def fragments(width, outlines, prims, prim, ys, antialias):
+  '''Return the (pixels, primitives, alphas, fill alphas) of the fragments painted by
+  primitives `prim` on pixel rows `ys` (ordered by kind) of a canvas `width` pixels wide.
+
+  Only the pixels near each outline are examined closely:  their coverage of the fill and of the pen
+  is computed from their distances to the outline and to the edge of the pen.  Those inside are wholly filled.'''
+  pens = prims.pens[prim]
+  (ox, y) = (prims.offsets[prim,0], ys + .5 - prims.offsets[prim,1])
+  slop = .5 if antialias else 0.0
+  kinds = np.searchsorted(prims.kinds[prim], np.arange(len(outlines) + 1))  # where each kind's rows start
+  spans = np.empty((4, len(prim)))
+  for (k, outline) in enumerate(outlines):
+    s = slice(kinds[k], kinds[k+1])
+    spans[:,s] = outline.spans(prims.rows[prim[s]], y[s], pens[s] / 2 + slop + .5, pens[s] / 2 + slop)
+  spans += (ox - .5)[np.newaxis]                 # (so that pixels are in a span when their centers are)
+  a = np.clip(np.ceil(spans[0]), 0, width).astype(np.int64)
+  b = np.maximum(np.clip(np.floor(spans[1]) + 1, 0, width).astype(np.int64), a)
+  c = np.clip(np.ceil(spans[2]), a, b).astype(np.int64)
+  d = np.clip(np.floor(spans[3]) + 1, c, b).astype(np.int64)
+  # Near outlines, on either side of the inner spans:
+  (i, xs) = ranges(np.stack((a, d), axis=1).ravel(), np.stack((c, b), axis=1).ravel())
+  i //= 2
+  epens = pens[i].astype(np.float32)
+  px = (xs + .5 - ox[i]).astype(np.float32)
+  py = y[i].astype(np.float32)
+  dist = np.empty(len(i), dtype=np.float32)
+  outer = np.empty(len(i), dtype=np.float32)
+  for (k, s) in enumerate(np.searchsorted(i, kinds)[:-1]):   # (still ordered by kind)
+    s = slice(s, np.searchsorted(i, kinds[k+1]))
+    (dist[s], outer[s]) = outlines[k].distances(prims.rows[prim[i[s]]], px[s], py[s], epens[s])
+  fill = coverage(dist, antialias)
+  pen = np.maximum(coverage(outer, antialias) - coverage(dist - epens / 2, antialias), 0)
+  pen[epens == 0] = 0
+  # Within the inner spans:
+  (i_in, xs_in) = ranges(c, d)
+  i = np.concatenate((i, i_in))
+  xs = np.concatenate((xs, xs_in))
+  fill = np.concatenate((fill, np.ones(len(i_in), dtype=np.float32)))
+  pen = np.concatenate((pen, np.zeros(len(i_in), dtype=np.float32)))
+  # The alpha of the fill ramps along each row as t = u*x + (the row's base).
+  ramps = prims.ramps[prim]
+  u = ramps[:,2].astype(np.float32)
+  base = ((ys + .5 - ramps[:,1]) * ramps[:,3] + (.5 - ramps[:,0]) * ramps[:,2]).astype(np.float32)
+  t = np.clip(xs.astype(np.float32) * u[i] + base[i], 0, 1)
+  alphas = prims.alphas[prim].astype(np.float32)
+  fill *= (alphas[i,0] + (alphas[i,1] - alphas[i,0]) * t) * (1 - pen)   # the pen is painted over the fill
+  return (ys[i] * width + xs, prim[i], pen + fill, fill)
+
+def rasterize(width, height, outlines, prims, antialias=True, canvas=None):
+  '''Paint `prims` (Primitives, whose kinds index the list of `outlines`), in order, over the (width*height,4)
+  premultiplied RGBA float `canvas`, or a new transparent one.  Return the canvas.'''
+  if canvas is None:
+    canvas = np.zeros((width * height, 4), dtype=np.float32)
+  for (batch, prim, ys) in batches(width, height, outlines, prims):
+    (pixels, prim, alphas, fills) = fragments(width, outlines, batch, prim, ys, antialias)
+    keep = np.flatnonzero(alphas > 0)
+    # Sort fragments by pixel, and then by painting order, and number each pixel's fragments from the bottom.
+    order = keep[np.argsort(pixels[keep] * len(batch.kinds) + prim[keep])]
+    pixels = pixels[order]
+    if not len(pixels):
+      continue
+    starts = np.flatnonzero(np.r_[True, pixels[1:] != pixels[:-1]])
+    counts = np.diff(np.r_[starts, len(pixels)])
+    # Fragments beneath an opaque one can't be seen.
+    opaque = np.where(alphas[order] >= 1, np.arange(len(pixels)), -1)
+    bottoms = np.maximum(np.maximum.reduceat(opaque, starts), starts)
+    visible = np.flatnonzero(np.arange(len(pixels)) >= np.repeat(bottoms, counts))
+    (order, pixels) = (order[visible], pixels[visible])
+    depths = visible - np.repeat(bottoms, counts - (bottoms - starts))
+    # Then each depth layer has at most one fragment per pixel, so can be composited at once.
+    layers = np.argsort(depths.astype(np.int16 if depths.max() < 2**15 else np.int64), kind='stable')
+    order = order[layers]
+    (pixels, alphas) = (pixels[layers], alphas[order])
+    colors = batch.rgb.astype(np.float32)[prim[order]] * fills[order][:,np.newaxis]   # (premultiplied; the pen is black)
+    bounds = np.searchsorted(depths[layers], np.arange(depths.max() + 2))
+    for (i, j) in zip(bounds[:-1], bounds[1:]):
+      p = pixels[i:j]
+      dst = canvas[p]
+      dst *= (1 - alphas[i:j])[:,np.newaxis]
+      dst[:,:3] += colors[i:j]
+      dst[:,3] += alphas[i:j]
+      canvas[p] = dst
+  return canvas
+
+def rasterizeUnion(width, height, outlines, prims, antialias=True):
+  '''Return the (width*height,) coverage of the union of the fills of `prims` (ignoring their colors,
+  alphas and pens), for painting overlapping shapes as one.'''
+  cover = np.zeros(width * height, dtype=np.float32)
+  prims = prims._replace(pens=np.zeros(len(prims.pens)), alphas=np.ones((len(prims.kinds), 2)))
+  for (batch, prim, ys) in batches(width, height, outlines, prims):
+    (pixels, prim, alphas, fills) = fragments(width, outlines, batch, prim, ys, antialias)
+    np.maximum.at(cover, pixels, alphas)
+  return cover
+
+def toQImage(canvas, width, height):
+  'Return a QImage (Format_ARGB32_Premultiplied) of the premultiplied RGBA float `canvas`.'
+  rgba = np.rint(np.clip(canvas, 0.0, 1.0) * 255).astype(np.uint32)
+  rgba[:,:3] = np.minimum(rgba[:,:3], rgba[:,3:])
+  argb = (rgba[:,3] << 24) | (rgba[:,0] << 16) | (rgba[:,1] << 8) | rgba[:,2]
+  return QtGui.QImage(argb.tobytes(), width, height, width * 4, QtGui.QImage.Format_ARGB32_Premultiplied).copy()
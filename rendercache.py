@@ -0,0 +1,74 @@
+
+import hashlib, json, os, shutil
+
+
+'''
+An on-disk cache of exported images, addressed by the hash of what they are an image of:
+the scene's spec (see scenespec, which includes its size), the file format, and RENDER_VERSION.
+Exporting a scene that was exported before is then just copying a file.
+
+Files are written to a temporary name and renamed into place, so processes can share a cache.
+The least recently used files are removed when the cache grows past its size limit.
+'''
+
+RENDER_VERSION = 8    # increase whenever a change to the code changes what a spec renders to
+
+def defaultDirectory():
+  return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'pain', 'renders')
+
+
+class RenderCache:
+
+  def __init__(self, directory=None, maxBytes=2**30):
+    self._dir = directory or defaultDirectory()
+    self._maxBytes = maxBytes
+
+  def directory(self):
+    return self._dir
+
+  def key(self, spec, extension):
+    'Return the hash of scene spec `spec` exported as a file with `extension`.'
+    text = json.dumps({ 'spec': spec, 'format': extension.lower(), 'render': RENDER_VERSION }, sort_keys=True, separators=(',',':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+  def path(self, key, extension):
+    return os.path.join(self._dir, key[:2], '{}.{}'.format(key, extension.lower()))
+
+  def fetch(self, spec, extension, filename):
+    'Copy the cached export of `spec` to `filename`, and return True, or return False if there is none.'
+    path = self.path(self.key(spec, extension), extension)
+    try:
+      shutil.copyfile(path, filename)
+    except FileNotFoundError:
+      return False
+    os.utime(path)    # (most recently used)
+    return True
+
+  def store(self, spec, extension, filename):
+    'Add a copy of `filename`, the export of `spec`, to the cache.'
+    path = self.path(self.key(spec, extension), extension)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp = '{}.{}.tmp'.format(path, os.getpid())
+    shutil.copyfile(filename, temp)
+    os.replace(temp, path)
+    self.prune()
+
+  def prune(self):
+    'Remove the least recently used files until the cache is within its size limit.'
+    files = []
+    for (dirpath, dirnames, filenames) in os.walk(self._dir):
+      for name in filenames:
+        try:
+          st = os.stat(os.path.join(dirpath, name))
+        except FileNotFoundError:
+          continue      # (removed by another process)
+        files.append((st.st_mtime, st.st_size, os.path.join(dirpath, name)))
+    total = sum( size for (mtime, size, path) in files )
+    for (mtime, size, path) in sorted(files):
+      if total <= self._maxBytes:
+        break
+      try:
+        os.remove(path)
+      except FileNotFoundError:
+        pass
+      total -= size
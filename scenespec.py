@@ -0,0 +1,175 @@
+
+import ast, random
+
+from PyQt5 import QtCore
+
+from painscene import PainScene
+from lightsource import LightSource
+from grid import Grid
+from confetti import Confetti
+
+
+'''
+Building the scene, and describing it as a spec:  a dict (which can be written as JSON) of its size, of the
+scene's own parameters, and of the kind and parameters of each of its layers in stacking order (bottom first),
+including the seeds that all of the layers' random choices are made from, so that building a scene from the
+spec makes the same picture again.
+
+Each layer's spec() returns its parameters in the units of its setters, so applying a spec is just
+calling layer.setParameter(value) for each of them, as pain.py --set does.
+'''
+
+SPEC_VERSION = 2
+
+LAYER_KINDS = { 'light': LightSource, 'grid': Grid, 'confetti': Confetti }   # the class of each kind of layer
+
+
+def buildScene(size, seed=None):
+  '''Return a new PainScene of QSize `size`, with the initial layers:  a grid, confetti, and the light source.
+  The seed of each layer is drawn from `seed` (or, if it is None, from a new random seed).'''
+  seeds = random.Random(seed)
+  scene = PainScene(QtCore.QRectF(QtCore.QPointF(0,0), QtCore.QSizeF(size)))
+  scene.setBackgroundBrush(QtCore.Qt.black)
+  #scene.addRect(scene.sceneRect(), QtGui.QPen(QtCore.Qt.green, 3))
+
+  light = LightSource()
+  light.setData(0, 'Light Source')
+  scene.setLight(light)
+
+  grid = Grid(seed=seeds.getrandbits(64))
+  grid.setData(0, 'Grid')
+  scene.addItem(grid)
+  #QtWidgets.QGraphicsEllipseItem(400,300, 800,600, grid) # test child items are not layers
+
+  confetti = Confetti(seed=seeds.getrandbits(64))
+  confetti.setData(0, 'Confetti')
+  scene.addItem(confetti)
+
+  scene.addItem(scene.light)
+  return scene
+
+def layerKind(item):
+  'Return the kind of layer (see LAYER_KINDS) that QGraphicsItem `item` is, or None if it is none of them.'
+  for (kind, cls) in LAYER_KINDS.items():
+    if isinstance(item, cls):
+      return kind
+  return None
+
+def stackedLayers(scene):
+  'Return a list of (kind, item) of each top-level item of `scene`, bottom first (see layerKind()).'
+  return [ (layerKind(item), item) for item in scene.items(QtCore.Qt.AscendingOrder) if item.parentItem() is None ]
+
+def sceneLayers(scene):
+  '''Return a dict of the scene, by the name "scene", and of each of its layers, by its kind, numbered from
+  the bottom up after the first of each kind:  "light", "grid", "grid2", ..., "confetti", "confetti2", ....'''
+  layers = { 'scene': scene }
+  counts = {}
+  for (kind, item) in stackedLayers(scene):
+    if not kind is None:
+      counts[kind] = counts.get(kind, 0) + 1
+      layers[kind if counts[kind] == 1 else '{}{}'.format(kind, counts[kind])] = item
+  return layers
+
+def arrangeLayers(scene, kinds):
+  '''Make the layers of `scene`, a scene made by buildScene(), be of the list of `kinds`, bottom first:
+  keeping its layers of each kind in order, adding any more that are needed, removing any left over
+  (but its light source, of which there is only ever the one), and stacking them in order.
+  Return the list of its layers, in order.'''
+  unused = {}
+  for (kind, item) in stackedLayers(scene):
+    unused.setdefault(kind, []).append(item)
+  layers = []
+  for kind in kinds:
+    if unused.get(kind):
+      item = unused[kind].pop(0)
+    elif kind == 'light':
+      raise ValueError('a scene has only one light source')
+    elif kind in LAYER_KINDS:
+      item = LAYER_KINDS[kind]()
+      item.setData(0, kind.capitalize())
+      scene.addItem(item)
+    else:
+      raise ValueError('no kind of layer "{}" (choose from {})'.format(kind, ', '.join(sorted(LAYER_KINDS))))
+    layers.append(item)
+  for kind in ('grid', 'confetti'):
+    for item in unused.get(kind, []):
+      scene.removeItem(item)
+  for i in reversed(range(len(layers) - 1)):
+    layers[i].stackBefore(layers[i+1])
+  return layers
+
+def paramSetter(obj, name, param):
+  'Return the setter of parameter `param` of `obj`, the layer named `name`, or raise ValueError naming the choices.'
+  method = getattr(obj, 'set' + param[:1].upper() + param[1:], None)
+  if method is None:
+    params = sorted( n[3].lower() + n[4:] for n in vars(type(obj)) if n.startswith('set') and n[3:4].isupper() )
+    raise ValueError('{} has no parameter "{}" (choose from {})'.format(name, param, ', '.join(params)))
+  return method
+
+def setter(layers, layer, param):
+  'Return the setter of parameter `param` of the layer named `layer`, or raise ValueError naming the choices.'
+  if not layer in layers:
+    raise ValueError('no layer "{}" (choose from {})'.format(layer, ', '.join(sorted(layers))))
+  return paramSetter(layers[layer], layer, param)
+
+def applySetting(layers, setting):
+  '''Apply a setting "layer.param=value" (as given to pain.py --set) by calling layer.setParam(value).
+  The value is a Python literal (a number, True or False), or else a string.'''
+  (name, sep, text) = setting.partition('=')
+  (layer, dot, param) = name.strip().partition('.')
+  if not sep or not dot or not param:
+    raise ValueError('expected LAYER.PARAM=VALUE, not "{}"'.format(setting))
+  method = setter(layers, layer, param)
+  try:
+    value = ast.literal_eval(text.strip())
+  except (ValueError, SyntaxError):
+    value = text.strip()
+  method(value)
+
+def sceneSpec(scene):
+  '''Return the spec of `scene`, a scene made by buildScene() (and perhaps given more layers or fewer since),
+  or raise ValueError if it has an item that isn't a kind of layer.'''
+  r = scene.sceneRect()
+  layers = []
+  for (kind, item) in stackedLayers(scene):
+    if kind is None:
+      raise ValueError('the scene has an item that is not a layer ({})'.format(type(item).__name__))
+    layers.append({ 'kind': kind, 'params': item.spec() })
+  return { 'version': SPEC_VERSION
+         , 'size': [round(r.width()), round(r.height())]
+         , 'scene': scene.spec()
+         , 'layers': layers
+         }
+
+def upgradeSpec(spec):
+  '''Return `spec` in the current version:  as it is, or if it is a version 1 spec (which could only describe
+  the layers buildScene() makes, by name), as the same scene.'''
+  if spec.get('version') == 1:
+    params = spec['layers']
+    return { 'version': SPEC_VERSION
+           , 'size': spec['size']
+           , 'scene': params.get('scene', {})
+           , 'layers': [ { 'kind': kind, 'params': params.get(kind, {}) } for kind in ('grid', 'confetti', 'light') ]
+           }
+  if spec.get('version') != SPEC_VERSION:
+    raise ValueError('not a version {} scene spec'.format(SPEC_VERSION))
+  return spec
+
+def applySpec(scene, spec):
+  'Make `scene`, a scene made by buildScene(), as described by `spec` (see sceneSpec()).'
+  spec = upgradeSpec(spec)
+  (w, h) = spec['size']
+  scene.setWidth(w)
+  scene.setHeight(h)
+  layers = arrangeLayers(scene, [ layer['kind'] for layer in spec['layers'] ])
+  for (param, value) in spec['scene'].items():
+    paramSetter(scene, 'scene', param)(value)
+  for (item, layer) in zip(layers, spec['layers']):
+    for (param, value) in layer['params'].items():
+      paramSetter(item, layer['kind'], param)(value)
+
+def sceneFromSpec(spec):
+  'Return a new scene built as described by `spec` (see sceneSpec()).'
+  scene = buildScene(QtCore.QSize(*spec['size']))
+  applySpec(scene, spec)
+  return scene
@@ -0,0 +1,121 @@
+
+import math
+
+import numpy as np
+from PyQt5 import QtCore, QtGui, sip
+
+
+class SpriteAtlas:
+
+  '''Shape templates pre-rasterized at a few sizes and in a palette of colors, all in one image,
+  so that any number of scaled, rotated, translucent copies can be painted with one drawPixmapFragments().
+  The atlas is kept as a QImage, which can be painted on any thread, and as a QPixmap made from it,
+  which can only be painted on the GUI thread (see paint()).
+
+  Each row of the atlas holds every template at every size in one color:  row 0 holds black silhouettes
+  without edges (for shadows), and row i holds palette color i-1, filled inside a black edge.
+  Sprites are centered on their template's origin, and have a circumradius of SIZES[s] pixels.
+  The tinted rows are made by multiplying one row of white sprites by each color.
+  '''
+
+  SIZES = (2, 4, 8, 16, 32)
+
+  def __init__(self, shapes, palette, edgeThickness):
+    self._palette = [ tuple(rgb) for rgb in palette ]
+    sizes = self.SIZES
+    # The edges are as thick as the shapes' edges in pixels, for sprites painted at about their own size.
+    pens = [ min(edgeThickness, r/2) for r in sizes ]
+    halves = [ math.ceil(r + pen/2 + 1) for (r, pen) in zip(sizes, pens) ]
+    self._cells = np.empty((len(shapes), len(sizes), 2))    # (left, half width) of the cell of each sprite
+    x = 0
+    for k in range(len(shapes)):
+      for s in range(len(sizes)):
+        self._cells[k,s] = (x, halves[s])
+        x += 2 * halves[s]
+    (width, height) = (x, 2 * max(halves))
+    self._row_height = height
+    silhouettes = QtGui.QImage(width, height, QtGui.QImage.Format_ARGB32_Premultiplied)
+    silhouettes.fill(QtCore.Qt.transparent)
+    sprites = QtGui.QImage(silhouettes)
+    for (img, edged) in ((silhouettes, False), (sprites, True)):
+      p = QtGui.QPainter(img)
+      p.setRenderHint(QtGui.QPainter.Antialiasing)
+      p.setBrush(QtCore.Qt.white if edged else QtCore.Qt.black)
+      for (k, shp) in enumerate(shapes):
+        outline = QtGui.QPainterPath()
+        shp.addTemplateToPath(outline)
+        for (s, r) in enumerate(sizes):
+          (left, half) = self._cells[k,s]
+          p.setPen(QtGui.QPen(QtCore.Qt.black, pens[s]) if edged and pens[s] else QtCore.Qt.NoPen)
+          xf = QtGui.QTransform.fromScale(r / shp._radius, r / shp._radius) * QtGui.QTransform.fromTranslate(left + half, height/2)
+          p.drawPath(xf.map(outline))
+      p.end()
+    atlas = QtGui.QImage(width, height * (1 + len(palette)), QtGui.QImage.Format_ARGB32_Premultiplied)
+    atlas.fill(QtCore.Qt.transparent)
+    p = QtGui.QPainter(atlas)
+    p.drawImage(0, 0, silhouettes)
+    for (i, rgb) in enumerate(self._palette):
+      y = (i + 1) * height
+      p.setCompositionMode(QtGui.QPainter.CompositionMode_SourceOver)
+      p.drawImage(0, y, sprites)
+      p.setCompositionMode(QtGui.QPainter.CompositionMode_Multiply)
+      p.fillRect(0, y, width, height, QtGui.QColor(*rgb))
+      p.setCompositionMode(QtGui.QPainter.CompositionMode_DestinationIn)   # (multiplying made it all opaque)
+      p.drawImage(0, y, sprites)
+    p.end()
+    self._image = atlas
+    self._pixmap = QtGui.QPixmap.fromImage(atlas)     # (so this must be made on the GUI thread)
+
+  def palette(self):
+    'Return the list of (r,g,b) colors of rows 1 and on.'
+    return list(self._palette)
+
+  def image(self):
+    return self._image
+
+  def pixmap(self):
+    return self._pixmap
+
+  def fragments(self, kinds, rows, xs, ys, radii, angles, opacities, scale=1.0):
+    '''Return an (n,10) array of the fields of QPainter.PixmapFragments painting sprites of templates `kinds`
+    from atlas `rows`, centered at `xs`,`ys`, with circumradii `radii`, rotated `angles` degrees,
+    and at `opacities`.  Each uses the sprite whose size is nearest its size in pixels, `scale` being
+    how much the painter magnifies.'''
+    sizes = np.array(self.SIZES)
+    s = np.rint(np.log2(np.maximum(radii * scale, sizes[0]) / sizes[0])).astype(int)
+    s = np.minimum(s, len(sizes) - 1)
+    cells = self._cells[kinds, s]
+    f = np.empty((len(kinds), 10))
+    f[:,0] = xs
+    f[:,1] = ys
+    f[:,2] = cells[:,0]                                             # sourceLeft
+    f[:,3] = rows * self._row_height + self._row_height/2 - cells[:,1] # sourceTop
+    f[:,4] = f[:,5] = cells[:,1] * 2                                # width, height
+    f[:,6] = f[:,7] = radii / sizes[s]                              # scaleX, scaleY
+    f[:,8] = angles
+    f[:,9] = opacities
+    return f
+
+  def paint(self, painter, fragments):
+    '''Paint the sprites described by the (n,10) array returned by fragments() (or a concatenation of them).
+    Off the GUI thread (e.g. in a background render), where the pixmap mustn't be used, each sprite is
+    drawn from the image instead, as drawPixmapFragments() would draw it (which takes about twice as long).'''
+    if not len(fragments):
+      return
+    if QtCore.QThread.currentThread() != QtCore.QCoreApplication.instance().thread():
+      self.paintFromImage(painter, fragments)
+      return
+    array = sip.array(QtGui.QPainter.PixmapFragment, len(fragments))
+    # A PixmapFragment is just its 10 qreal fields, in the order fragments() returns them.
+    np.frombuffer(array, dtype=np.float64).reshape(-1, 10)[:] = fragments
+    painter.drawPixmapFragments(array, self._pixmap)
+
+  def paintFromImage(self, painter, fragments):
+    'Paint the sprites described by `fragments` one by one from the QImage of the atlas.'
+    painter.save()
+    (xf, opacity) = (painter.worldTransform(), painter.opacity())
+    for (x, y, left, top, w, h, sx, sy, angle, alpha) in fragments.tolist():
+      painter.setWorldTransform(QtGui.QTransform().translate(x, y).rotate(angle).scale(sx, sy) * xf)
+      painter.setOpacity(opacity * alpha)
+      painter.drawImage(QtCore.QRectF(-w/2, -h/2, w, h), self._image, QtCore.QRectF(left, top, w, h))
+    painter.restore()
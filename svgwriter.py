@@ -0,0 +1,191 @@
+
+import time
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+
+'''
+Writing a QGraphicsScene of this application's items straight to an SVG file.
+
+QSvgGenerator writes whatever a QPainter paints, one element per drawing call, with every gradient
+spelled out as dozens of stops (and sometimes as embedded raster images), and nothing shared.
+Instead, each item with a writeSvg(writer) method writes its own elements:  Confetti defines each
+template shape once and places every shape with a <use> of it, and gradients that are the same
+are defined only once.  Output is streamed to the file as it is made.
+
+Definitions are written in a <defs> block just before the first element that uses them.
+'''
+
+
+def num(x):
+  'Format a number compactly, to 1/1000.'
+  s = '%.3f' % x
+  s = s.rstrip('0').rstrip('.')
+  return '0' if s == '-0' else s
+
+def matrix(xf):
+  'Return an SVG transform attribute value for QTransform `xf`.'
+  return 'matrix({} {} {} {} {} {})'.format(*map(num, (xf.m11(), xf.m12(), xf.m21(), xf.m22(), xf.dx(), xf.dy())))
+
+def color(c):
+  'Return the (#rrggbb, opacity) of QColor `c`.'
+  return ('#{:02x}{:02x}{:02x}'.format(c.red(), c.green(), c.blue()), c.alpha() / 255)
+
+def pathData(path):
+  'Return the SVG path data of QPainterPath `path`.'
+  d = []
+  i = 0
+  while i < path.elementCount():
+    e = path.elementAt(i)
+    if e.type == QtGui.QPainterPath.MoveToElement:
+      d.append('M{} {}'.format(num(e.x), num(e.y)))
+    elif e.type == QtGui.QPainterPath.LineToElement:
+      d.append('L{} {}'.format(num(e.x), num(e.y)))
+    else:   # a CurveToElement, followed by two CurveToDataElements
+      (c2, end) = (path.elementAt(i+1), path.elementAt(i+2))
+      d.append('C{} {} {} {} {} {}'.format(*map(num, (e.x, e.y, c2.x, c2.y, end.x, end.y))))
+      i += 2
+    i += 1
+  return ''.join(d)
+
+def penAttributes(pen):
+  'Return the SVG stroke attributes of QPen (or Qt.PenStyle) `pen`.'
+  pen = QtGui.QPen(pen)
+  if pen.style() == QtCore.Qt.NoPen:
+    return 'stroke="none"'
+  (rgb, opacity) = color(pen.color())
+  caps = { QtCore.Qt.FlatCap: 'butt', QtCore.Qt.SquareCap: 'square', QtCore.Qt.RoundCap: 'round' }
+  joins = { QtCore.Qt.MiterJoin: 'miter', QtCore.Qt.BevelJoin: 'bevel', QtCore.Qt.RoundJoin: 'round' }
+  attrs = 'stroke="{}" stroke-width="{}" stroke-linecap="{}" stroke-linejoin="{}"'.format(
+    rgb, num(pen.widthF() or 1), caps.get(pen.capStyle(), 'square'), joins.get(pen.joinStyle(), 'bevel'))
+  if opacity < 1:
+    attrs += ' stroke-opacity="{}"'.format(num(opacity))
+  return attrs
+
+
+class SvgWriter:
+
+  '''Writes an SVG document to a file, element by element.
+
+  define() gives an id to a definition (a gradient, a template shape, a clip path),
+  defining it only the first time it is given.'''
+
+  def __init__(self, file, rect, title=None, description=None):
+    '`rect` is the QRectF of user space shown, one unit per pixel.'
+    self._file = file
+    self._ids = {}          # definition text -> id
+    self._pending = []      # definitions not yet written
+    self._depth = 0
+    size = rect.toAlignedRect().size()
+    self._file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+      '<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" version="1.1"'
+      ' width="{}" height="{}" viewBox="{} {} {} {}">\n'.format(size.width(), size.height()
+      , num(rect.left()), num(rect.top()), num(rect.width()), num(rect.height())))
+    if title:
+      self._file.write('<title>{}</title>\n'.format(title))
+    if description:
+      self._file.write('<desc>{}</desc>\n'.format(description))
+
+  def define(self, text, prefix='d'):
+    '''Return the id of the definition `text`, an element with "{id}" where its id attribute's value goes.
+    It is written just before whatever is next written.'''
+    id = self._ids.get(text)
+    if id is None:
+      id = self._ids[text] = '{}{}'.format(prefix, len(self._ids))
+      self._pending.append(text.format(id=id))
+    return id
+
+  def write(self, text):
+    'Write `text`, the markup of one or more elements.'
+    if self._pending:
+      self._file.write('<defs>\n{}\n</defs>\n'.format('\n'.join(self._pending)))
+      self._pending = []
+    self._file.write(text)
+
+  def beginGroup(self, xf=None, opacity=1.0, clip=None, attributes=''):
+    '''Begin a <g> transformed by QTransform `xf`, at `opacity`, clipped to QRectF `clip` (in the group's coordinates),
+    and with any other `attributes`.'''
+    attrs = [attributes] if attributes else []
+    if not xf is None and not xf.isIdentity():
+      attrs.append('transform="{}"'.format(matrix(xf)))
+    if opacity < 1:
+      attrs.append('opacity="{}"'.format(num(opacity)))
+    if not clip is None:
+      rect = '<rect x="{}" y="{}" width="{}" height="{}"/>'.format(*map(num, (clip.left(), clip.top(), clip.width(), clip.height())))
+      attrs.append('clip-path="url(#{})"'.format(self.define('<clipPath id="{id}">' + rect + '</clipPath>', 'clip')))
+    self.write('<g {}>\n'.format(' '.join(attrs)) if attrs else '<g>\n')
+    self._depth += 1
+
+  def endGroup(self):
+    self._depth -= 1
+    self.write('</g>\n')
+
+  def gradient(self, g, xf=None):
+    '''Return the id of a definition of QLinearGradient or QRadialGradient `g`, as seen through QTransform `xf`
+    (to define it in the coordinates of something painted through `xf` from the coordinates it was made in).'''
+    stops = g.stops()
+    if isinstance(g, QtGui.QRadialGradient):
+      # SVG 1.1 has no focal radius, but when the focus is the center, it just moves the stops out.
+      (r, fr) = (g.radius(), min(max(g.focalRadius(), 0), g.radius()))
+      if g.focalPoint() == g.center() and fr > 0:
+        stops = [ ((fr + t * (r - fr)) / r, c) for (t, c) in stops ]
+    if not xf is None:
+      # Define it where it was made, and map that through the inverse of `xf`.
+      inverse = xf.inverted()[0]
+      transform = ' gradientTransform="{}"'.format(matrix(inverse)) if not inverse.isIdentity() else ''
+    else:
+      transform = ''
+    stopText = ''.join( '<stop offset="{}" stop-color="{}"{}/>'.format(num(t), *((rgb, '') if a == 1 else
+                          (rgb, ' stop-opacity="{}"'.format(num(a)))))
+                        for (t, (rgb, a)) in ((t, color(c)) for (t, c) in stops) )
+    if isinstance(g, QtGui.QRadialGradient):
+      (c, f) = (g.center(), g.focalPoint())
+      text = ('<radialGradient id="{{id}}" gradientUnits="userSpaceOnUse" cx="{}" cy="{}" r="{}"{}{}>{}</radialGradient>'
+              .format(num(c.x()), num(c.y()), num(g.radius())
+                     , '' if f == c else ' fx="{}" fy="{}"'.format(num(f.x()), num(f.y())), transform, stopText))
+    else:
+      (a, b) = (g.start(), g.finalStop())
+      text = ('<linearGradient id="{{id}}" gradientUnits="userSpaceOnUse" x1="{}" y1="{}" x2="{}" y2="{}"{}>{}</linearGradient>'
+              .format(num(a.x()), num(a.y()), num(b.x()), num(b.y()), transform, stopText))
+    return self.define(text, 'g')
+
+  def fillAttributes(self, brush, xf=None):
+    'Return the SVG fill attributes of QBrush `brush` (painted through QTransform `xf`, if any).'
+    brush = QtGui.QBrush(brush)
+    if brush.style() == QtCore.Qt.NoBrush:
+      return 'fill="none"'
+    if brush.gradient() is not None and brush.style() in (QtCore.Qt.LinearGradientPattern, QtCore.Qt.RadialGradientPattern):
+      g = brush.gradient()
+      g = QtGui.QRadialGradient(g) if g.type() == QtGui.QGradient.RadialGradient else QtGui.QLinearGradient(g)
+      return 'fill="url(#{})"'.format(self.gradient(g, xf))
+    (rgb, opacity) = color(brush.color())
+    return 'fill="{}"'.format(rgb) + ('' if opacity == 1 else ' fill-opacity="{}"'.format(num(opacity)))
+
+  def close(self):
+    while self._depth:
+      self.endGroup()
+    self.write('</svg>\n')
+
+
+def writeScene(scene, filename, title=None, description=None):
+  '''Write all of `scene`'s sceneRect to the SVG file `filename`:  its background brush,
+  and each visible item with a writeSvg(writer) method, in stacking order.'''
+  rect = scene.sceneRect()
+  t0 = time.perf_counter()
+  with open(filename, 'w', encoding='utf-8') as f:
+    svg = SvgWriter(f, rect, title, description)
+    brush = scene.backgroundBrush()
+    if brush.style() != QtCore.Qt.NoBrush:
+      svg.write('<rect x="{}" y="{}" width="{}" height="{}" {}/>\n'.format(*map(num, (rect.left(), rect.top(), rect.width(), rect.height()))
+                                                                          , svg.fillAttributes(brush)))
+    for (i, item) in enumerate(scene.items(QtCore.Qt.AscendingOrder)):
+      if not item.isVisible() or item.parentItem() is not None:
+        continue
+      if not hasattr(item, 'writeSvg'):
+        print('writeScene: skipping {}, which cannot write SVG'.format(item.data(0) or type(item).__name__))
+        continue
+      svg.beginGroup(item.sceneTransform(), item.effectiveOpacity(), attributes='id="layer{}"'.format(i))
+      item.writeSvg(svg)
+      svg.endGroup()
+    svg.close()
+  print('writeScene: {} in {:.3f} s'.format(filename, time.perf_counter() - t0))
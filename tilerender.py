@@ -0,0 +1,87 @@
+
+import concurrent.futures
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+
+'''
+Rendering a whole QGraphicsScene to an image, split into tiles which are painted concurrently.
+
+QPainter on a QImage may be used from any thread, and PyQt releases the GIL while Qt is busy
+rasterizing, so tiles really do render in parallel.  QGraphicsScene.render() itself is not safe
+to call from several threads (it lazily updates the scene's item index), so instead each tile
+paints the background and each visible item itself, in stacking order, just as render() would.
+Items with a preparePaint() method have it called first, on the calling thread, so that their
+paint() only reads cached state.
+
+Tiles are full-width horizontal bands by default, because items that don't cull to the exposed
+rect pay their whole per-item cost in every tile.  The tiling doesn't depend on the number of
+threads, so the result is byte for byte the same however many threads are used (including one).
+It can differ slightly from painting the whole image at once, in the antialiasing of long
+cosmetic strokes and slivers, because Qt clips those to the bounds of the image being painted.
+'''
+
+TILE_HEIGHT = 512
+
+def idealThreadCount():
+  return max(1, QtCore.QThread.idealThreadCount())
+
+def sceneTiles(rect, tileWidth, tileHeight):
+  'Return a list of QRects covering the integer QRect `rect`, in rows from the top left.'
+  tiles = []
+  for y in range(rect.top(), rect.top() + rect.height(), tileHeight):
+    for x in range(rect.left(), rect.left() + rect.width(), tileWidth):
+      tiles.append(QtCore.QRect(x, y, tileWidth, tileHeight).intersected(rect))
+  return tiles
+
+def renderTile(scene, tile, antialias=True, imageFormat=QtGui.QImage.Format_ARGB32):
+  'Render the part of `scene` within the integer QRect `tile` (in scene coordinates) into a new QImage.'
+  img = QtGui.QImage(tile.size(), imageFormat)
+  img.fill(QtCore.Qt.transparent)
+  rect = QtCore.QRectF(tile)
+  painter = QtGui.QPainter(img)
+  painter.setRenderHint(QtGui.QPainter.Antialiasing, antialias)
+  painter.translate(-tile.left(), -tile.top())
+  painter.setClipRect(rect)
+  scene.drawBackground(painter, rect)
+  option = QtWidgets.QStyleOptionGraphicsItem()
+  for item in scene.items(QtCore.Qt.AscendingOrder):
+    if not item.isVisible():
+      continue
+    xf = item.sceneTransform()
+    (inverse, invertible) = xf.inverted()
+    if not invertible:
+      continue
+    exposed = inverse.mapRect(rect).intersected(item.boundingRect())
+    if exposed.isEmpty():
+      continue
+    painter.save()
+    painter.setTransform(xf, True)
+    painter.setOpacity(item.effectiveOpacity())
+    option.exposedRect = exposed
+    item.paint(painter, option, None)
+    painter.restore()
+  scene.drawForeground(painter, rect)
+  painter.end()
+  return img
+
+def renderScene(scene, threads=None, tileWidth=None, tileHeight=TILE_HEIGHT, antialias=True, imageFormat=QtGui.QImage.Format_ARGB32):
+  'Render all of `scene`\'s sceneRect into a new QImage, painting tiles on a pool of `threads` threads.'
+  rect = scene.sceneRect().toAlignedRect()
+  if threads is None:
+    threads = idealThreadCount()
+  if tileWidth is None:
+    tileWidth = rect.width()
+  for item in scene.items():
+    if item.isVisible() and hasattr(item, 'preparePaint'):
+      item.preparePaint()
+  tiles = sceneTiles(rect, tileWidth, tileHeight)
+  with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+    images = list(pool.map(lambda tile: renderTile(scene, tile, antialias, imageFormat), tiles))
+  result = QtGui.QImage(rect.size(), imageFormat)
+  painter = QtGui.QPainter(result)
+  painter.setCompositionMode(QtGui.QPainter.CompositionMode_Source)
+  for (tile, img) in zip(tiles, images):
+    painter.drawImage(tile.topLeft() - rect.topLeft(), img)
+  painter.end()
+  return result